@@ -0,0 +1,77 @@
+"""Benchmarks for the preparation of calculations."""
+
+import pytest
+from aiida.engine.utils import instantiate_process
+from aiida.manage.manager import get_manager
+from aiida.orm import FolderData, List
+from aiida.plugins import CalculationFactory, DataFactory
+
+SnapshotSet = DataFactory("mala.snapshot_set")
+TestNetworkCalculation = CalculationFactory("mala.test_network")
+TrainNetworkCalculation = CalculationFactory("mala.train_network")
+
+NUM_SNAPSHOTS = (10, 100, 1000, 10000)
+
+
+def get_snapshots(num_snapshots):
+    """Return the names of the given number of snapshots."""
+    return [f"Be_snapshot{index}" for index in range(num_snapshots)]
+
+
+def get_snapshot_set(snapshots):
+    """Return a ``SnapshotSet`` with an index of the given snapshots, without their files."""
+    snapshot_set = SnapshotSet()
+    snapshot_set.base.attributes.set(
+        "snapshots",
+        {
+            snapshot: {
+                kind: {"filename": f"{snapshot}{suffix}", "nbytes": 0, "sha256": "0" * 64}
+                for kind, suffix in (("descriptors", ".in.npy"), ("targets", ".out.npy"))
+            }
+            for snapshot in snapshots
+        },
+    )
+    return snapshot_set
+
+
+@pytest.mark.parametrize("num_snapshots", NUM_SNAPSHOTS)
+def bench_train_network_generate_input_file(measure, train_network_parameters, num_snapshots):
+    """Benchmark the generation of the training script."""
+    snapshots = get_snapshots(num_snapshots)
+    tr_snapshots = List(snapshots[: -max(1, num_snapshots // 10)])
+    va_snapshots = List(snapshots[-max(1, num_snapshots // 10) :])
+
+    measure(lambda: TrainNetworkCalculation._generate_input_file(train_network_parameters, tr_snapshots, va_snapshots))
+
+
+@pytest.mark.parametrize("num_snapshots", NUM_SNAPSHOTS)
+def bench_test_network_generate_input_file(measure, num_snapshots):
+    """Benchmark the generation of the testing script."""
+    te_snapshots = List(get_snapshots(num_snapshots))
+
+    measure(lambda: TestNetworkCalculation._generate_input_file(te_snapshots, ["band_energy"], "model.zip"))
+
+
+@pytest.mark.parametrize("source", ("input_data", "snapshot_set"))
+@pytest.mark.parametrize("num_snapshots", NUM_SNAPSHOTS)
+def bench_train_network_prepare_for_submission(
+    measure, fixture_sandbox, train_network_code, train_network_parameters, num_snapshots, source
+):
+    """Benchmark the creation of a training and the preparation of its submission."""
+    snapshots = get_snapshots(num_snapshots)
+    inputs = {
+        "code": train_network_code,
+        "parameters": train_network_parameters,
+        "tr_snapshots": List(snapshots[: -max(1, num_snapshots // 10)]),
+        "va_snapshots": List(snapshots[-max(1, num_snapshots // 10) :]),
+    }
+    if source == "snapshot_set":
+        inputs["snapshot_set"] = get_snapshot_set(snapshots).store()
+    else:
+        inputs["input_data"] = inputs["output_data"] = FolderData().store()
+
+    def prepare_for_submission():
+        process = instantiate_process(get_manager().get_runner(), TrainNetworkCalculation, **inputs)
+        return process.prepare_for_submission(fixture_sandbox)
+
+    measure(prepare_for_submission)
@@ -0,0 +1,12 @@
+"""Benchmarks for data types."""
+
+from aiida.plugins import DataFactory
+
+TrainNetworkParameters = DataFactory("mala.train_network")
+
+
+def bench_train_network_parameters(measure, train_network_parameters):
+    """Benchmark the validation of the training parameters."""
+    parameters = train_network_parameters.get_dict()
+
+    measure(lambda: TrainNetworkParameters(parameters), rounds=100)
@@ -0,0 +1,78 @@
+"""Benchmarks for parsers on large synthetic outputs."""
+
+import json
+
+import numpy as np
+import pytest
+from aiida.orm import List
+from aiida.plugins import ParserFactory
+
+# Number of tested snapshots and edge of the grid of their density, which add up to 128 MiB of arrays
+NUM_TEST_SNAPSHOTS = 16
+GRID_SIZE = 100
+# Length of the scalar observables, which add up to more than 30 MB of ``.json`` files
+OBSERVABLE_LENGTH = 100000
+MODEL_SIZE = 2**27
+NUM_EPOCHS = 10000
+
+
+@pytest.fixture(scope="module")
+def test_network_results(tmp_path_factory):
+    """Return a folder with the large results of a testing."""
+    folder = tmp_path_factory.mktemp("retrieved")
+    results = folder / "results"
+    results.mkdir()
+    rng = np.random.default_rng(0)
+    for index in range(NUM_TEST_SNAPSHOTS):
+        np.save(results / f"Be_snapshot{index}__density.npy", rng.random((GRID_SIZE,) * 3))
+        scalars = {"band_energy": rng.random(OBSERVABLE_LENGTH).tolist(), "number_of_electrons": 4.0}
+        (results / f"Be_snapshot{index}.json").write_text(json.dumps(scalars))
+    return folder
+
+
+@pytest.fixture(scope="module")
+def train_network_results(tmp_path_factory):
+    """Return the retrieved and temporary folders with the large outputs of a training."""
+    retrieved = tmp_path_factory.mktemp("retrieved")
+    (retrieved / "metrics.json").write_text(json.dumps({"final_validation_loss": 0.5}))
+    with open(retrieved / "epochs.jsonl", "w") as handle:
+        for epoch in range(NUM_EPOCHS):
+            metrics = {
+                "epoch": epoch,
+                "training_loss": 1 / (epoch + 1),
+                "validation_loss": 1 / (epoch + 1),
+                "epoch_time": 1.0,
+                "learning_rate": 1e-3,
+            }
+            handle.write(json.dumps(metrics) + "\n")
+
+    temporary = tmp_path_factory.mktemp("temporary")
+    (temporary / "model.zip").write_bytes(np.random.default_rng(0).bytes(MODEL_SIZE))
+    return retrieved, temporary
+
+
+def bench_test_network_parser(measure, generate_calc_job_node, test_network_results):
+    """Benchmark the parsing of the results of a testing."""
+    inputs = {"te_snapshots": List([f"Be_snapshot{index}" for index in range(NUM_TEST_SNAPSHOTS)])}
+    node = generate_calc_job_node("mala.test_network", test_network_results, inputs)
+    parser = ParserFactory("mala.test_network")
+
+    results, calcfunction = measure(lambda: parser.parse_from_node(node, store_provenance=False), rounds=3)
+
+    assert calcfunction.is_finished_ok
+    assert len(results["observable_arrays"].get_arraynames()) == NUM_TEST_SNAPSHOTS
+
+
+def bench_train_network_parser(measure, generate_calc_job_node, train_network_results):
+    """Benchmark the parsing of the model and the metrics of a training."""
+    retrieved, temporary = train_network_results
+    node = generate_calc_job_node("mala.train_network", retrieved, options={"model_name": "model"})
+    parser = ParserFactory("mala.train_network")
+
+    results, calcfunction = measure(
+        lambda: parser.parse_from_node(node, store_provenance=False, retrieved_temporary_folder=str(temporary)),
+        rounds=3,
+    )
+
+    assert calcfunction.is_finished_ok
+    assert len(results["training_metrics"].get_array("epoch")) == NUM_EPOCHS
@@ -0,0 +1,92 @@
+"""pytest fixtures for the benchmarks.
+
+The benchmarks are run with ``hatch run benchmark:run``, which times them with ``pytest-benchmark`` and saves the
+timings as the baseline of the machine. ``hatch run benchmark:compare`` fails for benchmarks that became slower than
+the last saved run. The peak memory of every benchmark is compared against ``memory_baseline.json``, which does not
+depend on the machine and is updated with ``--update-memory-baseline``.
+"""
+
+import json
+import pathlib
+import tracemalloc
+
+import pytest
+
+MEMORY_BASELINE = pathlib.Path(__file__).parent / "memory_baseline.json"
+# Relative and absolute increase of the peak memory over the baseline at which a benchmark fails
+MEMORY_TOLERANCE = 0.2
+MEMORY_SLACK = 2**20
+PEAK_MEMORY = pytest.StashKey[dict]()
+
+
+def pytest_addoption(parser):
+    """Add the option to update the memory baseline."""
+    parser.addoption(
+        "--update-memory-baseline",
+        action="store_true",
+        default=False,
+        help=f"Write the peak memory of the benchmarks to `{MEMORY_BASELINE.name}` instead of comparing against it.",
+    )
+
+
+def pytest_terminal_summary(terminalreporter, config):
+    """Report the peak memory of the benchmarks."""
+    peak_memory = config.stash.get(PEAK_MEMORY, {})
+    if not peak_memory:
+        return
+    terminalreporter.section("peak memory")
+    width = max(len(name) for name in peak_memory)
+    for name, (peak, baseline) in sorted(peak_memory.items()):
+        line = f"{name:<{width}}  {peak / 2**20:10.2f} MiB"
+        if baseline is not None:
+            line += f"  (baseline {baseline / 2**20:.2f} MiB, {peak / baseline - 1:+.1%})"
+        terminalreporter.write_line(line)
+
+
+@pytest.fixture(scope="session")
+def memory_baseline(request):
+    """Return the peak memory of the benchmarks in the baseline, and write it back if it is to be updated."""
+    baseline = json.loads(MEMORY_BASELINE.read_text()) if MEMORY_BASELINE.is_file() else {}
+    yield baseline
+    if request.config.getoption("update_memory_baseline"):
+        MEMORY_BASELINE.write_text(json.dumps(dict(sorted(baseline.items())), indent=2) + "\n")
+
+
+@pytest.fixture
+def measure(benchmark, request, memory_baseline):
+    """Return a function that benchmarks the time and the peak memory of a function.
+
+    The peak memory is traced in a separate call after a warm-up call, because tracing the allocations slows down the
+    timed calls.
+    """
+
+    def _measure(function, rounds=5):
+        """Benchmark the function and return its result.
+
+        :param function: the function to benchmark, which is called without arguments.
+        :param rounds: number of timed calls.
+        """
+        function()
+        tracemalloc.start()
+        try:
+            function()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        name = request.node.nodeid
+        baseline = memory_baseline.get(name, None)
+        benchmark.extra_info["peak_memory"] = peak
+        request.config.stash.setdefault(PEAK_MEMORY, {})[name] = (peak, baseline)
+
+        if request.config.getoption("update_memory_baseline"):
+            memory_baseline[name] = peak
+        elif baseline is not None and peak > baseline * (1 + MEMORY_TOLERANCE) + MEMORY_SLACK:
+            pytest.fail(
+                f"Peak memory of {peak} bytes exceeds the baseline of {baseline} bytes by more than "
+                f"{MEMORY_TOLERANCE:.0%}."
+            )
+
+        return benchmark.pedantic(function, rounds=rounds)
+
+    return _measure
@@ -14,3 +14,166 @@ def clear_database_auto(clear_database):  # pylint: disable=unused-argument
 def mala_code(aiida_local_code_factory):
     """Get a mala code."""
     return aiida_local_code_factory(executable="diff", entry_point="mala")
+
+
+@pytest.fixture(scope="function")
+def train_network_code(aiida_local_code_factory):
+    """Get a code for the ``mala.train_network`` calculation."""
+    return aiida_local_code_factory(executable="python", entry_point="mala.train_network")
+
+
+@pytest.fixture(scope="function")
+def test_network_code(aiida_local_code_factory):
+    """Get a code for the ``mala.test_network`` calculation."""
+    return aiida_local_code_factory(executable="python", entry_point="mala.test_network")
+
+
+@pytest.fixture(scope="function")
+def predict_code(aiida_local_code_factory):
+    """Get a code for the ``mala.predict`` calculation."""
+    return aiida_local_code_factory(executable="python", entry_point="mala.predict")
+
+
+@pytest.fixture(scope="function")
+def preprocess_code(aiida_local_code_factory):
+    """Get a code for the ``mala.preprocess`` calculation."""
+    return aiida_local_code_factory(executable="python", entry_point="mala.preprocess")
+
+
+@pytest.fixture(scope="function")
+def convert_snapshots_code(aiida_local_code_factory):
+    """Get a code for the ``mala.convert_snapshots`` calculation."""
+    return aiida_local_code_factory(executable="python", entry_point="mala.convert_snapshots")
+
+
+@pytest.fixture(scope="function")
+def packed_code(aiida_local_code_factory):
+    """Get a code for the ``mala.packed`` calculation."""
+    return aiida_local_code_factory(executable="python", entry_point="mala.packed")
+
+
+@pytest.fixture
+def fixture_sandbox():
+    """Return a `SandboxFolder`."""
+    from aiida.common.folders import SandboxFolder
+
+    with SandboxFolder() as folder:
+        yield folder
+
+
+@pytest.fixture
+def generate_calc_job():
+    """Fixture to construct a new `CalcJob` instance and call `prepare_for_submission` for testing `CalcJob` classes.
+
+    The fixture will return the `CalcInfo` returned by `prepare_for_submission` and the temporary folder that was passed
+    to it, into which the raw input files will have been written.
+    """
+
+    def _generate_calc_job(folder, entry_point_name, inputs=None):
+        """Fixture to generate a mock `CalcInfo` for testing calculation jobs."""
+        from aiida.engine.utils import instantiate_process
+        from aiida.manage.manager import get_manager
+        from aiida.plugins import CalculationFactory
+
+        manager = get_manager()
+        runner = manager.get_runner()
+
+        process_class = CalculationFactory(entry_point_name)
+        process = instantiate_process(runner, process_class, **inputs)
+
+        return process.prepare_for_submission(folder)
+
+    return _generate_calc_job
+
+
+@pytest.fixture
+def snapshot_folder(tmp_path):
+    """Return a folder with small MALA snapshots ``Be_snapshot0`` to ``Be_snapshot3``."""
+    import json
+
+    import numpy as np
+
+    for index in range(4):
+        np.save(tmp_path / f"Be_snapshot{index}.in.npy", np.zeros((2, 2, 2, 5)))
+        np.save(tmp_path / f"Be_snapshot{index}.out.npy", np.zeros((2, 2, 2, 3)))
+        (tmp_path / f"Be_snapshot{index}.info.json").write_text(json.dumps({"snapshot": index}))
+
+    return tmp_path
+
+
+@pytest.fixture
+def train_network_parameters():
+    """Return the parameters of a small MALA training."""
+    from aiida.plugins import DataFactory
+
+    parameters = {
+        "data": {
+            "input_rescaling_type": "feature-wise-standard",
+            "output_rescaling_type": "minmax",
+        },
+        "network": {
+            "layer_activations": ["ReLU"],
+        },
+        "running": {
+            "max_number_epochs": 100,
+            "mini_batch_size": 40,
+            "learning_rate": 0.00001,
+            "optimizer": "Adam",
+        },
+        "descriptors": {
+            "descriptor_type": "Bispectrum",
+            "bispectrum_twojmax": 10,
+            "bispectrum_cutoff": 4.67637,
+        },
+        "targets": {
+            "target_type": "LDOS",
+            "ldos_gridsize": 11,
+            "ldos_gridspacing_ev": 2.5,
+            "ldos_gridoffset_ev": -5,
+        },
+    }
+    return DataFactory("mala.train_network")(parameters)
+
+
+@pytest.fixture
+def generate_calc_job_node(aiida_localhost):
+    """Fixture to generate a stored `CalcJobNode` with a `retrieved` output for testing parsers."""
+
+    def _generate_calc_job_node(entry_point_name, retrieved_folder, inputs=None, options=None, input_files=None):
+        """Return a `CalcJobNode` of the given calculation whose `retrieved` folder contains the given files.
+
+        :param entry_point_name: entry point name of the calculation class.
+        :param retrieved_folder: path of the folder with the retrieved files.
+        :param inputs: optional dictionary of input nodes that are linked to the calculation.
+        :param options: optional dictionary of ``metadata.options`` of the calculation.
+        :param input_files: optional dictionary of the contents of the input files written by the calculation.
+        """
+        import io
+
+        from aiida import orm
+        from aiida.common import LinkType
+        from aiida.plugins.entry_point import format_entry_point_string
+
+        node = orm.CalcJobNode(
+            computer=aiida_localhost,
+            process_type=format_entry_point_string("aiida.calculations", entry_point_name),
+        )
+        node.set_option("resources", {"num_machines": 1, "num_mpiprocs_per_machine": 1})
+        for name, value in (options or {}).items():
+            node.set_option(name, value)
+        for filename, content in (input_files or {}).items():
+            node.base.repository.put_object_from_filelike(io.BytesIO(content.encode()), filename)
+
+        for link_label, input_node in (inputs or {}).items():
+            input_node.store()
+            node.base.links.add_incoming(input_node, link_type=LinkType.INPUT_CALC, link_label=link_label)
+
+        node.store()
+
+        retrieved = orm.FolderData(tree=retrieved_folder)
+        retrieved.base.links.add_incoming(node, link_type=LinkType.CREATE, link_label="retrieved")
+        retrieved.store()
+
+        return node
+
+    return _generate_calc_job_node
@@ -28,11 +28,8 @@ except NotExistent:
 builder = code.get_builder()
 
 
-FolderData = DataFactory("core.folder")
-input_data = FolderData(tree=data_path)
-builder.input_data = input_data
-output_data = FolderData(tree=data_path)
-builder.output_data = output_data
+SnapshotSet = DataFactory("mala.snapshot_set")
+builder.snapshot_set = SnapshotSet(folder=data_path, snapshots=["Be_snapshot2", "Be_snapshot3"])
 
 model = os.path.join(data_path, "Be_model.zip")
 builder.model = orm.SinglefileData(model)
@@ -56,11 +56,8 @@ parameters = {
 }
 builder.parameters = TrainNetworkParameters(parameters)
 
-FolderData = DataFactory("core.folder")
-input_data = FolderData(tree=data_path)
-builder.input_data = input_data
-output_data = FolderData(tree=data_path)
-builder.output_data = output_data
+SnapshotSet = DataFactory("mala.snapshot_set")
+builder.snapshot_set = SnapshotSet(folder=data_path, snapshots=["Be_snapshot0", "Be_snapshot1"])
 
 tr_snapshots = orm.List(["Be_snapshot0"])
 builder.tr_snapshots = tr_snapshots
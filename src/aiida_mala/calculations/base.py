@@ -0,0 +1,551 @@
+"""
+Base class for the calculations provided by aiida_mala.
+
+Collects the inputs and the logic shared by the calculations that operate on MALA snapshots.
+"""
+
+import hashlib
+import posixpath
+import textwrap
+
+from aiida import orm
+from aiida.common.hashing import chunked_file_hash
+from aiida.engine import CalcJob, CalcJobProcessSpec
+from aiida.engine.processes.calcjobs.calcjob import validate_calc_job
+from aiida.orm.nodes.process.calculation.calcjob import CalcJobNodeCaching
+from aiida.plugins import DataFactory
+from aiida_mala import worker
+from aiida_mala.data.snapshot_set import SNAPSHOT_FORMATS, read_npy_header
+
+SnapshotSet = DataFactory("mala.snapshot_set")
+
+SNAPSHOT_SELECTIONS = ("tr_snapshots", "va_snapshots", "te_snapshots", "snapshots")
+# Output label and filename of the profile written by each profiler
+PROFILERS = {
+    "cprofile": ("profile_stats", "profile.pstats"),
+    "torch": ("profile_trace", "profile_trace.json"),
+}
+
+
+def validate_profilers(value, _):
+    """Validate the ``profilers`` option."""
+    unknown = [profiler for profiler in value if profiler not in PROFILERS]
+    if unknown:
+        return f"Unknown profilers {unknown}, choose from {list(PROFILERS)}."
+    return None
+
+
+def validate_snapshot_format(value, _):
+    """Validate the ``snapshot_format`` option."""
+    if value not in SNAPSHOT_FORMATS:
+        return f"Unknown snapshot format `{value}`, choose from {list(SNAPSHOT_FORMATS)}."
+    return None
+
+
+def validate_inputs(value, ctx=None):
+    """Validate the top-level inputs namespace."""
+    result = validate_calc_job(value, ctx)
+    if result is not None:
+        return result
+
+    sources = [key for key in ("snapshot_set", "remote_data") if key in value]
+    if "input_data" in value or "output_data" in value:
+        sources.append("input_data")
+    if len(sources) != 1:
+        return "Specify exactly one of `snapshot_set`, `remote_data` or both `input_data` and `output_data`."
+
+    if "input_data" in sources and ("input_data" not in value or "output_data" not in value):
+        return "Specify both `input_data` and `output_data`."
+
+    options = value.get("metadata", {}).get("options", {})
+    if options.get("worker_socket", None) is not None and options.get("use_ddp", False):
+        return "A distributed training cannot be run by the `worker_socket`."
+
+    if "remote_data" in value:
+        computer = getattr(value.get("code", None), "computer", None)
+        if computer is not None and computer.uuid != value["remote_data"].computer.uuid:
+            return "The `remote_data` has to be located on the same computer as the `code`."
+
+    if "snapshot_set" in value:
+        snapshot_format = options.get("snapshot_format", None)
+        if snapshot_format is not None and snapshot_format != value["snapshot_set"].snapshot_format:
+            return (
+                f"The `snapshot_format` option `{snapshot_format}` does not match the format "
+                f"`{value['snapshot_set'].snapshot_format}` of the `snapshot_set`."
+            )
+
+    return validate_snapshot_selections(value, {key: value[key] for key in SNAPSHOT_SELECTIONS if key in value})
+
+
+def validate_snapshot_selections(value, selections):
+    """
+    Validate that the selected snapshots are available in the ``snapshot_set``, ``input_data`` and ``output_data``.
+
+    The files of the ``input_data`` and ``output_data`` are checked as well, so that a missing file fails before the
+    upload and the queue.
+
+    :param value: the top-level inputs namespace.
+    :param selections: dictionary of the ``List`` of the selected snapshots, keyed by the name of their input.
+    """
+    if "snapshot_set" in value:
+        for key, selection in selections.items():
+            missing = value["snapshot_set"].get_missing_snapshots(selection.get_list())
+            if missing:
+                return f"The snapshots {missing} of `{key}` are not part of the `snapshot_set`."
+
+    if "input_data" in value:
+        options = value.get("metadata", {}).get("options", {})
+        suffixes = SNAPSHOT_FORMATS[options.get("snapshot_format", None) or "numpy"]
+        for key, kind in (("input_data", "descriptors"), ("output_data", "targets")):
+            filenames = set(value[key].base.repository.list_object_names())
+            missing = [
+                f"{snapshot}{suffixes[kind]}"
+                for selection in selections.values()
+                for snapshot in selection.get_list()
+                if f"{snapshot}{suffixes[kind]}" not in filenames
+            ]
+            if missing:
+                return f"The files {missing} are missing from the `{key}`."
+
+    return None
+
+
+class SnapshotCalcJobNodeCaching(CalcJobNodeCaching):
+    """
+    Caching of the calculations that stage MALA snapshots from the repository.
+
+    The folders with the snapshots are left out of the hash. It covers the checksums of the staged snapshot files
+    instead, which the calculation records in its ``snapshot_checksums`` attribute, so that the hash neither reads the
+    whole folders nor changes with snapshots that the calculation does not use.
+    """
+
+    _hash_ignored_inputs = CalcJobNodeCaching._hash_ignored_inputs + ["input_data", "output_data", "snapshot_set"]
+
+
+class SnapshotCalcJobNode(orm.CalcJobNode):
+    """
+    Node of the calculations that stage MALA snapshots, which are hashed by ``SnapshotCalcJobNodeCaching``.
+
+    The class is registered as the ``process.calculation.calcjob.mala`` entry point of ``aiida.node``, so that the
+    stored nodes are loaded as this class and keep their hash.
+    """
+
+    _CLS_NODE_CACHING = SnapshotCalcJobNodeCaching
+
+
+class ModelCalculationMixin:
+    """
+    Mixin of the calculations that stage a trained ``model``, given as a file or as a folder on the remote computer.
+    """
+
+    def _get_model_filename(self):
+        """Return the filename of the ``model`` in the working directory."""
+        model = self.inputs.model  # type: ignore
+        if isinstance(model, orm.RemoteData):
+            return posixpath.basename(model.get_remote_path())
+        return model.filename
+
+    def _get_model_copy_lists(self):
+        """
+        Return the lists that stage the ``model`` in the working directory.
+
+        :return: tuple of the ``local_copy_list`` and ``remote_copy_list``.
+        """
+        model = self.inputs.model  # type: ignore
+        if isinstance(model, orm.RemoteData):
+            return [], [(model.computer.uuid, model.get_remote_path(), self._get_model_filename())]
+        return [(model.uuid, model.filename, model.filename)], []
+
+
+class BaseMalaCalculation(ModelCalculationMixin, CalcJob):
+    """
+    Base class for the calculations that stage MALA snapshots.
+    """
+
+    _node_class = SnapshotCalcJobNode
+
+    _DEFAULT_INPUT_FILE = "aiida.in"
+    # Kinds of the snapshot files staged from the input and output data, see ``SNAPSHOT_FORMATS``
+    _INPUT_DATA_KINDS = ("descriptors",)
+    _OUTPUT_DATA_KINDS = ("targets",)
+    _WORKER_FILE = "mala_worker.py"
+    _SNAPSHOT_CHECKSUMS_KEY = "snapshot_checksums"
+    _RESOURCE_ESTIMATE_KEY = "resource_estimate"
+    _TIMINGS_FILE = "timings.json"
+
+    @classmethod
+    def define(cls, spec: CalcJobProcessSpec):
+        """Define inputs and outputs of the calculation."""
+        super().define(spec)
+
+        spec.input("metadata.options.input_filename", valid_type=str, default=cls._DEFAULT_INPUT_FILE)
+        spec.input(
+            "metadata.options.symlink_remote_data",
+            valid_type=bool,
+            default=True,
+            help="Symlink the snapshots of `remote_data` into the working directory instead of copying them.",
+        )
+        spec.input(
+            "metadata.options.worker_socket",
+            valid_type=str,
+            required=False,
+            help="Path of the Unix socket of a warm worker on the remote computer, see `aiida_mala.worker`. The script "
+            "is run by the worker, which has MALA already imported, instead of a fresh interpreter. Without a "
+            "listening worker the script is run directly.",
+        )
+
+        spec.input(
+            "metadata.options.profilers",
+            valid_type=list,
+            required=False,
+            validator=validate_profilers,
+            help="Profile the script with `cprofile` and/or the CPU profiler of `torch`. Their profiles are output as "
+            "`profile_stats` and `profile_trace`.",
+        )
+
+        spec.input(
+            "metadata.options.snapshot_format",
+            valid_type=str,
+            required=False,
+            validator=validate_snapshot_format,
+            help="Storage format of the snapshots in `input_data`, `output_data` or `remote_data`, see "
+            "`SNAPSHOT_FORMATS`. Defaults to `numpy`, the format of a `snapshot_set` is taken from the set.",
+        )
+
+        spec.input(
+            "metadata.options.estimate_resources",
+            valid_type=bool,
+            default=False,
+            help="Set the `max_memory_kb` and `max_wallclock_seconds` options, unless they are given, from the "
+            "estimate of `estimate_resources`, which is recorded in the `resource_estimate` attribute.",
+        )
+
+        spec.input("input_data", valid_type=orm.FolderData, required=False, help="Specify the folder with input data.")
+        spec.input(
+            "output_data", valid_type=orm.FolderData, required=False, help="Specify the folder with output data."
+        )
+        spec.input(
+            "snapshot_set",
+            valid_type=SnapshotSet,
+            required=False,
+            help="Set of snapshots with the input and output data, from which the selected snapshots are staged.",
+        )
+        spec.input(
+            "remote_data",
+            valid_type=orm.RemoteData,
+            required=False,
+            help="Folder on the remote computer with the input and output data. The snapshots are staged from there "
+            "instead of being uploaded from the repository.",
+        )
+        spec.inputs.validator = validate_inputs
+
+        # set default values for AiiDA options
+        spec.inputs["metadata"]["options"]["resources"].default = {  # type: ignore
+            "num_machines": 1,
+            "num_mpiprocs_per_machine": 1,
+        }
+
+        spec.output(
+            "timings",
+            valid_type=orm.Dict,
+            required=False,
+            help="Wall time, number of calls and peak resident set size in bytes of every phase of the script.",
+        )
+
+        spec.output(
+            "profile_stats",
+            valid_type=orm.SinglefileData,
+            required=False,
+            help="Statistics of `cProfile`, which can be read with `pstats`, if the `cprofile` profiler is enabled.",
+        )
+        spec.output(
+            "profile_trace",
+            valid_type=orm.SinglefileData,
+            required=False,
+            help="Chrome trace of the CPU profiler of `torch`, if the `torch` profiler is enabled.",
+        )
+
+        spec.exit_code(
+            300,
+            "ERROR_MISSING_OUTPUT_FILES",
+            message="Calculation did not produce all expected output files.",
+        )
+
+    def _setup_db_record(self):
+        """
+        Record the checksums of the staged snapshots, which replace the snapshot folders in the hash of the node.
+
+        With the ``estimate_resources`` option the estimate of the resources is recorded as well, and sets the memory
+        and the wall time of the job unless they are given.
+        """
+        super()._setup_db_record()
+
+        if self.metadata.options.estimate_resources:  # type: ignore
+            estimate = self.estimate_resources(self.inputs)
+            if estimate is not None:
+                self.node.base.attributes.set(self._RESOURCE_ESTIMATE_KEY, estimate)
+                for option in ("max_memory_kb", "max_wallclock_seconds"):
+                    if self.node.get_option(option) is None:
+                        self.node.set_option(option, estimate[option])
+
+        # The files of ``remote_data`` cannot be checksummed without a transport, so it is hashed by its path instead
+        if "remote_data" in self.inputs:
+            return
+
+        snapshots = self._get_staged_snapshots()
+        self.node.base.attributes.set(self._SNAPSHOT_CHECKSUMS_KEY, self._get_snapshot_checksums(snapshots))
+
+    @classmethod
+    def estimate_resources(cls, inputs):
+        """
+        Estimate the peak memory and the wall time of the calculation from the shapes of its snapshots.
+
+        :param inputs: the inputs of the calculation, e.g. a ``ProcessBuilder``.
+        :returns: dictionary with the sizes of the snapshots and the estimated ``max_memory_kb`` and
+            ``max_wallclock_seconds``, or ``None`` if the calculation does not provide an estimate or the shapes of the
+            snapshots are not known, see ``aiida_mala.calculations.resources``.
+        """
+        return None
+
+    @staticmethod
+    def get_snapshot_headers(inputs, snapshots):
+        """
+        Return the shapes and dtypes of the descriptors and targets of the given snapshots, without loading them.
+
+        The headers are taken from the index of a ``snapshot_set``, or read from the ``.npy`` files of the
+        ``input_data`` and ``output_data``.
+
+        :param inputs: the inputs of the calculation, e.g. a ``ProcessBuilder``.
+        :param snapshots: names of the snapshots.
+        :returns: dictionary ``{snapshot: {kind: {"shape": ..., "dtype": ...}}}``, or ``None`` if the headers cannot be
+            read, i.e. for ``remote_data`` and for openPMD files without recorded shapes.
+        :raises FileNotFoundError: if a file of a snapshot is missing.
+        """
+        headers = {}
+        if "snapshot_set" in inputs:
+            index = inputs["snapshot_set"].get_index()
+            for snapshot in snapshots:
+                headers[snapshot] = {kind: index[snapshot][kind] for kind in ("descriptors", "targets")}
+                if any("shape" not in header for header in headers[snapshot].values()):
+                    return None
+            return headers
+
+        options = inputs.get("metadata", {}).get("options", {})
+        if "input_data" not in inputs or (options.get("snapshot_format", None) or "numpy") != "numpy":
+            return None
+
+        suffixes = SNAPSHOT_FORMATS["numpy"]
+        for snapshot in snapshots:
+            headers[snapshot] = {}
+            for key, kind in (("input_data", "descriptors"), ("output_data", "targets")):
+                with inputs[key].base.repository.open(f"{snapshot}{suffixes[kind]}", "rb") as handle:
+                    headers[snapshot][kind] = read_npy_header(handle)
+        return headers
+
+    def _get_staged_snapshots(self):
+        """Return the names of the snapshots the calculation stages."""
+        return [
+            snapshot for key in SNAPSHOT_SELECTIONS if key in self.inputs for snapshot in self.inputs[key].get_list()
+        ]
+
+    def _get_snapshot_checksums(self, snapshots):
+        """
+        Return the SHA-256 checksums of the files of the given snapshots, keyed by their filename.
+
+        The checksums of a ``snapshot_set`` are taken from its index, those of ``input_data`` and ``output_data`` are
+        computed from the staged files only. Missing files get a checksum of ``None``, the required ones fail at the
+        upload.
+
+        :param snapshots: names of the snapshots to stage.
+        """
+        checksums = {}
+        if "snapshot_set" in self.inputs:
+            index = self.inputs.snapshot_set.get_index()  # type: ignore
+            for snapshot in snapshots:
+                for entry in index.get(snapshot, {}).values():
+                    checksums[entry["filename"]] = entry["sha256"]
+            return checksums
+
+        folders = [
+            (self.inputs.input_data, self._get_snapshot_suffixes(self._INPUT_DATA_KINDS)),  # type: ignore
+            (self.inputs.output_data, self._get_snapshot_suffixes(self._OUTPUT_DATA_KINDS)),  # type: ignore
+        ]
+        for folder, suffixes in folders:
+            for snapshot in snapshots:
+                for suffix in suffixes:
+                    filename = f"{snapshot}{suffix}"
+                    try:
+                        with folder.base.repository.open(filename, "rb") as handle:
+                            checksums[filename] = chunked_file_hash(handle, hashlib.sha256)
+                    except FileNotFoundError:
+                        checksums[filename] = None
+        return checksums
+
+    def _get_snapshot_format(self):
+        """Return the storage format of the staged snapshots."""
+        if "snapshot_set" in self.inputs:
+            return self.inputs.snapshot_set.snapshot_format  # type: ignore
+        return self.metadata.options.get("snapshot_format", None) or "numpy"  # type: ignore
+
+    def _get_snapshot_suffixes(self, kinds):
+        """Return the suffixes of the snapshot files of the given kinds in the format of the staged snapshots."""
+        suffixes = SNAPSHOT_FORMATS[self._get_snapshot_format()]
+        return tuple(suffixes[kind] for kind in kinds)
+
+    def _get_cmdline_params(self, folder):
+        """
+        Return the command line parameters of the code, which run the input file directly or through the worker.
+
+        :param folder: the folder with the input files, into which the client of the worker is written if needed.
+        """
+        input_filename = self.metadata.options.input_filename  # type: ignore
+        worker_socket = self.metadata.options.get("worker_socket", None)  # type: ignore
+        if worker_socket is None:
+            return [input_filename]
+
+        folder.insert_path(worker.__file__, self._WORKER_FILE)
+        return [self._WORKER_FILE, "run", "--socket", worker_socket, input_filename]
+
+    def _get_profilers(self):
+        """Return the names of the enabled profilers."""
+        return self.metadata.options.get("profilers", None) or []  # type: ignore
+
+    def _get_profile_filenames(self):
+        """Return the filenames of the profiles written by the enabled profilers."""
+        return [PROFILERS[profiler][1] for profiler in self._get_profilers()]
+
+    @classmethod
+    def _generate_profiled_script(cls, input_file, profilers):
+        """
+        Wrap the script in the given profilers, which write their profiles when the script finishes or fails.
+
+        :param input_file: the content of the script.
+        :param profilers: names of the profilers, see ``PROFILERS``.
+        """
+        if not profilers:
+            return input_file
+
+        wrapped = ""
+        wrapped += "import os\n"
+        if "torch" in profilers:
+            wrapped += "import torch.profiler\n"
+            wrapped += "torch_profiler = torch.profiler.profile(activities=[torch.profiler.ProfilerActivity.CPU])\n"
+            wrapped += "torch_profiler.start()\n"
+        if "cprofile" in profilers:
+            wrapped += "import cProfile\n"
+            wrapped += "cprofile = cProfile.Profile()\n"
+            wrapped += "cprofile.enable()\n"
+        wrapped += "try:\n"
+        wrapped += textwrap.indent(input_file, "  ")
+        wrapped += "finally:\n"
+        if "cprofile" in profilers:
+            wrapped += "  cprofile.disable()\n"
+        if "torch" in profilers:
+            wrapped += "  torch_profiler.stop()\n"
+        # Only the first rank of a distributed training writes its profiles
+        wrapped += "  if int(os.environ.get('RANK', 0)) == 0:\n"
+        if "cprofile" in profilers:
+            wrapped += f"    cprofile.dump_stats('{PROFILERS['cprofile'][1]}')\n"
+        if "torch" in profilers:
+            wrapped += f"    torch_profiler.export_chrome_trace('{PROFILERS['torch'][1]}')\n"
+
+        return wrapped
+
+    @classmethod
+    def _generate_phase_timer(cls):
+        """
+        Create the lines that define the ``phase`` context manager, which records the timings of a phase of the script.
+
+        The wall time and the number of calls of every phase are accumulated, together with the peak resident set size
+        of the process at its end. They are written to the timings file after every phase, so that the timings of the
+        finished phases are kept if the script fails.
+        """
+        input_file = ""
+        input_file += "import resource\n"
+        input_file += "timings = {}\n"
+        input_file += "class phase:\n"
+        input_file += "  def __init__(self, name):\n"
+        input_file += "    self.name = name\n"
+        input_file += "  def __enter__(self):\n"
+        input_file += "    self.start = time.time()\n"
+        input_file += "  def __exit__(self, *exc_info):\n"
+        input_file += "    timing = timings.setdefault(self.name, {'wall_time': 0.0, 'calls': 0, 'peak_rss': 0})\n"
+        input_file += "    timing['wall_time'] += time.time() - self.start\n"
+        input_file += "    timing['calls'] += 1\n"
+        # ``ru_maxrss`` is given in KiB on Linux
+        input_file += "    timing['peak_rss'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024\n"
+        input_file += "    if int(os.environ.get('RANK', 0)) == 0:\n"
+        input_file += f"      with open('{cls._TIMINGS_FILE}.tmp', 'w') as file:\n"
+        input_file += "        file.write(json.dumps(timings))\n"
+        input_file += f"      os.replace('{cls._TIMINGS_FILE}.tmp', '{cls._TIMINGS_FILE}')\n"
+
+        return input_file
+
+    def _get_snapshot_copy_lists(self, snapshots, output_kinds=None):
+        """
+        Return the lists that stage the files of the given snapshots in the working directory.
+
+        The information files are optional, they are only staged for the snapshots that have one in the index of the
+        ``snapshot_set`` or in the ``output_data``. The files of ``remote_data`` cannot be listed, so they are all
+        staged.
+
+        :param snapshots: names of the snapshots to stage.
+        :param output_kinds: kinds of the files staged from the output data, defaults to ``_OUTPUT_DATA_KINDS``.
+        :return: tuple of the ``local_copy_list``, ``remote_copy_list`` and ``remote_symlink_list``.
+        """
+        local_copy_list = []
+        remote_copy_list = []
+        remote_symlink_list = []
+        suffixes = SNAPSHOT_FORMATS[self._get_snapshot_format()]
+        input_kinds = self._INPUT_DATA_KINDS
+        output_kinds = output_kinds or self._OUTPUT_DATA_KINDS
+
+        if "remote_data" in self.inputs:
+            remote_data = self.inputs.remote_data  # type: ignore
+            symlink = self.metadata.options.symlink_remote_data  # type: ignore
+            remote_list = remote_symlink_list if symlink else remote_copy_list
+            for snapshot in snapshots:
+                for kind in input_kinds + output_kinds:
+                    remote_list.append(
+                        (
+                            remote_data.computer.uuid,
+                            posixpath.join(remote_data.get_remote_path(), f"{snapshot}{suffixes[kind]}"),
+                            f"{snapshot}{suffixes[kind]}",
+                        )
+                    )
+        elif "snapshot_set" in self.inputs:
+            index = self.inputs.snapshot_set.get_index()  # type: ignore
+            for snapshot in snapshots:
+                for kind in input_kinds + output_kinds:
+                    if kind == "info" and kind not in index.get(snapshot, {}):
+                        continue
+                    local_copy_list.append(
+                        (
+                            self.inputs.snapshot_set.uuid,  # type: ignore
+                            f"{snapshot}{suffixes[kind]}",
+                            f"{snapshot}{suffixes[kind]}",
+                        )
+                    )
+        else:
+            output_filenames = set(self.inputs.output_data.base.repository.list_object_names())  # type: ignore
+            for snapshot in snapshots:
+                for kind in input_kinds:
+                    local_copy_list.append(
+                        (
+                            self.inputs.input_data.uuid,  # type: ignore
+                            f"{snapshot}{suffixes[kind]}",
+                            f"{snapshot}{suffixes[kind]}",
+                        )
+                    )
+                for kind in output_kinds:
+                    if kind == "info" and f"{snapshot}{suffixes[kind]}" not in output_filenames:
+                        continue
+                    local_copy_list.append(
+                        (
+                            self.inputs.output_data.uuid,  # type: ignore
+                            f"{snapshot}{suffixes[kind]}",
+                            f"{snapshot}{suffixes[kind]}",
+                        )
+                    )
+
+        return local_copy_list, remote_copy_list, remote_symlink_list
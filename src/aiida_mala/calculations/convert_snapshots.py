@@ -0,0 +1,179 @@
+"""
+Calculations provided by aiida_mala.
+
+Register calculations via the "aiida.calculations" entry point in setup.json.
+"""
+
+from aiida import orm
+from aiida.common import datastructures
+from aiida.engine import CalcJobProcessSpec
+from aiida.plugins import DataFactory
+from aiida_mala.calculations.base import BaseMalaCalculation, validate_inputs
+from aiida_mala.data.snapshot_set import SNAPSHOT_FORMATS
+
+PreprocessParameters = DataFactory("mala.preprocess")
+
+# Floating point types the snapshots can be converted to
+DTYPES = ("float32", "float64")
+
+
+def validate_dtype(value, _):
+    """Validate the ``dtype`` input."""
+    if value is not None and value.value not in DTYPES:
+        return f"Unknown dtype `{value.value}`, choose from {list(DTYPES)}."
+    return None
+
+
+def validate_convert_inputs(value, ctx=None):
+    """Validate the top-level inputs namespace."""
+    snapshot_format = value.get("metadata", {}).get("options", {}).get("snapshot_format", None)
+    if "snapshot_set" in value:
+        snapshot_format = value["snapshot_set"].snapshot_format
+    if snapshot_format not in (None, "numpy"):
+        return f"Only `numpy` snapshots can be converted, not `{snapshot_format}` snapshots."
+
+    return validate_inputs(value, ctx)
+
+
+class ConvertSnapshotsCalculation(BaseMalaCalculation):
+    """
+    AiiDA calculation plugin wrapping the conversion of ``.npy`` snapshots into openPMD files.
+
+    The descriptors and targets are written by MALA as chunked HDF5 files, which MALA reads lazily, optionally
+    downcast to ``float32``. The chunking and the compression are set through the ``openpmd_configuration``, which
+    defaults to automatic chunks and a fast deflate filter. The converted snapshots are returned as a ``SnapshotSet``
+    in the ``openpmd`` format, which the training and the testing accept like any other set.
+    """
+
+    _MANIFEST_FILE = "snapshots.json"
+    _OUTPUT_DATA_KINDS = ("targets", "info")
+    _DEFAULT_OPENPMD_CONFIGURATION = {
+        "hdf5": {"dataset": {"chunks": "auto", "permanent_filters": {"id": "deflate", "aggression": 1}}}
+    }
+
+    @classmethod
+    def define(cls, spec: CalcJobProcessSpec):
+        """Define inputs and outputs of the calculation."""
+        super().define(spec)
+
+        spec.input(
+            "parameters",
+            valid_type=PreprocessParameters,
+            help="The parameters of the descriptors and targets, which describe the data written to the openPMD files.",
+        )
+        spec.input("snapshots", valid_type=orm.List, help="List of snapshots to convert.")
+        spec.input(
+            "dtype",
+            valid_type=orm.Str,
+            required=False,
+            validator=validate_dtype,
+            help="Floating point type of the converted arrays, e.g. `float32` to halve the size of `float64` "
+            "snapshots. By default the type of the snapshots is kept.",
+        )
+        spec.input(
+            "openpmd_configuration",
+            valid_type=orm.Dict,
+            required=False,
+            help="JSON configuration of the openPMD series, e.g. the chunks and the filters of the HDF5 datasets. "
+            "Defaults to automatic chunks compressed with deflate.",
+        )
+        spec.inputs.validator = validate_convert_inputs
+
+        spec.inputs["metadata"]["options"]["parser_name"].default = "mala.convert_snapshots"  # type: ignore
+
+        spec.output("snapshot_set", valid_type=DataFactory("mala.snapshot_set"), help="The converted snapshots.")
+
+    def prepare_for_submission(self, folder):
+        """
+        Create input files.
+
+        :param folder: an `aiida.common.folders.Folder` where the plugin should temporarily place all files
+            needed by the calculation.
+        :return: `aiida.common.datastructures.CalcInfo` instance
+        """
+        snapshots = self.inputs.snapshots.get_list()  # type: ignore
+        openpmd_configuration = self.inputs.get("openpmd_configuration", None)
+        dtype = self.inputs.get("dtype", None)
+
+        arguments = [
+            self.inputs.parameters,  # type: ignore
+            snapshots,
+            dtype.value if dtype is not None else None,
+            openpmd_configuration.get_dict() if openpmd_configuration is not None else None,
+        ]
+
+        input_file_content = self._generate_input_file(*arguments)
+        input_file_content = self._generate_profiled_script(input_file_content, self._get_profilers())
+        with folder.open(self.metadata.options.input_filename, "w") as handle:  # type: ignore
+            handle.write(input_file_content)
+
+        codeinfo = datastructures.CodeInfo()
+        codeinfo.cmdline_params = self._get_cmdline_params(folder)
+        codeinfo.code_uuid = self.inputs.code.uuid  # type: ignore
+
+        local_copy_list, remote_copy_list, remote_symlink_list = self._get_snapshot_copy_lists(snapshots)
+
+        calcinfo = datastructures.CalcInfo()
+        calcinfo.codes_info = [codeinfo]
+        calcinfo.local_copy_list = local_copy_list
+        calcinfo.remote_copy_list = remote_copy_list
+        calcinfo.remote_symlink_list = remote_symlink_list
+        calcinfo.retrieve_list = [self._TIMINGS_FILE]
+        # The parser streams the converted snapshots from the temporary folder into the ``SnapshotSet``, so they are
+        # not stored twice
+        calcinfo.retrieve_temporary_list = [
+            f"{snapshot}{suffix}" for snapshot in snapshots for suffix in SNAPSHOT_FORMATS["openpmd"].values()
+        ]
+        calcinfo.retrieve_temporary_list += [self._MANIFEST_FILE] + self._get_profile_filenames()
+
+        return calcinfo
+
+    @classmethod
+    def _generate_input_file(cls, parameters: orm.Dict, snapshots, dtype=None, openpmd_configuration=None):
+        """Create the input file"""
+
+        par_dict = parameters.get_dict()
+        suffixes = SNAPSHOT_FORMATS["openpmd"]
+        if openpmd_configuration is None:
+            openpmd_configuration = cls._DEFAULT_OPENPMD_CONFIGURATION
+
+        input_file = ""
+        input_file += "import os\n"
+        input_file += "import mala\n"
+        input_file += "import json\n"
+        input_file += "import time\n"
+        input_file += "import numpy as np\n"
+        input_file += cls._generate_phase_timer()
+
+        input_file += "parameters = mala.Parameters()\n"
+        for group in par_dict:
+            for key, value in par_dict[group].items():
+                if isinstance(value, str):
+                    input_file += f'parameters.{group:s}.{key:s} = "{value:s}"\n'
+                else:
+                    input_file += f"parameters.{group:s}.{key:s} = {value}\n"
+        input_file += f"parameters.openpmd_configuration = {openpmd_configuration}\n"
+
+        input_file += "calculators = {\n"
+        input_file += f"  'descriptors': ('.in.npy', '{suffixes['descriptors']}', mala.Descriptor(parameters)),\n"
+        input_file += f"  'targets': ('.out.npy', '{suffixes['targets']}', mala.Target(parameters)),\n"
+        input_file += "}\n"
+
+        # The shape and dtype of every array are written to the manifest, because they cannot be read from the
+        # header of the openPMD files. The information file of a snapshot is the same in both formats and is
+        # retrieved as is.
+        input_file += "headers = {}\n"
+        input_file += f"for snapshot in {snapshots}:\n"
+        input_file += "  headers[snapshot] = {}\n"
+        input_file += "  for kind, (npy_suffix, openpmd_suffix, calculator) in calculators.items():\n"
+        input_file += "    with phase('convert_' + kind):\n"
+        input_file += "      array = np.load(snapshot + npy_suffix, mmap_mode='r')\n"
+        if dtype is not None:
+            input_file += f"      array = array.astype(np.{dtype}, copy=False)\n"
+        input_file += "      calculator.write_to_openpmd_file(snapshot + openpmd_suffix, array)\n"
+        input_file += "    headers[snapshot][kind] = {'shape': list(array.shape), 'dtype': array.dtype.str}\n"
+        input_file += "    del array\n"
+        input_file += f"with open('{cls._MANIFEST_FILE}', 'w') as file:\n"
+        input_file += "  file.write(json.dumps(headers))\n"
+
+        return input_file
@@ -0,0 +1,359 @@
+"""
+Calculations provided by aiida_mala.
+
+Register calculations via the "aiida.calculations" entry point in setup.json.
+"""
+
+import math
+import posixpath
+import re
+from collections.abc import Mapping
+
+from aiida import orm
+from aiida.common import datastructures
+from aiida.engine import CalcJobProcessSpec
+from aiida.plugins import DataFactory
+from aiida_mala.calculations.base import BaseMalaCalculation, validate_inputs, validate_snapshot_selections
+from aiida_mala.calculations.test_network import TestNetworkCalculation
+from aiida_mala.calculations.train_network import TrainNetworkCalculation
+
+TrainNetworkParameters = DataFactory("mala.train_network")
+
+# Inputs of the trainings and the testings that can be packed, with their valid types
+TASK_INPUTS = {
+    "train": {
+        "parameters": TrainNetworkParameters,
+        "tr_snapshots": orm.List,
+        "va_snapshots": orm.List,
+    },
+    "test": {
+        "model": (orm.SinglefileData, orm.RemoteData),
+        "te_snapshots": orm.List,
+        "observables": orm.List,
+    },
+}
+# Task names are used as link labels and as directory names
+TASK_NAME_PATTERN = re.compile(r"^[A-Za-z][A-Za-z0-9_]*$")
+
+
+def get_task_kind(task):
+    """Return the kind of a task, ``train`` or ``test``, or ``None`` if its inputs match neither."""
+    if not isinstance(task, Mapping):
+        return None
+    for kind, inputs in TASK_INPUTS.items():
+        if set(task) == set(inputs) and all(isinstance(task[key], inputs[key]) for key in inputs):
+            return kind
+    return None
+
+
+def validate_packed_inputs(value, ctx=None):
+    """Validate the top-level inputs namespace."""
+    result = validate_inputs(value, ctx)
+    if result is not None:
+        return result
+
+    tasks = value.get("tasks", {})
+    if not tasks:
+        return "Specify at least one task in `tasks`."
+
+    selections = {}
+    for name, task in tasks.items():
+        if not TASK_NAME_PATTERN.match(name) or "__" in name:
+            return f"The task name `{name}` has to start with a letter and contain only letters, digits and single `_`."
+        kind = get_task_kind(task)
+        if kind is None:
+            return (
+                f"The task `{name}` has to be a training with the inputs {list(TASK_INPUTS['train'])} or a testing "
+                f"with the inputs {list(TASK_INPUTS['test'])}."
+            )
+        selections.update({f"tasks.{name}.{key}": task[key] for key in task if key.endswith("_snapshots")})
+
+    options = value.get("metadata", {}).get("options", {})
+    if options.get("profilers", None):
+        return "The tasks of a packed calculation cannot be profiled."
+
+    return validate_snapshot_selections(value, selections)
+
+
+def validate_max_concurrent_tasks(value, _):
+    """Validate the ``max_concurrent_tasks`` option."""
+    if value is not None and value < 1:
+        return "The `max_concurrent_tasks` has to be at least 1."
+    return None
+
+
+class PackedCalculation(BaseMalaCalculation):
+    """
+    AiiDA calculation plugin running many small trainings and testings in a single job.
+
+    Every task is a training or a testing with the inputs of the ``TrainNetworkCalculation`` or the
+    ``TestNetworkCalculation``, and runs the same script as those in its own directory ``tasks/{name}``. The snapshots
+    of all tasks are staged once into the working directory and linked into the directories of the tasks that use
+    them. A driver script runs the tasks concurrently on the cores of the job, at most ``max_concurrent_tasks`` at a
+    time, each with an equal share of the cores, so that a batch of short tasks waits in the queue only once.
+
+    The outputs of every task are returned in the ``tasks.{name}`` namespace, with the labels of the outputs of the
+    corresponding calculation. If some tasks fail, the outputs of the others are still parsed and the calculation exits
+    with ``ERROR_FAILED_TASKS``.
+
+    All outputs are created by the single packed calculation, so that the provenance graph links the outputs of every
+    task to the inputs of all tasks, not only to those of its own task. The task of an output is recorded by its link
+    label ``tasks__{name}__{label}``, through which the registry of the models pairs the outputs of a task with its own
+    inputs, see ``aiida_mala.registry``. The ``PackedWorkChain`` runs the calculation and returns the outputs of every
+    task through a workfunction that only takes the inputs of that task.
+    """
+
+    _OUTPUT_DATA_KINDS = ("targets", "info")
+    _TASKS_FOLDER = "tasks"
+    _TASKS_FILE = "tasks.json"
+    _TASK_OUTPUT_FILE = "aiida.out"
+    _TASK_ERROR_FILE = "aiida.err"
+
+    @classmethod
+    def define(cls, spec: CalcJobProcessSpec):
+        """Define inputs and outputs of the calculation."""
+        super().define(spec)
+
+        spec.input_namespace(
+            "tasks",
+            valid_type=orm.Data,
+            dynamic=True,
+            help="The tasks, keyed by their name. A training takes the `parameters`, `tr_snapshots` and "
+            "`va_snapshots`, a testing the `model`, `te_snapshots` and `observables`.",
+        )
+        spec.input(
+            "metadata.options.max_concurrent_tasks",
+            valid_type=int,
+            required=False,
+            validator=validate_max_concurrent_tasks,
+            help="Maximum number of tasks that run at the same time. Defaults to the number of cores of the job.",
+        )
+        spec.inputs.validator = validate_packed_inputs
+
+        spec.inputs["metadata"]["options"]["parser_name"].default = "mala.packed"  # type: ignore
+
+        spec.output_namespace(
+            "tasks",
+            valid_type=orm.Data,
+            dynamic=True,
+            help="The outputs of every task, with the labels of the outputs of the training or the testing.",
+        )
+        spec.output(
+            "task_summary",
+            valid_type=orm.Dict,
+            help="The kind, exit status and wall time of every task.",
+        )
+
+        spec.exit_code(
+            302,
+            "ERROR_FAILED_TASKS",
+            message="The tasks {tasks} failed, the outputs of the other tasks were parsed.",
+        )
+
+    @classmethod
+    def estimate_resources(cls, inputs):
+        """
+        Estimate the peak memory and the wall time of the packed tasks from the estimates of the single tasks.
+
+        The memory is that of the largest tasks that can run at the same time, the wall time that of the longest task
+        or of all tasks split evenly over the concurrent ones, whichever is longer.
+
+        :param inputs: the inputs of the calculation, e.g. a ``ProcessBuilder``.
+        :returns: dictionary with the estimates of the ``tasks`` and the estimated ``max_memory_kb`` and
+            ``max_wallclock_seconds``, or ``None`` if the shapes of the snapshots are not known.
+        """
+        sources = {key: inputs[key] for key in ("snapshot_set", "input_data", "output_data") if key in inputs}
+        options = inputs.get("metadata", {}).get("options", {})
+        estimates = {}
+        for name, task in inputs["tasks"].items():
+            calculation = TrainNetworkCalculation if get_task_kind(task) == "train" else TestNetworkCalculation
+            estimate = calculation.estimate_resources({**sources, **task, "metadata": {"options": options}})
+            if estimate is None:
+                return None
+            estimates[name] = estimate
+
+        concurrent = min(len(estimates), options.get("max_concurrent_tasks", None) or len(estimates))
+        memory = sorted((estimate["max_memory_kb"] for estimate in estimates.values()), reverse=True)
+        wall_time = [estimate["max_wallclock_seconds"] for estimate in estimates.values()]
+        return {
+            "tasks": estimates,
+            "max_memory_kb": sum(memory[:concurrent]),
+            "max_wallclock_seconds": max(*wall_time, math.ceil(sum(wall_time) / concurrent)),
+        }
+
+    def _get_tasks(self):
+        """Return the inputs of the tasks, keyed by their name."""
+        return dict(self.inputs.tasks)  # type: ignore
+
+    def _get_staged_snapshots(self):
+        """Return the names of the snapshots of all tasks, each staged once."""
+        return list(
+            dict.fromkeys(snapshot for snapshots in self._get_task_snapshots().values() for snapshot in snapshots)
+        )
+
+    def _get_task_snapshots(self):
+        """Return the names of the snapshots of every task."""
+        return {
+            name: [snapshot for key in task if key.endswith("_snapshots") for snapshot in task[key].get_list()]
+            for name, task in self._get_tasks().items()
+        }
+
+    def prepare_for_submission(self, folder):
+        """
+        Create input files.
+
+        :param folder: an `aiida.common.folders.Folder` where the plugin should temporarily place all files
+            needed by the calculation.
+        :return: `aiida.common.datastructures.CalcInfo` instance
+        """
+        input_filename = self.metadata.options.input_filename  # type: ignore
+        snapshot_format = self._get_snapshot_format()
+        tasks = self._get_tasks()
+        task_snapshots = self._get_task_snapshots()
+
+        # The information files are only staged for the snapshots that are tested
+        te_snapshots = {
+            snapshot
+            for task in tasks.values()
+            if "te_snapshots" in task
+            for snapshot in task["te_snapshots"].get_list()
+        }
+        staged = self._get_staged_snapshots()
+        local_copy_list, remote_copy_list, remote_symlink_list = self._get_snapshot_copy_lists(
+            [snapshot for snapshot in staged if snapshot in te_snapshots]
+        )
+        for copy_list, lists in zip(
+            (local_copy_list, remote_copy_list, remote_symlink_list),
+            self._get_snapshot_copy_lists(
+                [snapshot for snapshot in staged if snapshot not in te_snapshots],
+                TrainNetworkCalculation._OUTPUT_DATA_KINDS,
+            ),
+        ):
+            copy_list.extend(lists)
+        staged_files = {target for *_, target in local_copy_list + remote_copy_list + remote_symlink_list}
+
+        retrieve_list = [self._TASKS_FILE]
+        retrieve_temporary_list = []
+        task_files = {}
+        for name, task in tasks.items():
+            directory = f"{self._TASKS_FOLDER}/{name}"
+            kind = get_task_kind(task)
+            if kind == "train":
+                calculation = TrainNetworkCalculation
+                input_file_content = calculation._generate_input_file(  # pylint: disable=protected-access
+                    task["parameters"], task["tr_snapshots"], task["va_snapshots"], snapshot_format=snapshot_format
+                )
+                outputs = ["metrics.json", calculation._EPOCH_METRICS_FILE]
+                # The parser streams the model from the temporary folder into its node, so it is not stored twice
+                retrieve_temporary_list.append((f"{directory}/{calculation._DEFAULT_MODEL_NAME}.zip", ".", 3))
+                suffixes = self._get_snapshot_suffixes(self._INPUT_DATA_KINDS + calculation._OUTPUT_DATA_KINDS)
+            else:
+                calculation = TestNetworkCalculation
+                model = task["model"]
+                if isinstance(model, orm.RemoteData):
+                    model_filename = posixpath.basename(model.get_remote_path())
+                    remote_copy_list.append(
+                        (model.computer.uuid, model.get_remote_path(), f"{directory}/{model_filename}")
+                    )
+                else:
+                    model_filename = model.filename
+                    local_copy_list.append((model.uuid, model.filename, f"{directory}/{model_filename}"))
+                (info_suffix,) = self._get_snapshot_suffixes(("info",))
+                input_file_content = calculation._generate_input_file(  # pylint: disable=protected-access
+                    task["te_snapshots"],
+                    task["observables"].get_list(),
+                    model_filename,
+                    snapshot_format=snapshot_format,
+                    info_snapshots=[
+                        snapshot
+                        for snapshot in task["te_snapshots"].get_list()
+                        if f"{snapshot}{info_suffix}" in staged_files
+                    ],
+                )
+                outputs = [calculation._RESULTS_FOLDER]
+                suffixes = self._get_snapshot_suffixes(self._INPUT_DATA_KINDS + self._OUTPUT_DATA_KINDS)
+
+            with folder.get_subfolder(directory, create=True).open(input_filename, "w") as handle:
+                handle.write(input_file_content)
+            task_files[name] = [
+                f"{snapshot}{suffix}"
+                for snapshot in task_snapshots[name]
+                for suffix in suffixes
+                if f"{snapshot}{suffix}" in staged_files
+            ]
+            outputs += [calculation._TIMINGS_FILE, self._TASK_ERROR_FILE]
+            retrieve_list.extend((f"{directory}/{output}", ".", 3) for output in outputs)
+
+        input_file_content = self._generate_input_file(
+            task_files,
+            input_filename,
+            self.metadata.options.get("max_concurrent_tasks", None),  # type: ignore
+        )
+        with folder.open(input_filename, "w") as handle:
+            handle.write(input_file_content)
+
+        codeinfo = datastructures.CodeInfo()
+        codeinfo.cmdline_params = self._get_cmdline_params(folder)
+        codeinfo.code_uuid = self.inputs.code.uuid  # type: ignore
+
+        calcinfo = datastructures.CalcInfo()
+        calcinfo.codes_info = [codeinfo]
+        calcinfo.local_copy_list = local_copy_list
+        calcinfo.remote_copy_list = remote_copy_list
+        calcinfo.remote_symlink_list = remote_symlink_list
+        calcinfo.retrieve_list = retrieve_list
+        calcinfo.retrieve_temporary_list = retrieve_temporary_list
+
+        return calcinfo
+
+    @classmethod
+    def _generate_input_file(
+        cls, task_files, input_filename=BaseMalaCalculation._DEFAULT_INPUT_FILE, max_concurrent_tasks=None
+    ):
+        """
+        Create the driver script, which runs the scripts of the tasks concurrently.
+
+        Every task runs in a fresh interpreter in its directory, into which its snapshot files are linked. The threads
+        of the numerical libraries are limited to an equal share of the cores. The exit status and the wall time of
+        every finished task are written to the tasks file as soon as it finishes, so that they are kept if the job
+        runs out of time.
+
+        :param task_files: names of the staged files that every task uses, keyed by the name of the task.
+        :param input_filename: filename of the scripts of the tasks.
+        :param max_concurrent_tasks: maximum number of tasks that run at the same time, defaults to the number of cores.
+        """
+        input_file = ""
+        input_file += "import concurrent.futures\n"
+        input_file += "import json\n"
+        input_file += "import os\n"
+        input_file += "import subprocess\n"
+        input_file += "import sys\n"
+        input_file += "import time\n"
+        input_file += f"tasks = {task_files}\n"
+        input_file += "cores = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count()\n"
+        input_file += f"workers = min(len(tasks), {max_concurrent_tasks or 'cores'})\n"
+        input_file += "threads = str(max(1, cores // workers))\n"
+        input_file += "environment = dict(os.environ, OMP_NUM_THREADS=threads, MKL_NUM_THREADS=threads)\n"
+        input_file += "def run_task(name):\n"
+        input_file += f"  directory = os.path.join('{cls._TASKS_FOLDER}', name)\n"
+        input_file += "  for filename in tasks[name]:\n"
+        input_file += "    if not os.path.lexists(os.path.join(directory, filename)):\n"
+        input_file += "      os.symlink(os.path.join('..', '..', filename), os.path.join(directory, filename))\n"
+        input_file += "  start = time.time()\n"
+        input_file += f"  with open(os.path.join(directory, '{cls._TASK_OUTPUT_FILE}'), 'w') as stdout, \\\n"
+        input_file += f"      open(os.path.join(directory, '{cls._TASK_ERROR_FILE}'), 'w') as stderr:\n"
+        input_file += (
+            f"    process = subprocess.run([sys.executable, '{input_filename}'], cwd=directory, stdout=stdout,"
+            " stderr=stderr, env=environment)\n"
+        )
+        input_file += "  return {'exit_status': process.returncode, 'wall_time': time.time() - start}\n"
+        input_file += "results = {}\n"
+        input_file += "with concurrent.futures.ThreadPoolExecutor(workers) as executor:\n"
+        input_file += "  futures = {executor.submit(run_task, name): name for name in tasks}\n"
+        input_file += "  for future in concurrent.futures.as_completed(futures):\n"
+        input_file += "    results[futures[future]] = future.result()\n"
+        input_file += f"    with open('{cls._TASKS_FILE}.tmp', 'w') as file:\n"
+        input_file += "      file.write(json.dumps(results))\n"
+        input_file += f"    os.replace('{cls._TASKS_FILE}.tmp', '{cls._TASKS_FILE}')\n"
+
+        return input_file
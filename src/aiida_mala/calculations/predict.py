@@ -0,0 +1,216 @@
+"""
+Calculations provided by aiida_mala.
+
+Register calculations via the "aiida.calculations" entry point in setup.json.
+"""
+
+import json
+
+from aiida import orm
+from aiida.common import datastructures
+from aiida.engine import CalcJob, CalcJobProcessSpec
+from aiida_mala.calculations.base import ModelCalculationMixin
+
+PREDICTABLE_OBSERVABLES = ("ldos", "band_energy", "total_energy")
+# The total energy needs the atomic and Ewald energies, which only a MALA setup with Quantum ESPRESSO can compute
+DEFAULT_OBSERVABLES = ("ldos", "band_energy")
+
+
+def validate_observables(value, _):
+    """Validate the ``observables`` input."""
+    if value is None:
+        return None
+    unknown = [observable for observable in value.get_list() if observable not in PREDICTABLE_OBSERVABLES]
+    if unknown:
+        return f"The observables {unknown} cannot be predicted, choose from {list(PREDICTABLE_OBSERVABLES)}."
+    if not value.get_list():
+        return "At least one observable has to be predicted."
+    return None
+
+
+def validate_inputs(value, _):
+    """Validate the top-level inputs namespace."""
+    if not value.get("structures", {}) and "trajectory" not in value:
+        return "Specify at least one of `structures` or `trajectory`."
+    return None
+
+
+class PredictCalculation(ModelCalculationMixin, CalcJob):
+    """
+    AiiDA calculation plugin predicting the electronic structure of many structures with a trained model.
+
+    All structures are predicted in a single ``mala.Predictor`` session, so that the startup and the loading of the
+    model are paid only once. The results of each structure are written as soon as it is predicted. If the prediction
+    of some structures fails, the results of the others are still parsed and the calculation exits with
+    ``ERROR_INCOMPLETE_FRAMES``. An observable that cannot be computed for a frame is left out of its results, without
+    failing the other observables.
+    """
+
+    _DEFAULT_INPUT_FILE = "aiida.in"
+    _STRUCTURES_FILE = "structures.json"
+    _RESULTS_FOLDER = "predictions"
+    # Separates the frame from the observable in the names of the ``.npy`` arrays
+    _ARRAY_SEPARATOR = "__"
+
+    @classmethod
+    def define(cls, spec: CalcJobProcessSpec):
+        """Define inputs and outputs of the calculation."""
+        super().define(spec)
+
+        spec.input("metadata.options.input_filename", valid_type=str, default=cls._DEFAULT_INPUT_FILE)
+        spec.inputs["metadata"]["options"]["parser_name"].default = "mala.predict"  # type: ignore
+
+        spec.input(
+            "model",
+            valid_type=(orm.SinglefileData, orm.RemoteData),
+            help="The trained model file, or the `remote_model` of a training on the same computer.",
+        )
+        spec.input_namespace(
+            "structures",
+            valid_type=orm.StructureData,
+            dynamic=True,
+            required=False,
+            help="Structures to predict, the keys are used as the labels of the frames.",
+        )
+        spec.input(
+            "trajectory",
+            valid_type=orm.TrajectoryData,
+            required=False,
+            help="Trajectory whose steps are predicted, the frames are labelled `step_{index}`.",
+        )
+        spec.input(
+            "observables",
+            valid_type=orm.List,
+            default=lambda: orm.List(list(DEFAULT_OBSERVABLES)),
+            validator=validate_observables,
+            help=f"List of the predicted observables, out of {list(PREDICTABLE_OBSERVABLES)}. Defaults to "
+            f"{list(DEFAULT_OBSERVABLES)}.",
+        )
+        spec.inputs.validator = validate_inputs
+
+        # set default values for AiiDA options
+        spec.inputs["metadata"]["options"]["resources"].default = {  # type: ignore
+            "num_machines": 1,
+            "num_mpiprocs_per_machine": 1,
+        }
+
+        spec.output(
+            "predictions",
+            valid_type=orm.ArrayData,
+            help="Arrays of the predicted energies, ordered as the frames in the `frames` attribute, and of the LDOS "
+            "of every frame, named `{frame}__ldos`.",
+        )
+
+        spec.exit_code(
+            300,
+            "ERROR_MISSING_OUTPUT_FILES",
+            message="Calculation did not produce all expected output files.",
+        )
+        spec.exit_code(
+            301,
+            "ERROR_INCOMPLETE_FRAMES",
+            message="The prediction of the frames {frames} did not finish, the other frames were parsed.",
+        )
+
+    def prepare_for_submission(self, folder):
+        """
+        Create input files.
+
+        :param folder: an `aiida.common.folders.Folder` where the plugin should temporarily place all files
+            needed by the calculation.
+        :return: `aiida.common.datastructures.CalcInfo` instance
+        """
+        with folder.open(self._STRUCTURES_FILE, "w") as handle:
+            json.dump(self._get_frames(), handle)
+
+        arguments = [
+            self.inputs.observables.get_list(),  # type: ignore
+            self._get_model_filename(),
+        ]
+
+        input_file_content = self._generate_input_file(*arguments)
+        with folder.open(self.metadata.options.input_filename, "w") as handle:  # type: ignore
+            handle.write(input_file_content)
+
+        codeinfo = datastructures.CodeInfo()
+        codeinfo.cmdline_params = [self.metadata.options.input_filename]  # type: ignore
+        codeinfo.code_uuid = self.inputs.code.uuid  # type: ignore
+
+        calcinfo = datastructures.CalcInfo()
+        calcinfo.codes_info = [codeinfo]
+        calcinfo.local_copy_list, calcinfo.remote_copy_list = self._get_model_copy_lists()
+        calcinfo.retrieve_list = [self._RESULTS_FOLDER]
+
+        return calcinfo
+
+    def _get_frames(self):
+        """Return the label, symbols, positions, cell and periodicity of the frames in the order they are predicted."""
+        structures = sorted(self.inputs.get("structures", {}).items())
+        if "trajectory" in self.inputs:
+            trajectory = self.inputs.trajectory  # type: ignore
+            structures += [
+                (f"step_{index}", trajectory.get_step_structure(index)) for index in range(trajectory.numsteps)
+            ]
+
+        return [
+            {
+                "label": label,
+                "symbols": [structure.get_kind(site.kind_name).symbol for site in structure.sites],
+                "positions": [list(site.position) for site in structure.sites],
+                "cell": structure.cell,
+                "pbc": list(structure.pbc),
+            }
+            for label, structure in structures
+        ]
+
+    @classmethod
+    def _generate_input_file(cls, observables, model):
+        """Create the input file"""
+
+        input_file = ""
+        input_file += "import os\n"
+        input_file += "import json\n"
+        input_file += "import traceback\n"
+        input_file += "import ase\n"
+        input_file += "import mala\n"
+        input_file += "import numpy as np\n"
+
+        model_name = model.rsplit(".")[0]
+        input_file += (
+            "parameters, network, data_handler, predictor ="
+            f" mala.Predictor.load_run(run_name='{model_name:s}', path='./')\n"
+        )
+        input_file += f"with open('{cls._STRUCTURES_FILE}') as file:\n"
+        input_file += "  frames = json.load(file)\n"
+
+        # The results of every frame are written as soon as it is predicted, the ``.json`` file is written last and
+        # marks the frame as complete.
+        input_file += f"os.makedirs('{cls._RESULTS_FOLDER}', exist_ok=True)\n"
+        input_file += "for frame in frames:\n"
+        input_file += "  try:\n"
+        input_file += (
+            "    atoms = ase.Atoms(symbols=frame['symbols'], positions=frame['positions'], cell=frame['cell'],"
+            " pbc=frame['pbc'])\n"
+        )
+        input_file += "    ldos = predictor.predict_for_atoms(atoms)\n"
+        input_file += "    ldos_calculator = predictor.target_calculator\n"
+        input_file += "    ldos_calculator.read_from_array(ldos)\n"
+        input_file += "    scalars = {}\n"
+        input_file += "  except Exception:\n"
+        input_file += "    traceback.print_exc()\n"
+        input_file += "    continue\n"
+        for observable in observables:
+            input_file += "  try:\n"
+            if observable == "ldos":
+                filename = f"frame['label'] + '{cls._ARRAY_SEPARATOR}ldos.npy'"
+                input_file += f"    np.save(os.path.join('{cls._RESULTS_FOLDER}', {filename}), ldos)\n"
+            else:
+                input_file += f"    scalars['{observable}'] = float(ldos_calculator.{observable})\n"
+            input_file += "  except Exception:\n"
+            input_file += "    traceback.print_exc()\n"
+        input_file += f"  filename = os.path.join('{cls._RESULTS_FOLDER}', frame['label'] + '.json')\n"
+        input_file += "  with open(filename + '.tmp', 'w') as file:\n"
+        input_file += "    file.write(json.dumps(scalars))\n"
+        input_file += "  os.replace(filename + '.tmp', filename)\n"
+
+        return input_file
@@ -0,0 +1,180 @@
+"""
+Calculations provided by aiida_mala.
+
+Register calculations via the "aiida.calculations" entry point in setup.json.
+"""
+
+from aiida import orm
+from aiida.common import datastructures
+from aiida.engine import CalcJob, CalcJobProcessSpec
+from aiida.plugins import DataFactory
+from aiida_mala.data.snapshot_set import SNAPSHOT_FILES
+from voluptuous import Invalid, Match, Optional, Required, Schema
+
+PreprocessParameters = DataFactory("mala.preprocess")
+
+snapshots_schema = Schema(
+    {
+        Match(r"^[\w-]+$"): {
+            Required("descriptor_input_path"): str,
+            Optional("descriptor_input_type", default="espresso-out"): str,
+            Required("target_input_path"): str,
+            Optional("target_input_type", default=".cube"): str,
+            Optional("target_units", default="1/(Ry*Bohr^3)"): str,
+        }
+    }
+)
+
+
+def validate_snapshots(value, _):
+    """Validate the ``snapshots`` input."""
+    if value is None:
+        return None
+    try:
+        snapshots_schema(value.get_dict())
+    except Invalid as exception:
+        return f"Invalid snapshots: {exception}"
+    if not value.get_dict():
+        return "At least one snapshot has to be specified."
+    return None
+
+
+class PreprocessCalculation(CalcJob):
+    """
+    AiiDA calculation plugin wrapping the conversion of raw simulation data into MALA snapshots.
+
+    The descriptors are calculated by MALA's ``DataConverter``, which runs the calculation of the bispectrum
+    descriptors in parallel over the MPI ranks of the calculation, and the targets are converted alongside. The
+    snapshots are returned as a ``SnapshotSet``, which can be passed to the training directly.
+    """
+
+    _DEFAULT_INPUT_FILE = "aiida.in"
+    _RAW_DATA_FOLDER = "raw"
+
+    @classmethod
+    def define(cls, spec: CalcJobProcessSpec):
+        """Define inputs and outputs of the calculation."""
+        super().define(spec)
+
+        spec.input("metadata.options.input_filename", valid_type=str, default=cls._DEFAULT_INPUT_FILE)
+        spec.inputs["metadata"]["options"]["parser_name"].default = "mala.preprocess"  # type: ignore
+        spec.inputs["metadata"]["options"]["withmpi"].default = True  # type: ignore
+
+        spec.input(
+            "parameters",
+            valid_type=PreprocessParameters,
+            help="The parameters of the descriptors and targets.",
+        )
+        spec.input(
+            "raw_data",
+            valid_type=(orm.FolderData, orm.RemoteData),
+            help="Folder with the outputs of the electronic structure calculations, e.g. the Quantum ESPRESSO output "
+            "files and the LDOS cube files. A `RemoteData` is symlinked instead of being copied.",
+        )
+        spec.input(
+            "snapshots",
+            valid_type=orm.Dict,
+            validator=validate_snapshots,
+            help="Snapshots to convert, as a dictionary `{name: {'descriptor_input_path': ..., 'target_input_path': "
+            "...}}` with paths relative to the `raw_data`. The input types and the units of the targets are optional.",
+        )
+
+        # set default values for AiiDA options
+        spec.inputs["metadata"]["options"]["resources"].default = {  # type: ignore
+            "num_machines": 1,
+            "num_mpiprocs_per_machine": 1,
+        }
+
+        spec.output("snapshot_set", valid_type=DataFactory("mala.snapshot_set"), help="The converted snapshots.")
+
+        spec.exit_code(
+            300,
+            "ERROR_MISSING_OUTPUT_FILES",
+            message="Calculation did not produce all expected output files.",
+        )
+
+    def prepare_for_submission(self, folder):
+        """
+        Create input files.
+
+        :param folder: an `aiida.common.folders.Folder` where the plugin should temporarily place all files
+            needed by the calculation.
+        :return: `aiida.common.datastructures.CalcInfo` instance
+        """
+        snapshots = snapshots_schema(self.inputs.snapshots.get_dict())  # type: ignore
+
+        arguments = [
+            self.inputs.parameters,  # type: ignore
+            snapshots,
+            self.metadata.options.withmpi,  # type: ignore
+        ]
+
+        input_file_content = self._generate_input_file(*arguments)
+        with folder.open(self.metadata.options.input_filename, "w") as handle:  # type: ignore
+            handle.write(input_file_content)
+
+        codeinfo = datastructures.CodeInfo()
+        codeinfo.cmdline_params = [self.metadata.options.input_filename]  # type: ignore
+        codeinfo.code_uuid = self.inputs.code.uuid  # type: ignore
+
+        calcinfo = datastructures.CalcInfo()
+        calcinfo.codes_info = [codeinfo]
+        raw_data = self.inputs.raw_data  # type: ignore
+        if isinstance(raw_data, orm.RemoteData):
+            calcinfo.remote_symlink_list = [(raw_data.computer.uuid, raw_data.get_remote_path(), self._RAW_DATA_FOLDER)]
+        else:
+            calcinfo.local_copy_list = [
+                (raw_data.uuid, filename, f"{self._RAW_DATA_FOLDER}/{filename}")
+                for filename in raw_data.list_object_names()
+            ]
+        # The parser streams the snapshots from the temporary folder into the ``SnapshotSet``, so they are not stored
+        # twice
+        calcinfo.retrieve_temporary_list = [
+            f"{snapshot}{suffix}" for snapshot in snapshots for suffix in SNAPSHOT_FILES.values()
+        ]
+
+        return calcinfo
+
+    @classmethod
+    def _generate_input_file(cls, parameters: orm.Dict, snapshots, use_mpi=False):
+        """Create the input file"""
+
+        par_dict = parameters.get_dict()
+
+        input_file = ""
+        input_file += "import os\n"
+        input_file += "import mala\n"
+
+        input_file += "parameters = mala.Parameters()\n"
+        for group in par_dict:
+            for key, value in par_dict[group].items():
+                if isinstance(value, str):
+                    input_file += f'parameters.{group:s}.{key:s} = "{value:s}"\n'
+                else:
+                    input_file += f"parameters.{group:s}.{key:s} = {value}\n"
+
+        if use_mpi:
+            input_file += "parameters.use_mpi = True\n"
+
+        # Every snapshot is converted on its own, so that the files are named after the snapshot
+        for name, snapshot in snapshots.items():
+            descriptor_input_path = f"os.path.join('{cls._RAW_DATA_FOLDER}', '{snapshot['descriptor_input_path']}')"
+            target_input_path = f"os.path.join('{cls._RAW_DATA_FOLDER}', '{snapshot['target_input_path']}')"
+            input_file += "data_converter = mala.DataConverter(parameters)\n"
+            input_file += "data_converter.add_snapshot(\n"
+            input_file += f"  descriptor_input_type='{snapshot['descriptor_input_type']}',\n"
+            input_file += f"  descriptor_input_path={descriptor_input_path},\n"
+            input_file += f"  target_input_type='{snapshot['target_input_type']}',\n"
+            input_file += f"  target_input_path={target_input_path},\n"
+            input_file += f"  target_units='{snapshot['target_units']}',\n"
+            if snapshot["descriptor_input_type"] == "espresso-out":
+                input_file += "  additional_info_input_type='espresso-out',\n"
+                input_file += f"  additional_info_input_path={descriptor_input_path},\n"
+            input_file += ")\n"
+            input_file += (
+                "data_converter.convert_snapshots(descriptor_save_path='.', target_save_path='.',"
+                f" additional_info_save_path='.', naming_scheme='{name}.npy',"
+                " descriptor_calculation_kwargs={'working_directory': '.'})\n"
+            )
+
+        return input_file
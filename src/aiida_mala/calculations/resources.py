@@ -0,0 +1,130 @@
+"""
+Estimates of the memory and the wall time of the calculations of aiida_mala.
+
+The estimates are derived from the shapes of the snapshot arrays, which are read from the index of a ``SnapshotSet``
+or from the headers of the ``.npy`` files, without loading the arrays. The rates below are those of a network of the
+default size on a single CPU node and are deliberately conservative, the estimates are further multiplied by
+``SAFETY_FACTOR``.
+"""
+
+import math
+
+import numpy as np
+
+# Memory of the interpreter with MALA and torch imported, in bytes
+BASE_MEMORY = 2 * 2**30
+# Memory of a forked process that trains a member of an ensemble, on top of the memory it shares, in bytes
+MEMBER_MEMORY = 2**29
+# Time to import MALA, set up the network and save the results, in seconds
+SETUP_TIME = 120.0
+# Grid points per second for which the network is trained, and evaluated in the validation and the testing
+TRAINING_RATE = 2e5
+EVALUATION_RATE = 1e6
+# Time of an optimizer step on top of the grid points of its mini batch, in seconds
+STEP_TIME = 1e-3
+# Bytes per second at which the snapshot files are read
+READ_RATE = 2e8
+SAFETY_FACTOR = 1.5
+# MALA holds the loaded snapshots as ``float32`` tensors
+TENSOR_ITEMSIZE = 4
+
+
+def get_snapshot_sizes(headers):
+    """Return the sizes of the snapshots, computed from the shapes and dtypes of their arrays.
+
+    :param headers: shape and dtype of the arrays, as ``{snapshot: {kind: {"shape": ..., "dtype": ...}}}`` with the
+        ``descriptors`` and ``targets`` kinds.
+    :returns: dictionary with the ``grid_points``, the ``descriptor_features``, the ``target_features`` and the
+        ``nbytes`` of the arrays of every snapshot.
+    """
+    sizes = {}
+    for snapshot, arrays in headers.items():
+        descriptors, targets = arrays["descriptors"], arrays["targets"]
+        sizes[snapshot] = {
+            "grid_points": math.prod(descriptors["shape"][:-1]),
+            "descriptor_features": descriptors["shape"][-1],
+            "target_features": targets["shape"][-1],
+            "nbytes": sum(
+                math.prod(array["shape"]) * np.dtype(array["dtype"]).itemsize for array in (descriptors, targets)
+            ),
+        }
+    return sizes
+
+
+def _get_tensor_nbytes(size):
+    """Return the bytes of the tensors MALA holds for a snapshot of the given size."""
+    return size["grid_points"] * (size["descriptor_features"] + size["target_features"]) * TENSOR_ITEMSIZE
+
+
+def _get_estimate(sizes, memory, wall_time):
+    """Return the estimate of the given peak memory and wall time, with the sizes of the snapshots."""
+    return {
+        "snapshots": sizes,
+        "grid_points": sum(size["grid_points"] for size in sizes.values()),
+        "nbytes": sum(size["nbytes"] for size in sizes.values()),
+        "max_memory_kb": math.ceil(memory * SAFETY_FACTOR / 1024),
+        "max_wallclock_seconds": math.ceil(wall_time * SAFETY_FACTOR),
+    }
+
+
+def estimate_training(sizes, tr_snapshots, va_snapshots, parameters, ensemble_size=1):
+    """Estimate the peak memory and the wall time of a training.
+
+    Without lazy loading all snapshots are held in memory, with it only the current one and, with prefetching, the
+    next one. The snapshots are read once, or in every epoch with lazy loading. The members of an ensemble share the
+    snapshots but split the cores, so that their epochs are assumed to take as long as if they were trained one after
+    the other.
+
+    :param sizes: sizes of the snapshots, see ``get_snapshot_sizes``.
+    :param tr_snapshots: names of the training snapshots.
+    :param va_snapshots: names of the validation snapshots.
+    :param parameters: dictionary of the ``TrainNetworkParameters``.
+    :param ensemble_size: number of members of an ensemble.
+    :returns: dictionary with the sizes of the ``snapshots``, their total ``grid_points`` and ``nbytes``, and the
+        estimated ``max_memory_kb`` and ``max_wallclock_seconds``.
+    """
+    data, running = parameters["data"], parameters["running"]
+    snapshots = list(tr_snapshots) + list(va_snapshots)
+    lazy_loading = data.get("use_lazy_loading", False)
+
+    tensor_nbytes = sorted((_get_tensor_nbytes(sizes[snapshot]) for snapshot in snapshots), reverse=True)
+    if lazy_loading:
+        tensor_nbytes = tensor_nbytes[: 2 if data.get("use_lazy_loading_prefetch", False) else 1]
+    # A snapshot is read in its own dtype before it is converted into tensors
+    memory = BASE_MEMORY + sum(tensor_nbytes) + max((sizes[snapshot]["nbytes"] for snapshot in snapshots), default=0)
+    memory += (ensemble_size - 1) * MEMBER_MEMORY
+
+    tr_points = sum(sizes[snapshot]["grid_points"] for snapshot in tr_snapshots)
+    va_points = sum(sizes[snapshot]["grid_points"] for snapshot in va_snapshots)
+    read_time = sum(sizes[snapshot]["nbytes"] for snapshot in snapshots) / READ_RATE
+    epoch_time = (
+        tr_points / TRAINING_RATE
+        + va_points / EVALUATION_RATE
+        + math.ceil(tr_points / running["mini_batch_size"]) * STEP_TIME
+    )
+    if lazy_loading:
+        epoch_time += read_time
+    wall_time = SETUP_TIME + read_time + ensemble_size * running["max_number_epochs"] * epoch_time
+
+    return _get_estimate({snapshot: sizes[snapshot] for snapshot in snapshots}, memory, wall_time)
+
+
+def estimate_testing(sizes, te_snapshots, use_lazy_loading=True):
+    """Estimate the peak memory and the wall time of a testing.
+
+    :param sizes: sizes of the snapshots, see ``get_snapshot_sizes``.
+    :param te_snapshots: names of the testing snapshots.
+    :param use_lazy_loading: whether only the current snapshot is held in memory.
+    :returns: dictionary with the sizes of the ``snapshots``, their total ``grid_points`` and ``nbytes``, and the
+        estimated ``max_memory_kb`` and ``max_wallclock_seconds``.
+    """
+    tensor_nbytes = [_get_tensor_nbytes(sizes[snapshot]) for snapshot in te_snapshots]
+    largest = max((sizes[snapshot]["nbytes"] for snapshot in te_snapshots), default=0)
+    # The predictions and the observables computed from them are about the size of the targets of a snapshot
+    memory = BASE_MEMORY + (max(tensor_nbytes, default=0) if use_lazy_loading else sum(tensor_nbytes)) + 2 * largest
+
+    te_points = sum(sizes[snapshot]["grid_points"] for snapshot in te_snapshots)
+    read_time = sum(sizes[snapshot]["nbytes"] for snapshot in te_snapshots) / READ_RATE
+    wall_time = SETUP_TIME + read_time + te_points / EVALUATION_RATE
+
+    return _get_estimate({snapshot: sizes[snapshot] for snapshot in te_snapshots}, memory, wall_time)
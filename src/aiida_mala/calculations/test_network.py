@@ -6,47 +6,86 @@ Register calculations via the "aiida.calculations" entry point in setup.json.
 
 from aiida import orm
 from aiida.common import datastructures
-from aiida.engine import CalcJob, CalcJobProcessSpec
+from aiida.engine import CalcJobProcessSpec
+from aiida_mala.calculations.base import BaseMalaCalculation
+from aiida_mala.calculations.resources import estimate_testing, get_snapshot_sizes
+from aiida_mala.data.snapshot_set import SNAPSHOT_FORMATS
 
 # TestNetworkParameters = DataFactory("mala.test_network")
 
 
-class TestNetworkCalculation(CalcJob):
+class TestNetworkCalculation(BaseMalaCalculation):
     """
     AiiDA calculation plugin wrapping testing trained models.
+
+    The results of each snapshot are written as soon as it is tested. If the testing of some snapshots fails, the
+    results of the others are still parsed and the calculation exits with ``ERROR_INCOMPLETE_SNAPSHOTS``. The wall
+    time and peak memory of loading the model, preparing the data, testing and writing the results are parsed into
+    ``timings``.
     """
 
-    _DEFAULT_INPUT_FILE = "aiida.in"
+    _OUTPUT_DATA_KINDS = ("targets", "info")
+    _RESULTS_FOLDER = "results"
+    # Separates the snapshot from the observable in the names of the ``.npy`` arrays
+    _ARRAY_SEPARATOR = "__"
+    # Observables with at most this many values per snapshot, e.g. an actual and a predicted value, are kept in the
+    # ``observables`` dictionary, larger ones are written as ``.npy`` arrays.
+    _MAX_INLINE_SIZE = 2
 
     @classmethod
     def define(cls, spec: CalcJobProcessSpec):
         """Define inputs and outputs of the calculation."""
         super().define(spec)
 
-        spec.input("metadata.options.input_filename", valid_type=str, default=cls._DEFAULT_INPUT_FILE)
-
-        spec.input("model", valid_type=orm.SinglefileData, help="The trained model file.")
-        spec.input("input_data", valid_type=orm.FolderData, help="Specify the folder with input data.")
-        spec.input("output_data", valid_type=orm.FolderData, help="Specify the folder with output data.")
+        spec.input(
+            "model",
+            valid_type=(orm.SinglefileData, orm.RemoteData),
+            help="The trained model file, or the `remote_model` of a training on the same computer.",
+        )
         spec.input("te_snapshots", valid_type=orm.List, help="List of testing snapshots.")
         spec.input("observables", valid_type=orm.List, help="List of observables to test.")
 
-        # set default values for AiiDA options
-        spec.inputs["metadata"]["options"]["resources"].default = {  # type: ignore
-            "num_machines": 1,
-            "num_mpiprocs_per_machine": 1,
-        }
+        spec.input(
+            "metadata.options.use_lazy_loading",
+            valid_type=bool,
+            default=True,
+            help="Load the testing snapshots one at a time instead of all at once.",
+        )
 
         spec.inputs["metadata"]["options"]["parser_name"].default = "mala.test_network"  # type: ignore
 
-        spec.output("observables", valid_type=orm.Dict, help="Dictionary of the observables.")
+        spec.output(
+            "observables", valid_type=orm.Dict, help="Dictionary of the scalar observables of each tested snapshot."
+        )
+        spec.output(
+            "observable_arrays",
+            valid_type=orm.ArrayData,
+            required=False,
+            help="Arrays of the grid-sized observables, named `{snapshot}__{observable}`.",
+        )
 
         spec.exit_code(
-            300,
-            "ERROR_MISSING_OUTPUT_FILES",
-            message="Calculation did not produce all expected output files.",
+            301,
+            "ERROR_INCOMPLETE_SNAPSHOTS",
+            message="The testing of the snapshots {snapshots} did not finish, the other snapshots were parsed.",
         )
 
+    @classmethod
+    def estimate_resources(cls, inputs):
+        """
+        Estimate the peak memory and the wall time of the testing from the shapes of its snapshots.
+
+        :param inputs: the inputs of the calculation, e.g. a ``ProcessBuilder``.
+        :returns: dictionary with the sizes of the snapshots and the estimated ``max_memory_kb`` and
+            ``max_wallclock_seconds``, or ``None`` if the shapes of the snapshots are not known.
+        """
+        te_snapshots = inputs["te_snapshots"].get_list()
+        headers = cls.get_snapshot_headers(inputs, te_snapshots)
+        if headers is None:
+            return None
+        use_lazy_loading = inputs.get("metadata", {}).get("options", {}).get("use_lazy_loading", True)
+        return estimate_testing(get_snapshot_sizes(headers), te_snapshots, use_lazy_loading)
+
     def prepare_for_submission(self, folder):
         """
         Create input files.
@@ -56,91 +95,126 @@ class TestNetworkCalculation(CalcJob):
         :return: `aiida.common.datastructures.CalcInfo` instance
         """
 
+        local_copy_list, remote_copy_list, remote_symlink_list = self._get_snapshot_copy_lists(
+            self.inputs.te_snapshots.get_list()  # type: ignore
+        )
+        # The information files are optional, only the staged ones are passed to MALA
+        staged_files = {target for *_, target in local_copy_list + remote_copy_list + remote_symlink_list}
+        (info_suffix,) = self._get_snapshot_suffixes(("info",))
+
         arguments = [
             self.inputs.te_snapshots,  # type: ignore
             self.inputs.observables.get_list(),  # type: ignore
-            self.inputs.model.filename,  # type: ignore
+            self._get_model_filename(),
+            self.metadata.options.use_lazy_loading,  # type: ignore
+            self._get_snapshot_format(),
+            [
+                snapshot
+                for snapshot in self.inputs.te_snapshots.get_list()  # type: ignore
+                if f"{snapshot}{info_suffix}" in staged_files
+            ],
         ]
-        local_copy_list = []
 
         input_file_content = self._generate_input_file(*arguments)
+        input_file_content = self._generate_profiled_script(input_file_content, self._get_profilers())
         with folder.open(self.metadata.options.input_filename, "w") as handle:  # type: ignore
             handle.write(input_file_content)
 
         codeinfo = datastructures.CodeInfo()
-        codeinfo.cmdline_params = [self.metadata.options.input_filename]  # type: ignore
+        codeinfo.cmdline_params = self._get_cmdline_params(folder)
 
         codeinfo.code_uuid = self.inputs.code.uuid  # type: ignore
 
-        local_copy_list = []
-        local_copy_list.append(
-            (
-                self.inputs.model.uuid,  # type: ignore
-                self.inputs.model.filename,  # type: ignore
-                self.inputs.model.filename,  # type: ignore
-            )
-        )  # type: ignore
-        for snapshot in self.inputs.te_snapshots.get_list():  # type: ignore
-            local_copy_list.append(
-                (
-                    self.inputs.input_data.uuid,  # type: ignore
-                    f"{snapshot}.in.npy",
-                    f"{snapshot}.in.npy",
-                )
-            )
-            local_copy_list.append(
-                (
-                    self.inputs.output_data.uuid,  # type: ignore
-                    f"{snapshot}.out.npy",
-                    f"{snapshot}.out.npy",
-                )
-            )
-            local_copy_list.append(
-                (
-                    self.inputs.output_data.uuid,  # type: ignore
-                    f"{snapshot}.info.json",
-                    f"{snapshot}.info.json",
-                )
-            )
+        model_local_copy_list, model_remote_copy_list = self._get_model_copy_lists()
+        local_copy_list += model_local_copy_list
+        remote_copy_list += model_remote_copy_list
 
         # Prepare a `CalcInfo` to be returned to the engine
         calcinfo = datastructures.CalcInfo()
         calcinfo.codes_info = [codeinfo]
         calcinfo.local_copy_list = local_copy_list
-        calcinfo.retrieve_list = ["observables.json"]
+        calcinfo.remote_copy_list = remote_copy_list
+        calcinfo.remote_symlink_list = remote_symlink_list
+        calcinfo.retrieve_list = [self._RESULTS_FOLDER, self._TIMINGS_FILE]
+        # The parser streams the profiles from the temporary folder into their nodes
+        calcinfo.retrieve_temporary_list = self._get_profile_filenames()
 
         return calcinfo
 
     @classmethod
-    def _generate_input_file(cls, te_snapshots, observables, model):  # pylint: disable=invalid-name
-        """Create the input file"""
+    def _generate_input_file(  # pylint: disable=invalid-name
+        cls, te_snapshots, observables, model, use_lazy_loading=True, snapshot_format="numpy", info_snapshots=None
+    ):
+        """Create the input file
+
+        The information file is only passed to MALA for the ``info_snapshots``, by default for all snapshots.
+        """
 
         input_file = ""
         input_file += "import os\n"
         input_file += "import mala\n"
         input_file += "import json\n"
+        input_file += "import time\n"
+        input_file += "import traceback\n"
+        input_file += "import numpy as np\n"
+        input_file += cls._generate_phase_timer()
 
         model_name = model.rsplit(".")[0]
         model_path = "./"
+        input_file += "with phase('load_model'):\n"
         input_file += (
-            "parameters, network, data_handler, tester ="
+            "  parameters, network, data_handler, tester ="
             f" mala.Tester.load_run(run_name='{model_name:s}', path='{model_path:s}')\n"
         )
         input_file += f"tester.observables_to_test = {observables}\n"
         input_file += "tester.output_format = 'list'\n"
-        input_file += "parameters.data.use_lazy_loading = True\n"
+        input_file += f"parameters.data.use_lazy_loading = {use_lazy_loading}\n"
 
+        suffixes = SNAPSHOT_FORMATS[snapshot_format]
+        snapshot_type = "" if snapshot_format == "numpy" else f" snapshot_type='{snapshot_format}',"
         for snapshot in te_snapshots.get_list():
+            calculation_output_file = ""
+            if info_snapshots is None or snapshot in info_snapshots:
+                calculation_output_file = (
+                    f" calculation_output_file=os.path.join('.', '{snapshot:s}{suffixes['info']}'),"
+                )
             input_file += (
-                f"data_handler.add_snapshot('{snapshot:s}.in.npy', '.',"
-                f" '{snapshot:s}.out.npy', '.', 'te',"
-                f" calculation_output_file=os.path.join('.', '{snapshot:s}.info.json'),)\n"
+                f"data_handler.add_snapshot('{snapshot:s}{suffixes['descriptors']}', '.',"
+                f" '{snapshot:s}{suffixes['targets']}', '.', 'te',{calculation_output_file}{snapshot_type})\n"
             )
 
-        input_file += "data_handler.prepare_data(reparametrize_scaler=False)\n"
-
-        input_file += "results = tester.test_all_snapshots()\n"
-        input_file += "with open('observables.json', 'w') as file:\n"
-        input_file += "  file.write(json.dumps(results))\n"
+        input_file += "with phase('prepare_data'):\n"
+        input_file += "  data_handler.prepare_data(reparametrize_scaler=False)\n"
+
+        # Every snapshot is tested on its own and its results are written as soon as it finishes, so that a failure
+        # only loses the snapshots that were not tested yet. The ``.json`` file is written last and marks the snapshot
+        # as complete.
+        input_file += f"os.makedirs('{cls._RESULTS_FOLDER}', exist_ok=True)\n"
+        input_file += f"for index, snapshot in enumerate({te_snapshots.get_list()}):\n"
+        input_file += "  try:\n"
+        input_file += "    with phase('testing'):\n"
+        input_file += "      results = tester.test_snapshot(index)\n"
+        input_file += "  except Exception:\n"
+        input_file += "    traceback.print_exc()\n"
+        input_file += "    continue\n"
+        input_file += "  with phase('write_results'):\n"
+        input_file += "    scalars = {}\n"
+        input_file += "    for observable, value in results.items():\n"
+        input_file += "      try:\n"
+        input_file += "        array = np.asarray(value, dtype=float)\n"
+        input_file += "      except (TypeError, ValueError):\n"
+        input_file += "        scalars[observable] = value\n"
+        input_file += "        continue\n"
+        input_file += f"      if array.size > {cls._MAX_INLINE_SIZE}:\n"
+        input_file += (
+            f"        np.save(os.path.join('{cls._RESULTS_FOLDER}', snapshot + '{cls._ARRAY_SEPARATOR}' + observable"
+            " + '.npy'), array)\n"
+        )
+        input_file += "      else:\n"
+        input_file += "        scalars[observable] = array.tolist()\n"
+        input_file += f"    filename = os.path.join('{cls._RESULTS_FOLDER}', snapshot + '.json')\n"
+        input_file += "    with open(filename + '.tmp', 'w') as file:\n"
+        input_file += "      file.write(json.dumps(scalars))\n"
+        input_file += "    os.replace(filename + '.tmp', filename)\n"
 
         return input_file
@@ -4,52 +4,216 @@ Calculations provided by aiida_mala.
 Register calculations via the "aiida.calculations" entry point in setup.json.
 """
 
+import posixpath
+
 from aiida import orm
 from aiida.common import datastructures
-from aiida.engine import CalcJob, CalcJobProcessSpec
+from aiida.engine import CalcJobProcessSpec
 from aiida.plugins import DataFactory
+from aiida_mala.calculations.base import BaseMalaCalculation, validate_inputs
+from aiida_mala.calculations.resources import estimate_training, get_snapshot_sizes
+from aiida_mala.data.snapshot_set import SNAPSHOT_FORMATS
 
 TrainNetworkParameters = DataFactory("mala.train_network")
 
 
-class TrainNetworkCalculation(CalcJob):
+def validate_train_inputs(value, ctx=None):
+    """Validate the top-level inputs namespace."""
+    result = validate_inputs(value, ctx)
+    if result is not None:
+        return result
+
+    options = value.get("metadata", {}).get("options", {})
+    if options.get("frozen_layers", 0) < 0:
+        return "The `frozen_layers` option cannot be negative."
+    if options.get("frozen_layers", 0) and "model" not in value:
+        return "The `frozen_layers` option requires a `model` to fine-tune."
+
+    if "ensemble_seeds" in value:
+        unsupported = [key for key in ("model",) if key in value]
+        unsupported += [key for key in ("use_ddp", "keep_model_remote") if options.get(key, False)]
+        if unsupported:
+            return f"An ensemble cannot be trained with {unsupported}."
+
+    return None
+
+
+def validate_ensemble_seeds(value, _):
+    """Validate the ``ensemble_seeds`` input."""
+    if value is None:
+        return None
+    seeds = value.get_list()
+    if len(seeds) < 2 or not all(isinstance(seed, int) for seed in seeds) or len(set(seeds)) != len(seeds):
+        return "The `ensemble_seeds` have to be at least two distinct integers."
+    return None
+
+
+class TrainNetworkCalculation(BaseMalaCalculation):
     """
     AiiDA calculation plugin wrapping training of the data.
+
+    The training writes a checkpoint every ``running.checkpoints_each_epoch`` epochs (by default every 10 epochs). If
+    the checkpoint of a previous calculation is staged through the ``parent_folder`` input, the training resumes from it
+    and continues up to its own ``running.max_number_epochs``.
+    With a ``model`` input the training fine-tunes that model on the new snapshots instead of training a new network,
+    keeping the architecture and the scalers of the model and optionally freezing its first layers.
+
+    With ``ensemble_seeds`` an ensemble of networks, which only differ in their seed, is trained in a single job. The
+    snapshots are loaded and scaled once, and the members are trained in forked processes that share the prepared data
+    and split the cores of the job. The members are returned in ``ensemble_models`` and the ``ensemble`` lists their
+    seeds and final losses. Every member writes its own checkpoint, from which it resumes if the ensemble is restarted
+    from the ``parent_folder``. A resumed member prepares its data from its checkpoint itself.
+
+    The trained model is retrieved as ``model``, or with the ``keep_model_remote`` option left on the remote computer as
+    ``remote_model``, which can be passed to the testing without transferring it back and forth. The losses, wall time
+    and learning rate of every epoch are recorded from the output of MALA and parsed into ``training_metrics``. The wall
+    time and peak memory of the phases of the script, from preparing the data to saving the model, are parsed into
+    ``timings``.
     """
 
-    _DEFAULT_INPUT_FILE = "aiida.in"
+    _CHECKPOINT_NAME = "checkpoint"
+    _DEFAULT_MODEL_NAME = "model"
+    _MODEL_MANIFEST_FILE = "model_manifest.json"
+    _EPOCH_METRICS_FILE = "epochs.jsonl"
+    # Matches the line MALA prints after every epoch, the training loss is only printed by some versions
+    _EPOCH_PATTERN = r"Epoch:?\s*(\d+)\W+validation data loss:\s*([^,\s]+)(?:,\s*training data loss:\s*([^,\s]+))?"
+    _DEFAULT_CHECKPOINTS_EACH_EPOCH = 10
+    _DEFAULT_DDP_PORT = 29500
+    # Environment variables with the rank, world size and local rank set by the common MPI launchers
+    _MPI_RANK_VARIABLES = (
+        ("OMPI_COMM_WORLD_RANK", "OMPI_COMM_WORLD_SIZE", "OMPI_COMM_WORLD_LOCAL_RANK"),
+        ("PMI_RANK", "PMI_SIZE", "MPI_LOCALRANKID"),
+        ("SLURM_PROCID", "SLURM_NTASKS", "SLURM_LOCALID"),
+    )
 
     @classmethod
     def define(cls, spec: CalcJobProcessSpec):
         """Define inputs and outputs of the calculation."""
         super().define(spec)
 
-        spec.input("metadata.options.input_filename", valid_type=str, default=cls._DEFAULT_INPUT_FILE)
-
         spec.input(
             "parameters",
             valid_type=TrainNetworkParameters,
             help="The input parameters that are to be used to construct the input file.",
         )
 
-        spec.input("input_data", valid_type=orm.FolderData, help="Specify the folder with input data.")
-        spec.input("output_data", valid_type=orm.FolderData, help="Specify the folder with output data.")
         spec.input("tr_snapshots", valid_type=orm.List, help="List of training snapshots.")
         spec.input("va_snapshots", valid_type=orm.List, help="List of validation snapshots.")
+        spec.input(
+            "parent_folder",
+            valid_type=orm.RemoteData,
+            required=False,
+            help="Working directory of a previous training, from which the training is resumed at the last checkpoint.",
+        )
+        spec.input(
+            "model",
+            valid_type=(orm.SinglefileData, orm.RemoteData),
+            required=False,
+            help="A trained model file, or the `remote_model` of a training on the same computer, which is fine-tuned "
+            "instead of training a new network. Its architecture, descriptors and targets are kept, only the `data` "
+            "and `running` groups of the `parameters` are applied.",
+        )
+        spec.input(
+            "metadata.options.frozen_layers",
+            valid_type=int,
+            default=0,
+            help="Number of leading linear layers of the `model` whose weights are not trained further.",
+        )
+        spec.input(
+            "ensemble_seeds",
+            valid_type=orm.List,
+            required=False,
+            validator=validate_ensemble_seeds,
+            help="Seeds of the members of an ensemble, which are trained on the same snapshots in a single job.",
+        )
+        spec.inputs.validator = validate_train_inputs
+        spec.input(
+            "metadata.options.use_ddp",
+            valid_type=bool,
+            default=False,
+            help="Train with distributed data parallelism, with one rank per MPI process of the `resources`.",
+        )
+        spec.input(
+            "metadata.options.retrieve_checkpoint",
+            valid_type=bool,
+            default=False,
+            help="Retrieve the last checkpoint. By default it is only kept in the remote working directory.",
+        )
+
+        spec.input(
+            "metadata.options.model_name",
+            valid_type=str,
+            default=cls._DEFAULT_MODEL_NAME,
+            help="Name of the run the trained model is saved as, the model is written to `{model_name}.zip`.",
+        )
+        spec.input(
+            "metadata.options.keep_model_remote",
+            valid_type=bool,
+            default=False,
+            help="Leave the trained model in the remote working directory instead of retrieving it. Only a manifest "
+            "with its size and checksum is retrieved.",
+        )
 
-        # set default values for AiiDA options
-        spec.inputs["metadata"]["options"]["resources"].default = {  # type: ignore
-            "num_machines": 1,
-            "num_mpiprocs_per_machine": 1,
-        }
         spec.inputs["metadata"]["options"]["parser_name"].default = "mala.train_network"  # type:ignore
 
-        spec.output("model", valid_type=orm.SinglefileData, help="The trained model file.")
+        spec.output("model", valid_type=orm.SinglefileData, required=False, help="The trained model file.")
+        spec.output(
+            "remote_model",
+            valid_type=orm.RemoteData,
+            required=False,
+            help="The trained model file on the remote computer, if `keep_model_remote` is set.",
+        )
+        spec.output(
+            "model_manifest",
+            valid_type=orm.Dict,
+            required=False,
+            help="Filename, size and SHA-256 checksum of the remote model, if `keep_model_remote` is set.",
+        )
+        spec.output_namespace(
+            "ensemble_models",
+            valid_type=orm.SinglefileData,
+            dynamic=True,
+            required=False,
+            help="The trained model files of the members of an ensemble, named `member_{index}`.",
+        )
+        spec.output(
+            "ensemble",
+            valid_type=orm.Dict,
+            required=False,
+            help="The seed, output label and final validation loss of every member of an ensemble.",
+        )
+        spec.output(
+            "output_parameters",
+            valid_type=orm.Dict,
+            help="Dictionary with the final losses of the training and a summary of the epochs.",
+        )
+        spec.output(
+            "training_metrics",
+            valid_type=orm.ArrayData,
+            required=False,
+            help="Arrays with the epoch, training and validation loss, wall time and learning rate of every epoch.",
+        )
+
+    @classmethod
+    def estimate_resources(cls, inputs):
+        """
+        Estimate the peak memory and the wall time of the training from the shapes of its snapshots.
+
+        The estimate follows the epochs, the mini batch size and the lazy loading of the ``parameters``, and the size of
+        an ensemble.
 
-        spec.exit_code(
-            300,
-            "ERROR_MISSING_OUTPUT_FILES",
-            message="Calculation did not produce all expected output files.",
+        :param inputs: the inputs of the calculation, e.g. a ``ProcessBuilder``.
+        :returns: dictionary with the sizes of the snapshots and the estimated ``max_memory_kb`` and
+            ``max_wallclock_seconds``, or ``None`` if the shapes of the snapshots are not known.
+        """
+        tr_snapshots = inputs["tr_snapshots"].get_list()
+        va_snapshots = inputs["va_snapshots"].get_list()
+        headers = cls.get_snapshot_headers(inputs, tr_snapshots + va_snapshots)
+        if headers is None:
+            return None
+        ensemble_size = len(inputs["ensemble_seeds"].get_list()) if "ensemble_seeds" in inputs else 1
+        return estimate_training(
+            get_snapshot_sizes(headers), tr_snapshots, va_snapshots, inputs["parameters"].get_dict(), ensemble_size
         )
 
     def prepare_for_submission(self, folder):
@@ -65,47 +229,42 @@ class TrainNetworkCalculation(CalcJob):
             self.inputs.parameters,  # type:ignore
             self.inputs.tr_snapshots,  # type:ignore
             self.inputs.va_snapshots,  # type:ignore
+            self.metadata.options.use_ddp,  # type:ignore
+            self.metadata.options.model_name,  # type:ignore
+            self.metadata.options.keep_model_remote,  # type:ignore
+            self._get_snapshot_format(),
+            self._get_model_filename() if "model" in self.inputs else None,
+            self.metadata.options.frozen_layers,  # type:ignore
+            self.inputs.ensemble_seeds.get_list() if "ensemble_seeds" in self.inputs else None,  # type:ignore
         ]
-        local_copy_list = []
 
         input_file_content = self._generate_input_file(*arguments)
+        input_file_content = self._generate_profiled_script(input_file_content, self._get_profilers())
         with folder.open(self.metadata.options.input_filename, "w") as handle:  # type:ignore
             handle.write(input_file_content)
 
         codeinfo = datastructures.CodeInfo()
-        codeinfo.cmdline_params = [self.metadata.options.input_filename]  # type:ignore
+        codeinfo.cmdline_params = self._get_cmdline_params(folder)
 
         codeinfo.code_uuid = self.inputs.code.uuid  # type:ignore
+        if self.metadata.options.use_ddp:  # type:ignore
+            codeinfo.withmpi = True
 
-        local_copy_list = []
-        for snapshot in self.inputs.tr_snapshots.get_list():  # type:ignore
-            local_copy_list.append(
-                (
-                    self.inputs.input_data.uuid,  # type:ignore
-                    f"{snapshot}.in.npy",
-                    f"{snapshot}.in.npy",
-                )
-            )
-            local_copy_list.append(
-                (
-                    self.inputs.output_data.uuid,  # type:ignore
-                    f"{snapshot}.out.npy",
-                    f"{snapshot}.out.npy",
-                )
-            )
-        for snapshot in self.inputs.va_snapshots.get_list():  # type:ignore
-            local_copy_list.append(
-                (
-                    self.inputs.input_data.uuid,  # type:ignore
-                    f"{snapshot}.in.npy",
-                    f"{snapshot}.in.npy",
-                )
-            )
-            local_copy_list.append(
+        snapshots = self.inputs.tr_snapshots.get_list() + self.inputs.va_snapshots.get_list()  # type:ignore
+        local_copy_list, remote_copy_list, remote_symlink_list = self._get_snapshot_copy_lists(snapshots)
+
+        if "model" in self.inputs:
+            model_local_copy_list, model_remote_copy_list = self._get_model_copy_lists()
+            local_copy_list += model_local_copy_list
+            remote_copy_list += model_remote_copy_list
+
+        if "parent_folder" in self.inputs:
+            parent_folder = self.inputs.parent_folder  # type:ignore
+            remote_copy_list.append(
                 (
-                    self.inputs.output_data.uuid,  # type:ignore
-                    f"{snapshot}.out.npy",
-                    f"{snapshot}.out.npy",
+                    parent_folder.computer.uuid,
+                    posixpath.join(parent_folder.get_remote_path(), f"{self._CHECKPOINT_NAME}*"),
+                    ".",
                 )
             )
 
@@ -113,12 +272,46 @@ class TrainNetworkCalculation(CalcJob):
         calcinfo = datastructures.CalcInfo()
         calcinfo.codes_info = [codeinfo]
         calcinfo.local_copy_list = local_copy_list
-        calcinfo.retrieve_list = ["model.zip"]
+        calcinfo.remote_copy_list = remote_copy_list
+        calcinfo.remote_symlink_list = remote_symlink_list
+        if self.metadata.options.use_ddp:  # type:ignore
+            # The batch script runs on the first node, which hosts the rendezvous of the ranks
+            calcinfo.prepend_text = (
+                "export MASTER_ADDR=${MASTER_ADDR:-$(hostname)}\n"
+                f"export MASTER_PORT=${{MASTER_PORT:-{self._DEFAULT_DDP_PORT}}}"
+            )
+        calcinfo.retrieve_list = ["metrics.json", self._EPOCH_METRICS_FILE, self._TIMINGS_FILE]
+        if self.metadata.options.keep_model_remote:  # type:ignore
+            calcinfo.retrieve_list.append(self._MODEL_MANIFEST_FILE)
+        elif "ensemble_seeds" in self.inputs:
+            calcinfo.retrieve_temporary_list = [
+                f"{self.metadata.options.model_name}_{index}.zip"  # type:ignore
+                for index in range(len(self.inputs.ensemble_seeds))  # type:ignore
+            ]
+        else:
+            # The parser streams the model from the temporary folder into its node, so it is not stored twice
+            calcinfo.retrieve_temporary_list = [f"{self.metadata.options.model_name}.zip"]  # type:ignore
+        # The profiles are streamed from the temporary folder into their nodes as well
+        calcinfo.retrieve_temporary_list = (calcinfo.retrieve_temporary_list or []) + self._get_profile_filenames()
+        if self.metadata.options.retrieve_checkpoint:  # type:ignore
+            calcinfo.retrieve_list.append(f"{self._CHECKPOINT_NAME}*")
 
         return calcinfo
 
     @classmethod
-    def _generate_input_file(cls, parameters: orm.Dict, tr_snapshots, va_snapshots):  # pylint: disable=invalid-name
+    def _generate_input_file(  # pylint: disable=invalid-name
+        cls,
+        parameters: orm.Dict,
+        tr_snapshots,
+        va_snapshots,
+        use_ddp=False,
+        model_name=_DEFAULT_MODEL_NAME,
+        keep_model_remote=False,
+        snapshot_format="numpy",
+        model=None,
+        frozen_layers=0,
+        ensemble_seeds=None,
+    ):
         """Create the input file"""
 
         par_dict = parameters.get_dict()
@@ -126,31 +319,304 @@ class TrainNetworkCalculation(CalcJob):
         input_file = ""
         input_file += "import os\n"
         input_file += "import mala\n"
-
-        input_file += "parameters = mala.Parameters()\n"
-        for group in par_dict:
+        input_file += "import json\n"
+        input_file += "import re\n"
+        input_file += "import sys\n"
+        input_file += "import time\n"
+        if keep_model_remote:
+            input_file += "import hashlib\n"
+
+        if use_ddp:
+            input_file += cls._generate_ddp_environment()
+            input_file += cls._generate_ddp_backend()
+        input_file += cls._generate_phase_timer()
+        if frozen_layers:
+            input_file += cls._generate_layer_freezing(frozen_layers)
+
+        setup = ""
+        groups = list(par_dict)
+        if model is None:
+            setup += "parameters = mala.Parameters()\n"
+        else:
+            # The network, the descriptors and the targets are those of the model, only the data loading and the
+            # training are set. The data handler keeps the scalers of the model.
+            setup += "with phase('load_model'):\n"
+            setup += (
+                "  parameters, test_network, data_handler = mala.Trainer.load_run("
+                f"run_name='{model.rsplit('.')[0]:s}', path='./', load_runner=False, prepare_data=False)\n"
+            )
+            groups = ["data", "running"]
+        for group in groups:
             for key, value in par_dict[group].items():
+                if group == "network" and key == "hidden_layer_sizes":
+                    continue
                 if isinstance(value, str):
-                    input_file += f'parameters.{group:s}.{key:s} = "{value:s}"\n'
+                    setup += f'parameters.{group:s}.{key:s} = "{value:s}"\n'
                 else:
-                    input_file += f"parameters.{group:s}.{key:s} = {value}\n"
+                    setup += f"parameters.{group:s}.{key:s} = {value}\n"
+
+        if "checkpoints_each_epoch" not in par_dict["running"]:
+            setup += f"parameters.running.checkpoints_each_epoch = {cls._DEFAULT_CHECKPOINTS_EACH_EPOCH}\n"
+        setup += f"parameters.running.checkpoint_name = '{cls._CHECKPOINT_NAME}'\n"
+
+        if use_ddp:
+            setup += "parameters.use_ddp = True\n"
+
+        if model is None:
+            setup += "data_handler = mala.DataHandler(parameters)\n"
+
+        suffixes = SNAPSHOT_FORMATS[snapshot_format]
+        snapshot_type = "" if snapshot_format == "numpy" else f", snapshot_type='{snapshot_format}'"
+        for snapshots, add_snapshot_as in ((tr_snapshots, "tr"), (va_snapshots, "va")):
+            for snapshot in snapshots.get_list():
+                setup += (
+                    f"data_handler.add_snapshot('{snapshot:s}{suffixes['descriptors']}', '.',"
+                    f" '{snapshot:s}{suffixes['targets']}', '.', '{add_snapshot_as}'{snapshot_type})\n"
+                )
+
+        setup += "with phase('prepare_data'):\n"
+        if model is None:
+            setup += "  data_handler.prepare_data()\n"
+
+            hidden_layer_sizes = par_dict["network"].get(
+                "hidden_layer_sizes", TrainNetworkParameters.DEFAULT_HIDDEN_LAYER_SIZES
+            )
+            layer_sizes = [
+                "data_handler.input_dimension",
+                *map(str, hidden_layer_sizes),
+                "data_handler.output_dimension",
+            ]
+            setup += f"parameters.network.layer_sizes = [{', '.join(layer_sizes)}]\n"
+            if ensemble_seeds:
+                # The data is only prepared once for the members that are not resumed from their own checkpoint
+                # No pool of threads of OpenMP or MKL may exist when the members are forked, as its threads are not
+                # forked with it. The data is thus prepared on a single thread, and the members set their own threads.
+                input_file += "import torch\n"
+                input_file += "torch.set_num_threads(1)\n"
+                input_file += f"seeds = {list(ensemble_seeds)}\n"
+                input_file += (
+                    f"resumed = [mala.Trainer.run_exists('{cls._CHECKPOINT_NAME}_' + str(index))"
+                    " for index in range(len(seeds))]\n"
+                )
+                input_file += "if not all(resumed):\n"
+                input_file += "".join(f"    {line}\n" for line in setup.splitlines())
+                input_file += cls._generate_epoch_logger()
+                input_file += cls._generate_ensemble_training(par_dict["running"]["max_number_epochs"], model_name)
+                return input_file
+            setup += "with phase('setup_network'):\n"
+            setup += "  test_network = mala.Network(parameters)\n"
+        else:
+            setup += "  data_handler.prepare_data(reparametrize_scaler=False)\n"
+            setup += "with phase('setup_network'):\n"
+            if frozen_layers:
+                setup += "  freeze_layers(test_network)\n"
+        setup += "  test_trainer = mala.Trainer(parameters, test_network, data_handler)\n"
+
+        training_setup = ""
+        training_setup += f"if mala.Trainer.run_exists('{cls._CHECKPOINT_NAME}'):\n"
+        training_setup += "    with phase('load_checkpoint'):\n"
+        training_setup += (
+            "        parameters, test_network, data_handler, test_trainer ="
+            f" mala.Trainer.load_run('{cls._CHECKPOINT_NAME}')\n"
+        )
+        # A resumed training continues up to its own number of epochs, which is larger for a promoted trial
+        training_setup += (
+            f"        parameters.running.max_number_epochs = {par_dict['running']['max_number_epochs']:d}\n"
+        )
+        if frozen_layers:
+            # The checkpoint does not record which layers are frozen. The trainer already wrapped the network with all
+            # its layers for a distributed training, so it is wrapped again once they are frozen.
+            training_setup += "        freeze_layers(test_network)\n"
+            if use_ddp:
+                training_setup += (
+                    "        test_trainer.network = torch.nn.parallel.DistributedDataParallel(test_network)\n"
+                )
+        training_setup += "else:\n"
+        training_setup += "".join(f"    {line}\n" for line in setup.splitlines())
+        if use_ddp:
+            input_file += "with ddp_setup():\n"
+            input_file += "".join(f"  {line}\n" for line in training_setup.splitlines())
+        else:
+            input_file += training_setup
+
+        input_file += cls._generate_epoch_logger()
+        input_file += "with phase('training'):\n"
+        input_file += "  test_trainer.train_network()\n"
+        input_file += "with phase('save_model'):\n"
+        input_file += f"  test_trainer.save_run('{model_name:s}')\n"
+        input_file += "metrics = {'final_validation_loss': float(test_trainer.final_validation_loss)}\n"
+        input_file += "if int(os.environ.get('RANK', 0)) == 0:\n"
+        input_file += "  with open('metrics.json', 'w') as file:\n"
+        input_file += "    file.write(json.dumps(metrics))\n"
+        if keep_model_remote:
+            input_file += "  sha256 = hashlib.sha256()\n"
+            input_file += f"  with open('{model_name:s}.zip', 'rb') as file:\n"
+            input_file += "    for chunk in iter(lambda: file.read(2**22), b''):\n"
+            input_file += "      sha256.update(chunk)\n"
+            input_file += (
+                f"  manifest = {{'filename': '{model_name:s}.zip', 'nbytes': os.path.getsize('{model_name:s}.zip'),"
+                " 'sha256': sha256.hexdigest()}\n"
+            )
+            input_file += f"  with open('{cls._MODEL_MANIFEST_FILE}', 'w') as file:\n"
+            input_file += "    file.write(json.dumps(manifest))\n"
+
+        return input_file
+
+    @classmethod
+    def _generate_ensemble_training(cls, max_number_epochs, model_name=_DEFAULT_MODEL_NAME):
+        """
+        Create the lines that train the members of an ensemble, listed in ``seeds``, on the prepared data.
+
+        Every member is trained in a process forked from the script, which shares the prepared data in memory, with
+        its own seed and checkpoint. The members are trained concurrently on an equal share of the cores, the script
+        itself has to run ``torch`` on a single thread up to the fork. A member whose checkpoint exists, as listed in
+        ``resumed``, continues its training from it up to ``max_number_epochs``.
+        """
+        input_file = ""
+        input_file += "import concurrent.futures\n"
+        input_file += "import copy\n"
+        input_file += "import multiprocessing\n"
+        input_file += "cores = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count()\n"
+        input_file += "workers = min(len(seeds), cores)\n"
+        input_file += "def train_member(index, seed):\n"
+        input_file += "  global test_trainer\n"
+        input_file += "  torch.set_num_threads(max(1, cores // workers))\n"
+        input_file += "  torch.manual_seed(seed)\n"
+        input_file += f"  checkpoint_name = '{cls._CHECKPOINT_NAME}_' + str(index)\n"
+        input_file += "  if resumed[index]:\n"
+        input_file += "    member_parameters, _, _, test_trainer = mala.Trainer.load_run(checkpoint_name)\n"
+        input_file += f"    member_parameters.running.max_number_epochs = {max_number_epochs:d}\n"
+        input_file += "  else:\n"
+        input_file += "    member_parameters = copy.deepcopy(parameters)\n"
+        input_file += "    member_parameters.running.checkpoint_name = checkpoint_name\n"
+        input_file += (
+            "    test_trainer = mala.Trainer(member_parameters, mala.Network(member_parameters), data_handler)\n"
+        )
+        input_file += "  if isinstance(sys.stdout, EpochLogger):\n"
+        input_file += "    sys.stdout.member = index\n"
+        input_file += "  test_trainer.train_network()\n"
+        input_file += f"  test_trainer.save_run('{model_name:s}_' + str(index))\n"
+        input_file += "  return float(test_trainer.final_validation_loss)\n"
+        input_file += "with phase('training'):\n"
+        input_file += "  context = multiprocessing.get_context('fork')\n"
+        input_file += "  with concurrent.futures.ProcessPoolExecutor(workers, mp_context=context) as executor:\n"
+        input_file += "    losses = list(executor.map(train_member, range(len(seeds)), seeds))\n"
+        input_file += "members = [\n"
+        input_file += "  {'seed': seed, 'final_validation_loss': loss} for seed, loss in zip(seeds, losses)\n"
+        input_file += "]\n"
+        input_file += "metrics = {'final_validation_loss': sum(losses) / len(losses), 'members': members}\n"
+        input_file += "with open('metrics.json', 'w') as file:\n"
+        input_file += "  file.write(json.dumps(metrics))\n"
+
+        return input_file
+
+    @classmethod
+    def _generate_layer_freezing(cls, frozen_layers):
+        """Create the lines that define ``freeze_layers``, which freezes the first ``frozen_layers`` linear layers."""
+        input_file = ""
+        input_file += "def freeze_layers(network):\n"
+        input_file += "  import torch\n"
+        input_file += "  layers = [module for module in network.modules() if isinstance(module, torch.nn.Linear)]\n"
+        input_file += f"  for layer in layers[:{frozen_layers:d}]:\n"
+        input_file += "    for weight in layer.parameters():\n"
+        input_file += "      weight.requires_grad = False\n"
+
+        return input_file
 
-        input_file += "data_handler = mala.DataHandler(parameters)\n"
+    @classmethod
+    def _generate_ddp_environment(cls):
+        """Create the lines that set the environment of ``torch.distributed`` from the one of the MPI launcher."""
+        input_file = ""
+        input_file += f"for rank, size, local_rank in {cls._MPI_RANK_VARIABLES}:\n"
+        input_file += "  if rank in os.environ:\n"
+        input_file += "    os.environ.setdefault('RANK', os.environ[rank])\n"
+        input_file += "    os.environ.setdefault('WORLD_SIZE', os.environ[size])\n"
+        input_file += "    os.environ.setdefault('LOCAL_RANK', os.environ.get(local_rank, '0'))\n"
+        input_file += "    break\n"
+        input_file += "os.environ.setdefault('MASTER_ADDR', 'localhost')\n"
+        input_file += f"os.environ.setdefault('MASTER_PORT', '{cls._DEFAULT_DDP_PORT}')\n"
 
-        for snapshot in tr_snapshots.get_list():
-            input_file += f"data_handler.add_snapshot('{snapshot:s}.in.npy', '.', '{snapshot:s}.out.npy', '.', 'tr')\n"
-        for snapshot in va_snapshots.get_list():
-            input_file += f"data_handler.add_snapshot('{snapshot:s}.in.npy', '.', '{snapshot:s}.out.npy', '.', 'va')\n"
+        return input_file
 
-        input_file += "data_handler.prepare_data()\n"
+    @classmethod
+    def _generate_ddp_backend(cls):
+        """
+        Create the lines that define ``ddp_setup``, in which MALA sets up a distributed training without GPUs.
 
+        MALA starts the process group with the NCCL backend and wraps the network in a CUDA stream, which both require
+        GPUs. Without GPUs, the process group is started with the Gloo backend beforehand, and while MALA sets up the
+        training within ``ddp_setup``, the start of the process group and the CUDA streams are replaced by no-ops. The
+        functions of ``torch`` are restored when MALA is set up. With GPUs, ``ddp_setup`` does nothing.
+        """
+        input_file = ""
+        input_file += "import contextlib\n"
+        input_file += "import torch\n"
+        input_file += "import torch.distributed\n"
+        input_file += "class NoStream:\n"
+        input_file += "  def wait_stream(self, stream):\n"
+        input_file += "    pass\n"
+        input_file += "@contextlib.contextmanager\n"
+        input_file += "def no_stream(stream):\n"
+        input_file += "  yield stream\n"
+        input_file += "def no_process_group(*args, **kwargs):\n"
+        input_file += "  pass\n"
+        input_file += "@contextlib.contextmanager\n"
+        input_file += "def ddp_setup():\n"
+        input_file += "  if torch.cuda.is_available():\n"
+        input_file += "    yield\n"
+        input_file += "    return\n"
+        input_file += "  if not torch.distributed.is_initialized():\n"
+        input_file += "    torch.distributed.init_process_group('gloo')\n"
+        input_file += (
+            "  functions = (torch.distributed.init_process_group, torch.cuda.Stream, torch.cuda.stream,"
+            " torch.cuda.current_stream)\n"
+        )
+        input_file += "  torch.distributed.init_process_group = no_process_group\n"
+        input_file += "  torch.cuda.Stream = torch.cuda.current_stream = lambda *args, **kwargs: NoStream()\n"
+        input_file += "  torch.cuda.stream = no_stream\n"
+        input_file += "  try:\n"
+        input_file += "    yield\n"
+        input_file += "  finally:\n"
         input_file += (
-            "parameters.network.layer_sizes = [data_handler.input_dimension, 100, data_handler.output_dimension]\n"
+            "    torch.distributed.init_process_group, torch.cuda.Stream, torch.cuda.stream,"
+            " torch.cuda.current_stream = functions\n"
         )
-        input_file += "test_network = mala.Network(parameters)\n"
 
-        input_file += "test_trainer = mala.Trainer(parameters, test_network, data_handler)\n"
-        input_file += "test_trainer.train_network()\n"
-        input_file += "test_trainer.save_run('model')\n"
+        return input_file
+
+    @classmethod
+    def _generate_epoch_logger(cls):
+        """Create the lines that write the metrics of every epoch printed by MALA to a JSON lines file."""
+        input_file = ""
+        input_file += "class EpochLogger:\n"
+        input_file += f"  pattern = re.compile({cls._EPOCH_PATTERN!r})\n"
+        # The member of an ensemble the epochs belong to
+        input_file += "  member = None\n"
+        input_file += "  def __init__(self, stream):\n"
+        input_file += "    self.stream = stream\n"
+        input_file += "    self.time = time.time()\n"
+        input_file += "  def write(self, text):\n"
+        input_file += "    for match in self.pattern.finditer(text):\n"
+        input_file += "      now = time.time()\n"
+        input_file += "      optimizer = getattr(test_trainer, 'optimizer', None)\n"
+        input_file += "      record = {\n"
+        input_file += "        'epoch': int(match.group(1)),\n"
+        input_file += "        'training_loss': float(match.group(3) or 'nan'),\n"
+        input_file += "        'validation_loss': float(match.group(2)),\n"
+        input_file += "        'epoch_time': now - self.time,\n"
+        input_file += (
+            "        'learning_rate': optimizer.param_groups[0]['lr'] if optimizer is not None else float('nan'),\n"
+        )
+        input_file += "      }\n"
+        input_file += "      if self.member is not None:\n"
+        input_file += "        record['member'] = self.member\n"
+        input_file += "      self.time = now\n"
+        input_file += f"      with open('{cls._EPOCH_METRICS_FILE}', 'a') as file:\n"
+        input_file += "        file.write(json.dumps(record) + '\\n')\n"
+        input_file += "    return self.stream.write(text)\n"
+        input_file += "  def __getattr__(self, name):\n"
+        input_file += "    return getattr(self.stream, name)\n"
+        input_file += "if int(os.environ.get('RANK', 0)) == 0:\n"
+        input_file += "  sys.stdout = EpochLogger(sys.stdout)\n"
 
         return input_file
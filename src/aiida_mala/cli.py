@@ -0,0 +1,103 @@
+"""
+Command line interface (cli) of aiida_mala.
+
+Register new commands either via the "console_scripts" entry point or plug them
+directly into the 'verdi' command by using AiiDA-specific entry points like
+"aiida.cmdline.data" (both in the pyproject.toml file).
+"""
+
+import click
+from aiida.cmdline.commands.cmd_data import verdi_data
+from aiida.cmdline.params import arguments
+from aiida.cmdline.utils import decorators, echo
+
+from aiida_mala.registry import MODEL_EXTRA, TEST_EXTRA, index_models, parse_filter, query_models
+
+DEFAULT_FIELDS = ("descriptors.descriptor_type", "metrics.final_validation_loss")
+
+
+def validate_filters(ctx, param, value):  # pylint: disable=unused-argument
+    """Validate the filters on the fields of the models."""
+    for expression in value:
+        try:
+            parse_filter(expression)
+        except ValueError as exception:
+            raise click.BadParameter(str(exception)) from exception
+    return value
+
+
+# See aiida.cmdline.data entry point in pyproject.toml
+@verdi_data.group("mala")
+def data_cli():
+    """Command line interface for aiida-mala, with the registry of the trained models."""
+
+
+@data_cli.command("list")
+@click.option(
+    "-f",
+    "--filter",
+    "filters",
+    multiple=True,
+    callback=validate_filters,
+    help="Filter on a field of the models, e.g. `descriptors.bispectrum_twojmax=10` or `errors.band_energy<0.01`, "
+    "with the operators =, !=, <, <=, > and >=. Can be given multiple times.",
+)
+@click.option(
+    "-o",
+    "--order-by",
+    help="Numerical field by which the models are ranked, e.g. `errors.band_energy`. Only the models with the field "
+    "are listed.",
+)
+@click.option("--descending", is_flag=True, help="Rank the models in descending order.")
+@click.option("-l", "--limit", type=click.IntRange(min=1), help="Maximum number of models to list.")
+@click.option(
+    "-p",
+    "--project",
+    "fields",
+    multiple=True,
+    default=DEFAULT_FIELDS,
+    show_default=True,
+    help="Field of the models to show. Can be given multiple times.",
+)
+@decorators.with_dbenv()
+def list_(filters, order_by, descending, limit, fields):
+    """
+    List, filter and rank the registered models.
+
+    The fields of a model are the groups of its training parameters, e.g. `running.learning_rate` or
+    `descriptors.bispectrum_twojmax`, its `tr_snapshots` and `va_snapshots`, its `metrics`, e.g.
+    `metrics.best_validation_loss`, and the mean errors of its testings, e.g. `errors.band_energy`.
+    """
+    from tabulate import tabulate
+
+    fields = list(fields)
+    if order_by is not None and order_by not in fields:
+        fields.append(order_by)
+
+    rows = [[pk, *values] for pk, _, *values in query_models(filters, order_by, descending, limit, fields)]
+    if not rows:
+        echo.echo_report("No models found.")
+        return
+    echo.echo(tabulate(rows, headers=["PK", *fields]))
+
+
+@data_cli.command("show")
+@arguments.DATUM()
+@decorators.with_dbenv()
+def show(datum):
+    """Show the registry record and the testing errors of a model."""
+    if MODEL_EXTRA not in datum.base.extras.keys():
+        echo.echo_critical(f"{datum} is not a registered model, run `verdi data mala index` to register older models.")
+    record = datum.base.extras.get(MODEL_EXTRA)
+    test = datum.base.extras.get(TEST_EXTRA, {})
+    if test:
+        record = {**record, "errors": test["errors"], "te_snapshots": sorted(test["snapshots"])}
+    echo.echo_dictionary(record)
+
+
+@data_cli.command("index")
+@decorators.with_dbenv()
+def index():
+    """Register the trainings and the testings that were parsed before the registry existed."""
+    trained, tested = index_models()
+    echo.echo_success(f"Registered {trained} trained models and the testing errors of {tested} models.")
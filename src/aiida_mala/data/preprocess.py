@@ -0,0 +1,64 @@
+"""Data types provided by plugin
+
+Register data types via the "aiida.data" entry point in setup.json.
+"""
+
+from aiida.orm import Dict
+from aiida_mala.data.train_network import TrainNetworkParameters
+from voluptuous import Required, Schema
+
+
+class PreprocessParameters(Dict):  # pylint: disable=too-many-ancestors
+    """
+    Options for calculating the descriptors and converting the targets of snapshots.
+
+    The ``descriptors`` and ``targets`` groups are the same as those of the ``TrainNetworkParameters``, so that the
+    parameters the snapshots were preprocessed with can be passed on to the training.
+    """
+
+    schema = Schema(
+        {
+            Required("descriptors"): TrainNetworkParameters.descriptors_schema,
+            Required("targets"): TrainNetworkParameters.targets_schema,
+        }
+    )
+
+    # pylint: disable=redefined-builtin
+    def __init__(self, dict=None, **kwargs):
+        """
+        Constructor for the data class
+
+        Usage: ``PreprocessParameters(dict{'descriptors': {...}, 'targets': {...}})``
+
+        :param parameters_dict: dictionary with the descriptor and target parameters
+        :param type parameters_dict: dict
+
+        """
+        dict = self.validate(dict)
+        super().__init__(dict=dict, **kwargs)
+
+    def validate(self, parameters_dict):
+        """Validate the parameters.
+
+        Uses the voluptuous package for validation. Find out about allowed keys using::
+
+            print(PreprocessParameters).schema.schema
+
+        :param parameters_dict: dictionary with the descriptor and target parameters
+        :param type parameters_dict: dict
+        :returns: validated dictionary
+        """
+        return PreprocessParameters.schema(parameters_dict)
+
+    def __str__(self):
+        """String representation of node.
+
+        Append values of dictionary to usual representation. E.g.::
+
+            uuid: b416cbee-24e8-47a8-8c11-6d668770158b (pk: 590)
+            {'descriptors': {'descriptor_type': 'Bispectrum'}, 'targets': {'target_type': 'LDOS'}}
+
+        """
+        string = super().__str__()
+        string += "\n" + str(self.get_dict())
+        return string
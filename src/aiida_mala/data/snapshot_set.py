@@ -0,0 +1,208 @@
+"""Data types provided by plugin
+
+Register data types via the "aiida.data" entry point in setup.json.
+"""
+
+import hashlib
+import pathlib
+
+import numpy as np
+from aiida.orm import FolderData
+from aiida.orm.nodes.caching import NodeCaching
+
+SNAPSHOT_FILES = {
+    "descriptors": ".in.npy",
+    "targets": ".out.npy",
+    "info": ".info.json",
+}
+# Suffixes of the files of a snapshot in each storage format MALA can read
+SNAPSHOT_FORMATS = {
+    "numpy": SNAPSHOT_FILES,
+    "openpmd": {
+        "descriptors": ".in.h5",
+        "targets": ".out.h5",
+        "info": ".info.json",
+    },
+}
+
+
+def read_npy_header(handle):
+    """Read the header of a ``.npy`` file without loading the array.
+
+    :param handle: binary file handle positioned at the start of the file.
+    :returns: dictionary with the ``shape`` and ``dtype`` of the array.
+    """
+    version = np.lib.format.read_magic(handle)
+    if version == (1, 0):
+        shape, _, dtype = np.lib.format.read_array_header_1_0(handle)
+    elif version == (2, 0):
+        shape, _, dtype = np.lib.format.read_array_header_2_0(handle)
+    else:
+        raise ValueError(f"unsupported `.npy` format version {version}")
+
+    return {"shape": list(shape), "dtype": dtype.str}
+
+
+class HashingReader:
+    """Binary file handle that computes the SHA-256 checksum of the bytes read through it.
+
+    The repository streams a file from the handle, so that the checksum is computed without reading the file twice.
+    """
+
+    mode = "rb"
+
+    def __init__(self, handle):
+        """
+        Wrap a binary file handle.
+
+        :param handle: binary file handle positioned at the start of the file.
+        """
+        self._handle = handle
+        self._sha256 = hashlib.sha256()
+
+    def read(self, size=-1):
+        """Read and hash up to ``size`` bytes."""
+        chunk = self._handle.read(size)
+        self._sha256.update(chunk)
+        return chunk
+
+    def hexdigest(self):
+        """Return the checksum of the bytes read so far."""
+        return self._sha256.hexdigest()
+
+
+class SnapshotSetCaching(NodeCaching):
+    """Caching of a ``SnapshotSet``, whose hash covers its index instead of reading all files of the repository."""
+
+    def get_objects_to_hash(self):
+        """Return the objects which should be included in the hash.
+
+        The same objects as for any node, except for the hash of the repository, which would read every file. The index
+        in the attributes already contains the checksum of every file.
+        """
+        return {
+            "class": str(self._node.__class__),
+            "attributes": {
+                key: value
+                for key, value in self._node.base.attributes.items()
+                if key not in self._node._hash_ignored_attributes  # pylint: disable=protected-access
+                and key not in self._node._updatable_attributes  # pylint: disable=protected-access
+            },
+            "computer_uuid": self._node.computer.uuid if self._node.computer is not None else None,
+        }
+
+    # Name of the method before aiida-core 2.6
+    _get_objects_to_hash = get_objects_to_hash
+
+
+class SnapshotSet(FolderData):  # pylint: disable=too-many-ancestors
+    """
+    Set of MALA snapshots.
+
+    Every snapshot is stored once as its triple of descriptor (``.in.npy``), target (``.out.npy``) and optional
+    calculation info (``.info.json``) files. An index with the shape, dtype, byte size and checksum of each file is
+    kept in the attributes, so that the snapshots can be validated and sized without opening the arrays.
+
+    The snapshots are stored as ``.npy`` files, or in the ``openpmd`` format as chunked ``.in.h5`` and ``.out.h5``
+    files, see ``SNAPSHOT_FORMATS``. The shape and dtype of the openPMD files cannot be read from their header, they are
+    passed on by the conversion that wrote them.
+
+    The hash of the set is computed from the index, so that it does not have to read the snapshot files.
+
+    Usage: ``SnapshotSet(folder="/path/to/data", snapshots=["Be_snapshot0", "Be_snapshot1"])``
+    """
+
+    _CLS_NODE_CACHING = SnapshotSetCaching
+
+    def __init__(self, folder=None, snapshots=None, snapshot_format="numpy", headers=None, **kwargs):
+        """
+        Constructor for the data class
+
+        :param folder: path to the folder with the snapshot files.
+        :param snapshots: names of the snapshots to store. Defaults to all snapshots with a descriptor file.
+        :param snapshot_format: storage format of the snapshot files, see ``SNAPSHOT_FORMATS``.
+        :param headers: optional shape and dtype of the arrays, as ``{snapshot: {kind: {"shape": ..., "dtype": ...}}}``.
+        """
+        super().__init__(**kwargs)
+        if folder is not None:
+            self.set_snapshots(folder, snapshots, snapshot_format, headers)
+
+    def set_snapshots(self, folder, snapshots=None, snapshot_format="numpy", headers=None):
+        """Store the snapshots of a folder and build their index.
+
+        :param folder: path to the folder with the snapshot files.
+        :param snapshots: names of the snapshots to store. Defaults to all snapshots with a descriptor file.
+        :param snapshot_format: storage format of the snapshot files, see ``SNAPSHOT_FORMATS``.
+        :param headers: optional shape and dtype of the arrays, as ``{snapshot: {kind: {"shape": ..., "dtype": ...}}}``.
+            The headers of ``.npy`` files are read from the files.
+        :raises ValueError: if the storage format is unknown.
+        :raises FileNotFoundError: if the descriptor or target file of a snapshot is missing.
+        """
+        if snapshot_format not in SNAPSHOT_FORMATS:
+            raise ValueError(f"unknown snapshot format `{snapshot_format}`, choose from {list(SNAPSHOT_FORMATS)}")
+        suffixes = SNAPSHOT_FORMATS[snapshot_format]
+        headers = headers or {}
+
+        folder = pathlib.Path(folder)
+        if snapshots is None:
+            suffix = suffixes["descriptors"]
+            snapshots = sorted(path.name[: -len(suffix)] for path in folder.glob(f"*{suffix}"))
+
+        index = {}
+        for snapshot in snapshots:
+            index[snapshot] = {}
+            for kind, suffix in suffixes.items():
+                filepath = folder / f"{snapshot}{suffix}"
+                if not filepath.is_file():
+                    if kind == "info":
+                        continue
+                    raise FileNotFoundError(f"snapshot `{snapshot}` has no {kind} file `{filepath}`")
+
+                entry = {"filename": filepath.name, "nbytes": filepath.stat().st_size}
+                with open(filepath, "rb") as handle:
+                    if kind != "info" and snapshot_format == "numpy":
+                        entry.update(read_npy_header(handle))
+                        handle.seek(0)
+                    # The checksum is computed while the file is streamed into the repository
+                    reader = HashingReader(handle)
+                    self.base.repository.put_object_from_filelike(reader, filepath.name)
+                entry["sha256"] = reader.hexdigest()
+                entry.update(headers.get(snapshot, {}).get(kind, {}))
+                index[snapshot][kind] = entry
+
+        self.base.attributes.set("snapshot_format", snapshot_format)
+        self.base.attributes.set("snapshots", index)
+
+    @property
+    def snapshot_format(self):
+        """Return the storage format of the snapshot files."""
+        return self.base.attributes.get("snapshot_format", "numpy")
+
+    @property
+    def snapshot_names(self):
+        """Return the names of the snapshots in the set."""
+        return sorted(self.base.attributes.get("snapshots", {}))
+
+    @property
+    def nbytes(self):
+        """Return the total size of all snapshot files in bytes."""
+        return sum(entry["nbytes"] for files in self.get_index().values() for entry in files.values())
+
+    def get_index(self, snapshot=None):
+        """Return the index of the set, or only that of a single snapshot.
+
+        :param snapshot: optional name of a snapshot.
+        :raises KeyError: if the snapshot is not part of the set.
+        """
+        index = self.base.attributes.get("snapshots", {})
+        if snapshot is None:
+            return index
+        try:
+            return index[snapshot]
+        except KeyError as exception:
+            raise KeyError(f"snapshot `{snapshot}` is not part of the set") from exception
+
+    def get_missing_snapshots(self, snapshots):
+        """Return the names of the given snapshots that are not part of the set."""
+        index = self.base.attributes.get("snapshots", {})
+        return [snapshot for snapshot in snapshots if snapshot not in index]
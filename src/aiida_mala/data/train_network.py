@@ -6,24 +6,77 @@ Register data types via the "aiida.data" entry point in setup.json.
 # You can directly use or subclass aiida.orm.data.Data
 # or any other data type listed under 'verdi data'
 from aiida.orm import Dict
-from voluptuous import All, In, Optional, Required, Schema
+from voluptuous import All, In, Invalid, Length, Optional, Range, Required, Schema
+
+
+def validate_data_loading(data):
+    """Validate that the data loading options of the ``data`` group are compatible with each other."""
+    if data.get("use_lazy_loading_prefetch", False) and not data.get("use_lazy_loading", False):
+        raise Invalid(
+            "`use_lazy_loading_prefetch` requires `use_lazy_loading`",
+            path=["use_lazy_loading_prefetch"],
+        )
+    if data.get("use_fast_tensor_data_set", False) and data.get("use_lazy_loading", False):
+        raise Invalid(
+            "`use_fast_tensor_data_set` cannot be combined with `use_lazy_loading`",
+            path=["use_fast_tensor_data_set"],
+        )
+    return data
+
+
+def validate_network(network):
+    """Validate that the activations of the ``network`` group match its hidden layers."""
+    num_layers = len(network.get("hidden_layer_sizes", TrainNetworkParameters.DEFAULT_HIDDEN_LAYER_SIZES)) + 1
+    num_activations = len(network["layer_activations"])
+    if network.get("nn_type", "feed-forward") == "feed-forward" and num_activations not in (1, num_layers):
+        raise Invalid(
+            f"`layer_activations` has to contain a single activation or one per layer ({num_layers}), "
+            f"got {num_activations}",
+            path=["layer_activations"],
+        )
+    return network
 
 
 class TrainNetworkParameters(Dict):  # pylint: disable=too-many-ancestors
     """
     Options for training the network.
+
+    Besides the rescaling, the ``data`` group configures how the snapshots are loaded: ``use_lazy_loading`` keeps only
+    the current snapshot in memory, which ``use_lazy_loading_prefetch`` loads in the background, while
+    ``use_fast_tensor_data_set`` speeds up the batching of snapshots held in memory. The ``running`` group sets the
+    number of loader processes ``num_workers`` and whether the samplers shuffle the data.
+
+    The ``network`` group sets the sizes of the hidden layers with ``hidden_layer_sizes`` (by default a single layer of
+    100 neurons). A feed-forward network takes either a single activation for all layers or one per layer, including
+    the output layer.
     """
 
-    data_schema = Schema(
-        {
-            Required("input_rescaling_type"): In(["feature-wise-standard", "minmax"]),
-            Required("output_rescaling_type"): In(["feature-wise-standard", "minmax"]),
-        }
+    data_schema = All(
+        Schema(
+            {
+                Required("input_rescaling_type"): In(["feature-wise-standard", "minmax"]),
+                Required("output_rescaling_type"): In(["feature-wise-standard", "minmax"]),
+                Optional("use_lazy_loading"): bool,
+                Optional("use_lazy_loading_prefetch"): bool,
+                Optional("use_fast_tensor_data_set"): bool,
+                Optional("shuffling_seed"): int,
+            }
+        ),
+        validate_data_loading,
     )
-    network_schema = Schema(
-        {
-            Required("layer_activations"): All(list, [str]),
-        }
+    DEFAULT_HIDDEN_LAYER_SIZES = [100]
+
+    network_schema = All(
+        Schema(
+            {
+                Required("layer_activations"): All(list, [str], Length(min=1)),
+                Optional("hidden_layer_sizes"): All([All(int, Range(min=1))], Length(min=1)),
+                Optional("nn_type"): In(["feed-forward", "transformer", "lstm", "gru"]),
+                Optional("num_hidden_layers"): All(int, Range(min=1)),
+                Optional("num_heads"): All(int, Range(min=1)),
+            }
+        ),
+        validate_network,
     )
     running_schema = Schema(
         {
@@ -31,6 +84,9 @@ class TrainNetworkParameters(Dict):  # pylint: disable=too-many-ancestors
             Required("mini_batch_size"): int,
             Required("learning_rate"): float,
             Required("optimizer"): In(["Adam", "SGD"]),
+            Optional("checkpoints_each_epoch"): All(int, Range(min=1)),
+            Optional("num_workers"): All(int, Range(min=0)),
+            Optional("use_shuffling_for_samplers"): bool,
         }
     )
     descriptors_schema = Schema(
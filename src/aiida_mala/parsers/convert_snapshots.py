@@ -0,0 +1,80 @@
+"""
+Parsers provided by aiida_mala.
+
+Register parsers via the "aiida.parsers" entry point in setup.json.
+"""
+
+import json
+import os
+
+from aiida.common import exceptions
+from aiida.engine import ExitCode
+from aiida.parsers.parser import Parser
+from aiida.plugins import CalculationFactory, DataFactory
+from aiida_mala.data.snapshot_set import SNAPSHOT_FORMATS
+from aiida_mala.parsers.utils import get_profiles, get_timings
+
+ConvertSnapshotsCalculation = CalculationFactory("mala.convert_snapshots")
+SnapshotSet = DataFactory("mala.snapshot_set")
+
+
+class ConvertSnapshotsParser(Parser):
+    """
+    Parser class for parsing output of calculation.
+    """
+
+    def __init__(self, node):
+        """
+        Initialize Parser instance
+
+        Checks that the ProcessNode being passed was produced by a ConvertSnapshotsCalculation.
+
+        :param node: ProcessNode of calculation
+        :param type node: :class:`aiida.orm.nodes.process.process.ProcessNode`
+        """
+        super().__init__(node)
+        if not issubclass(node.process_class, ConvertSnapshotsCalculation):
+            raise exceptions.ParsingError("Can only parse ConvertSnapshotsCalculation")
+
+    def parse(self, **kwargs):
+        """
+        Parse outputs, store results in database.
+
+        :returns: an exit code, if parsing fails (or nothing if parsing succeeds)
+        """
+        retrieved_temporary_folder = kwargs.get("retrieved_temporary_folder", None)
+
+        timings = get_timings(self.retrieved, ConvertSnapshotsCalculation._TIMINGS_FILE)
+        if timings is not None:
+            self.out("timings", timings)
+        for label, profile in get_profiles(self.node, retrieved_temporary_folder).items():
+            self.out(label, profile)
+
+        # Check that folder content is as expected, the snapshots are retrieved into the temporary folder
+        files_retrieved = os.listdir(retrieved_temporary_folder) if retrieved_temporary_folder is not None else []
+        snapshots = self.node.inputs.snapshots.get_list()
+        suffixes = SNAPSHOT_FORMATS["openpmd"]
+        files_expected = [ConvertSnapshotsCalculation._MANIFEST_FILE] + [
+            f"{snapshot}{suffixes[kind]}" for snapshot in snapshots for kind in ("descriptors", "targets")
+        ]
+        # Note: set(A) <= set(B) checks whether A is a subset of B
+        if not set(files_expected) <= set(files_retrieved):
+            # A scheduler error, e.g. running out of walltime or memory, explains the missing files
+            if self.node.exit_status:
+                return self.node.exit_code
+            self.logger.error(f"Found files '{files_retrieved}', expected to find '{files_expected}'")
+            return self.exit_codes.ERROR_MISSING_OUTPUT_FILES
+
+        with open(os.path.join(retrieved_temporary_folder, ConvertSnapshotsCalculation._MANIFEST_FILE)) as handle:
+            headers = json.load(handle)
+
+        # add the snapshots, which are streamed into the repository of the node
+        self.logger.info(f"Parsing the snapshots {snapshots}")
+        snapshot_set = SnapshotSet(
+            folder=retrieved_temporary_folder, snapshots=snapshots, snapshot_format="openpmd", headers=headers
+        )
+        # record the parameters the snapshots were preprocessed with, so that they can be checked against the training
+        snapshot_set.base.attributes.set("parameters", self.node.inputs.parameters.get_dict())
+        self.out("snapshot_set", snapshot_set)
+
+        return ExitCode(0)
@@ -0,0 +1,163 @@
+"""
+Parsers provided by aiida_mala.
+
+Register parsers via the "aiida.parsers" entry point in setup.json.
+"""
+
+import json
+import os
+
+from aiida.common import exceptions
+from aiida.engine import ExitCode
+from aiida.orm import Dict, SinglefileData
+from aiida.parsers.parser import Parser
+from aiida.plugins import CalculationFactory
+from aiida_mala.calculations.packed import get_task_kind
+from aiida_mala.parsers.test_network import get_test_results
+from aiida_mala.parsers.train_network import get_epoch_summary, get_training_metrics
+from aiida_mala.parsers.utils import get_timings
+from aiida_mala.registry import get_model_record, record_model, record_test_errors
+
+PackedCalculation = CalculationFactory("mala.packed")
+TrainNetworkCalculation = CalculationFactory("mala.train_network")
+TestNetworkCalculation = CalculationFactory("mala.test_network")
+
+
+class PackedParser(Parser):
+    """
+    Parser class for parsing output of calculation.
+    """
+
+    def __init__(self, node):
+        """
+        Initialize Parser instance
+
+        Checks that the ProcessNode being passed was produced by a PackedCalculation.
+
+        :param node: ProcessNode of calculation
+        :param type node: :class:`aiida.orm.nodes.process.process.ProcessNode`
+        """
+        super().__init__(node)
+        if not issubclass(node.process_class, PackedCalculation):
+            raise exceptions.ParsingError("Can only parse PackedCalculation")
+
+    def parse(self, **kwargs):
+        """
+        Parse outputs, store results in database.
+
+        :returns: an exit code, if parsing fails (or nothing if parsing succeeds)
+        """
+        retrieved_temporary_folder = kwargs.get("retrieved_temporary_folder", None)
+
+        # The tasks file is written as soon as the first task finishes
+        files_retrieved = self.retrieved.list_object_names()
+        if PackedCalculation._TASKS_FILE not in files_retrieved:
+            # A scheduler error, e.g. running out of walltime or memory, explains the missing files
+            if self.node.exit_status:
+                return self.node.exit_code
+            self.logger.error(f"Found files '{files_retrieved}', expected to find '{PackedCalculation._TASKS_FILE}'")
+            return self.exit_codes.ERROR_MISSING_OUTPUT_FILES
+
+        with self.retrieved.open(PackedCalculation._TASKS_FILE, "r") as handle:
+            results = json.load(handle)
+
+        summary = {}
+        failed = []
+        for name, task in self.node.inputs.tasks.items():
+            directory = f"{PackedCalculation._TASKS_FOLDER}/{name}"
+            kind = get_task_kind(task)
+            if kind == "train":
+                outputs, complete = self._parse_training(directory, retrieved_temporary_folder)
+                if "model" in outputs:
+                    snapshots = (task["tr_snapshots"].get_list(), task["va_snapshots"].get_list())
+                    metrics = outputs["output_parameters"].get_dict()
+                    record_model(outputs["model"], get_model_record(task["parameters"].get_dict(), *snapshots, metrics))
+            else:
+                outputs, complete = self._parse_testing(directory, task["te_snapshots"].get_list())
+                if "observables" in outputs:
+                    record_test_errors(task["model"], outputs["observables"].get_dict())
+            for label, output in outputs.items():
+                self.out(f"tasks.{name}.{label}", output)
+
+            summary[name] = {"kind": kind, "exit_status": None, "wall_time": None, **results.get(name, {})}
+            if not complete or summary[name]["exit_status"] != 0:
+                failed.append(name)
+
+        self.out("task_summary", Dict(summary))
+
+        if failed:
+            return self.exit_codes.ERROR_FAILED_TASKS.format(tasks=failed)
+
+        return ExitCode(0)
+
+    def _list_object_names(self, path):
+        """Return the names of the retrieved files in a folder, which is empty if it was not retrieved."""
+        try:
+            return self.retrieved.list_object_names(path)
+        except (FileNotFoundError, NotADirectoryError):
+            return []
+
+    def _parse_training(self, directory, retrieved_temporary_folder):
+        """
+        Return the outputs of a training task, with the labels of the outputs of the ``TrainNetworkCalculation``.
+
+        :param directory: the directory of the task.
+        :param retrieved_temporary_folder: path of the folder with the files of the ``retrieve_temporary_list``.
+        :returns: tuple of the outputs and whether all of them were found.
+        """
+        outputs = {}
+        timings = get_timings(self.retrieved, f"{directory}/{TrainNetworkCalculation._TIMINGS_FILE}")
+        if timings is not None:
+            outputs["timings"] = timings
+
+        filenames = self._list_object_names(directory)
+        model_path = os.path.join(
+            retrieved_temporary_folder or "", directory, f"{TrainNetworkCalculation._DEFAULT_MODEL_NAME}.zip"
+        )
+        if "metrics.json" not in filenames or retrieved_temporary_folder is None or not os.path.isfile(model_path):
+            self.logger.error(f"Found files '{filenames}' of the task '{directory}', expected to find the model")
+            return outputs, False
+
+        # add the model, which is streamed into the repository of the node
+        self.logger.info(f"Parsing '{directory}'")
+        outputs["model"] = SinglefileData(file=model_path)
+        with self.retrieved.open(f"{directory}/metrics.json", "r") as handle:
+            output_parameters = json.load(handle)
+
+        if TrainNetworkCalculation._EPOCH_METRICS_FILE in filenames:
+            with self.retrieved.open(f"{directory}/{TrainNetworkCalculation._EPOCH_METRICS_FILE}", "r") as handle:
+                epochs = [json.loads(line) for line in handle if line.strip()]
+            if epochs:
+                outputs["training_metrics"] = get_training_metrics(epochs)
+                output_parameters.update(get_epoch_summary(epochs))
+        outputs["output_parameters"] = Dict(output_parameters)
+
+        return outputs, True
+
+    def _parse_testing(self, directory, te_snapshots):
+        """
+        Return the outputs of a testing task, with the labels of the outputs of the ``TestNetworkCalculation``.
+
+        :param directory: the directory of the task.
+        :param te_snapshots: names of the testing snapshots of the task.
+        :returns: tuple of the outputs and whether all snapshots were tested.
+        """
+        outputs = {}
+        timings = get_timings(self.retrieved, f"{directory}/{TestNetworkCalculation._TIMINGS_FILE}")
+        if timings is not None:
+            outputs["timings"] = timings
+
+        # Collect the snapshots whose testing finished, which are marked by their ``.json`` file
+        folder = f"{directory}/{TestNetworkCalculation._RESULTS_FOLDER}"
+        filenames = self._list_object_names(folder)
+        finished = [snapshot for snapshot in te_snapshots if f"{snapshot}.json" in filenames]
+        if not finished:
+            self.logger.error(f"Found files '{filenames}', expected to find the results of '{te_snapshots}'")
+            return outputs, False
+
+        observables, observable_arrays = get_test_results(self.retrieved, folder, finished, filenames, self.logger)
+        outputs["observables"] = Dict(observables)
+        if observable_arrays.get_arraynames():
+            outputs["observable_arrays"] = observable_arrays
+
+        return outputs, len(finished) == len(te_snapshots)
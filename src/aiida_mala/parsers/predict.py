@@ -0,0 +1,82 @@
+"""
+Parsers provided by aiida_mala.
+
+Register parsers via the "aiida.parsers" entry point in setup.json.
+"""
+
+import json
+
+import numpy as np
+from aiida.common import exceptions
+from aiida.engine import ExitCode
+from aiida.orm import ArrayData
+from aiida.parsers.parser import Parser
+from aiida.plugins import CalculationFactory
+from aiida_mala.parsers.utils import attach_npy_file
+
+PredictCalculation = CalculationFactory("mala.predict")
+
+
+class PredictParser(Parser):
+    """
+    Parser class for parsing output of calculation.
+    """
+
+    def __init__(self, node):
+        """
+        Initialize Parser instance
+
+        Checks that the ProcessNode being passed was produced by a PredictCalculation.
+
+        :param node: ProcessNode of calculation
+        :param type node: :class:`aiida.orm.nodes.process.process.ProcessNode`
+        """
+        super().__init__(node)
+        if not issubclass(node.process_class, PredictCalculation):
+            raise exceptions.ParsingError("Can only parse PredictCalculation")
+
+    def parse(self, **kwargs):
+        """
+        Parse outputs, store results in database.
+
+        :returns: an exit code, if parsing fails (or nothing if parsing succeeds)
+        """
+        # Collect the frames whose prediction finished, which are marked by their ``.json`` file
+        folder = PredictCalculation._RESULTS_FOLDER
+        files_retrieved = self.retrieved.list_object_names()
+        filenames = self.retrieved.list_object_names(folder) if folder in files_retrieved else []
+        with self.node.base.repository.open(PredictCalculation._STRUCTURES_FILE, "r") as handle:
+            frames = [frame["label"] for frame in json.load(handle)]
+        finished = [frame for frame in frames if f"{frame}.json" in filenames]
+
+        if not finished:
+            # A scheduler error, e.g. running out of walltime or memory, explains the missing files
+            if self.node.exit_status:
+                return self.node.exit_code
+            self.logger.error(f"Found files '{filenames}', expected to find the predictions of '{frames}'")
+            return self.exit_codes.ERROR_MISSING_OUTPUT_FILES
+
+        scalars = []
+        predictions = ArrayData()
+        for frame in finished:
+            self.logger.info(f"Parsing '{folder}/{frame}.json'")
+            with self.retrieved.open(f"{folder}/{frame}.json", "r") as handle:
+                scalars.append(json.load(handle))
+
+            # add the LDOS, which is stored without loading it into memory
+            filename = f"{frame}{PredictCalculation._ARRAY_SEPARATOR}ldos.npy"
+            if filename in filenames:
+                self.logger.info(f"Parsing '{folder}/{filename}'")
+                attach_npy_file(predictions, filename.removesuffix(".npy"), self.retrieved, f"{folder}/{filename}")
+
+        # An observable that could not be computed for a frame is NaN, so that the arrays stay ordered as the frames
+        for observable in sorted({observable for values in scalars for observable in values}):
+            predictions.set_array(observable, np.array([values.get(observable, np.nan) for values in scalars]))
+        predictions.base.attributes.set("frames", finished)
+        self.out("predictions", predictions)
+
+        missing = [frame for frame in frames if frame not in finished]
+        if missing:
+            return self.exit_codes.ERROR_INCOMPLETE_FRAMES.format(frames=missing)
+
+        return ExitCode(0)
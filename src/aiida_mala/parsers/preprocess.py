@@ -0,0 +1,65 @@
+"""
+Parsers provided by aiida_mala.
+
+Register parsers via the "aiida.parsers" entry point in setup.json.
+"""
+
+import os
+
+from aiida.common import exceptions
+from aiida.engine import ExitCode
+from aiida.parsers.parser import Parser
+from aiida.plugins import CalculationFactory, DataFactory
+from aiida_mala.data.snapshot_set import SNAPSHOT_FILES
+
+PreprocessCalculation = CalculationFactory("mala.preprocess")
+SnapshotSet = DataFactory("mala.snapshot_set")
+
+
+class PreprocessParser(Parser):
+    """
+    Parser class for parsing output of calculation.
+    """
+
+    def __init__(self, node):
+        """
+        Initialize Parser instance
+
+        Checks that the ProcessNode being passed was produced by a PreprocessCalculation.
+
+        :param node: ProcessNode of calculation
+        :param type node: :class:`aiida.orm.nodes.process.process.ProcessNode`
+        """
+        super().__init__(node)
+        if not issubclass(node.process_class, PreprocessCalculation):
+            raise exceptions.ParsingError("Can only parse PreprocessCalculation")
+
+    def parse(self, **kwargs):
+        """
+        Parse outputs, store results in database.
+
+        :returns: an exit code, if parsing fails (or nothing if parsing succeeds)
+        """
+        # Check that folder content is as expected, the snapshots are retrieved into the temporary folder
+        retrieved_temporary_folder = kwargs.get("retrieved_temporary_folder", None)
+        files_retrieved = os.listdir(retrieved_temporary_folder) if retrieved_temporary_folder is not None else []
+        snapshots = sorted(self.node.inputs.snapshots.keys())
+        files_expected = [
+            f"{snapshot}{SNAPSHOT_FILES[kind]}" for snapshot in snapshots for kind in ("descriptors", "targets")
+        ]
+        # Note: set(A) <= set(B) checks whether A is a subset of B
+        if not set(files_expected) <= set(files_retrieved):
+            # A scheduler error, e.g. running out of walltime or memory, explains the missing files
+            if self.node.exit_status:
+                return self.node.exit_code
+            self.logger.error(f"Found files '{files_retrieved}', expected to find '{files_expected}'")
+            return self.exit_codes.ERROR_MISSING_OUTPUT_FILES
+
+        # add the snapshots, which are streamed into the repository of the node
+        self.logger.info(f"Parsing the snapshots {snapshots}")
+        snapshot_set = SnapshotSet(folder=retrieved_temporary_folder, snapshots=snapshots)
+        # record the parameters the snapshots were preprocessed with, so that they can be checked against the training
+        snapshot_set.base.attributes.set("parameters", self.node.inputs.parameters.get_dict())
+        self.out("snapshot_set", snapshot_set)
+
+        return ExitCode(0)
@@ -8,13 +8,43 @@ import json
 
 from aiida.common import exceptions
 from aiida.engine import ExitCode
-from aiida.orm import Dict
+from aiida.orm import ArrayData, Dict
 from aiida.parsers.parser import Parser
 from aiida.plugins import CalculationFactory
+from aiida_mala.parsers.utils import attach_npy_file, get_profiles, get_timings
+from aiida_mala.registry import record_test_errors
 
 TestNetworkCalculation = CalculationFactory("mala.test_network")
 
 
+def get_test_results(retrieved, folder, snapshots, filenames, logger):
+    """Return the results of the tested snapshots.
+
+    :param retrieved: the ``retrieved`` folder of the calculation.
+    :param folder: path of the results folder in the ``retrieved`` folder.
+    :param snapshots: names of the snapshots whose testing finished.
+    :param filenames: names of the files in the results folder.
+    :param logger: the logger of the parser.
+    :returns: tuple of the dictionary of the scalar observables of every snapshot and the ``ArrayData`` of the
+        grid-sized observables.
+    """
+    observables = {}
+    observable_arrays = ArrayData()
+    for snapshot in snapshots:
+        logger.info(f"Parsing '{folder}/{snapshot}.json'")
+        with retrieved.open(f"{folder}/{snapshot}.json", "r") as handle:
+            observables[snapshot] = json.load(handle)
+
+        # add the grid-sized observables, which are stored without loading them into memory
+        prefix = f"{snapshot}{TestNetworkCalculation._ARRAY_SEPARATOR}"
+        for filename in filenames:
+            if filename.startswith(prefix) and filename.endswith(".npy"):
+                logger.info(f"Parsing '{folder}/{filename}'")
+                attach_npy_file(observable_arrays, filename.removesuffix(".npy"), retrieved, f"{folder}/{filename}")
+
+    return observables, observable_arrays
+
+
 class TestNetworkParser(Parser):
     """
     Parser class for parsing output of calculation.
@@ -41,18 +71,36 @@ class TestNetworkParser(Parser):
         """
         # output_filename = self.node.get_option("output_filename")
 
-        # Check that folder content is as expected
+        # The timings of the finished phases and the profiles are also output if the testing failed
+        timings = get_timings(self.retrieved, TestNetworkCalculation._TIMINGS_FILE)
+        if timings is not None:
+            self.out("timings", timings)
+        for label, profile in get_profiles(self.node, kwargs.get("retrieved_temporary_folder", None)).items():
+            self.out(label, profile)
+
+        # Collect the snapshots whose testing finished, which are marked by their ``.json`` file
+        folder = TestNetworkCalculation._RESULTS_FOLDER
         files_retrieved = self.retrieved.list_object_names()
-        files_expected = ["observables.json"]
-        # Note: set(A) <= set(B) checks whether A is a subset of B
-        if not set(files_expected) <= set(files_retrieved):
-            self.logger.error(f"Found files '{files_retrieved}', expected to find '{files_expected}'")
+        filenames = self.retrieved.list_object_names(folder) if folder in files_retrieved else []
+        te_snapshots = self.node.inputs.te_snapshots.get_list()
+        finished = [snapshot for snapshot in te_snapshots if f"{snapshot}.json" in filenames]
+
+        if not finished:
+            # A scheduler error, e.g. running out of walltime or memory, explains the missing files
+            if self.node.exit_status:
+                return self.node.exit_code
+            self.logger.error(f"Found files '{filenames}', expected to find the results of '{te_snapshots}'")
             return self.exit_codes.ERROR_MISSING_OUTPUT_FILES
 
-        # add output file
-        self.logger.info("Parsing 'observables.json'")
-        with self.retrieved.open("observables.json", "r") as handle:
-            output_node = Dict(json.load(handle))
-        self.out("observables", output_node)
+        observables, observable_arrays = get_test_results(self.retrieved, folder, finished, filenames, self.logger)
+        self.out("observables", Dict(observables))
+        if observable_arrays.get_arraynames():
+            self.out("observable_arrays", observable_arrays)
+        # record the errors in the registry, on the tested model
+        record_test_errors(self.node.inputs.model, observables)
+
+        missing = [snapshot for snapshot in te_snapshots if snapshot not in finished]
+        if missing:
+            return self.exit_codes.ERROR_INCOMPLETE_SNAPSHOTS.format(snapshots=missing)
 
         return ExitCode(0)
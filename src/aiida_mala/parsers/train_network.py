@@ -4,15 +4,60 @@ Parsers provided by aiida_mala.
 Register parsers via the "aiida.parsers" entry point in setup.json.
 """
 
+import json
+import math
+import os
+import posixpath
+
+import numpy as np
 from aiida.common import exceptions
 from aiida.engine import ExitCode
-from aiida.orm import SinglefileData
+from aiida.orm import ArrayData, Dict, RemoteData, SinglefileData
 from aiida.parsers.parser import Parser
 from aiida.plugins import CalculationFactory
+from aiida_mala.parsers.utils import get_profiles, get_timings
+from aiida_mala.registry import get_model_record, record_model
 
 TrainNetworkCalculation = CalculationFactory("mala.train_network")
 
 
+EPOCH_METRICS = ("epoch", "training_loss", "validation_loss", "epoch_time", "learning_rate")
+
+
+def get_epoch_summary(epochs):
+    """Summarize the metrics of the epochs of a training.
+
+    :param epochs: list with a dictionary of the metrics of every epoch.
+    :returns: dictionary with the number of epochs, the mean epoch time and the epoch with the lowest validation loss.
+    """
+    summary = {
+        "number_of_epochs": len(epochs),
+        "mean_epoch_time": sum(epoch["epoch_time"] for epoch in epochs) / len(epochs),
+    }
+    finished = [epoch for epoch in epochs if math.isfinite(epoch["validation_loss"])]
+    if finished:
+        best = min(finished, key=lambda epoch: epoch["validation_loss"])
+        summary["best_epoch"] = best["epoch"]
+        summary["best_validation_loss"] = best["validation_loss"]
+    return summary
+
+
+def get_training_metrics(epochs, ensemble=False):
+    """Return the metrics of the epochs of a training as arrays.
+
+    :param epochs: list with a dictionary of the metrics of every epoch.
+    :param ensemble: whether the epochs belong to the members of an ensemble, which are interleaved and labeled with
+        their ``member``.
+    :returns: ``ArrayData`` with an array of every metric in ``EPOCH_METRICS``.
+    """
+    training_metrics = ArrayData()
+    for key in EPOCH_METRICS:
+        training_metrics.set_array(key, np.array([epoch[key] for epoch in epochs]))
+    if ensemble:
+        training_metrics.set_array("member", np.array([epoch.get("member", -1) for epoch in epochs]))
+    return training_metrics
+
+
 class TrainNetworkParser(Parser):
     """
     Parser class for parsing output of calculation.
@@ -39,18 +84,91 @@ class TrainNetworkParser(Parser):
         """
         # output_filename = self.node.get_option("output_filename")
 
-        # Check that folder content is as expected
+        model_name = self.node.get_option("model_name")
+        model_filename = f"{model_name}.zip"
+        keep_model_remote = self.node.get_option("keep_model_remote")
+        ensemble_seeds = self.node.inputs.ensemble_seeds.get_list() if "ensemble_seeds" in self.node.inputs else []
+        member_filenames = [f"{model_name}_{index}.zip" for index in range(len(ensemble_seeds))]
+
+        # The timings of the finished phases and the profiles are also output if the training failed
+        timings = get_timings(self.retrieved, TrainNetworkCalculation._TIMINGS_FILE)
+        if timings is not None:
+            self.out("timings", timings)
+        for label, profile in get_profiles(self.node, kwargs.get("retrieved_temporary_folder", None)).items():
+            self.out(label, profile)
+
+        # Check that folder content is as expected, the model is retrieved into the temporary folder
         files_retrieved = self.retrieved.list_object_names()
-        files_expected = ["Be_model.zip"]
+        retrieved_temporary_folder = kwargs.get("retrieved_temporary_folder", None)
+        if retrieved_temporary_folder is not None:
+            files_retrieved += os.listdir(retrieved_temporary_folder)
+        files_expected = ["metrics.json"]
+        if keep_model_remote:
+            files_expected.append(TrainNetworkCalculation._MODEL_MANIFEST_FILE)
+        elif ensemble_seeds:
+            files_expected.extend(member_filenames)
+        else:
+            files_expected.append(model_filename)
         # Note: set(A) <= set(B) checks whether A is a subset of B
         if not set(files_expected) <= set(files_retrieved):
+            # A scheduler error, e.g. running out of walltime or memory, explains the missing files
+            if self.node.exit_status:
+                return self.node.exit_code
             self.logger.error(f"Found files '{files_retrieved}', expected to find '{files_expected}'")
             return self.exit_codes.ERROR_MISSING_OUTPUT_FILES
 
-        # add output file
-        self.logger.info(f"Parsing '{'Be_model.zip'}'")
-        with self.retrieved.open("Be_model.zip", "rb") as handle:
-            output_node = SinglefileData(file=handle)
-        self.out("model", output_node)
+        if keep_model_remote:
+            self.logger.info(f"Parsing '{TrainNetworkCalculation._MODEL_MANIFEST_FILE}'")
+            with self.retrieved.open(TrainNetworkCalculation._MODEL_MANIFEST_FILE, "r") as handle:
+                manifest = json.load(handle)
+            remote_path = posixpath.join(self.node.get_remote_workdir(), manifest["filename"])
+            self.out("model_manifest", Dict(manifest))
+            models = {"remote_model": RemoteData(computer=self.node.computer, remote_path=remote_path)}
+        elif ensemble_seeds:
+            # add the models of the members, which are streamed into the repository of their nodes
+            models = {}
+            for index, filename in enumerate(member_filenames):
+                self.logger.info(f"Parsing '{filename}'")
+                filepath = os.path.join(retrieved_temporary_folder, filename)
+                models[f"ensemble_models.member_{index}"] = SinglefileData(file=filepath)
+        else:
+            # add output file, which is streamed into the repository of the node
+            self.logger.info(f"Parsing '{model_filename}'")
+            models = {"model": SinglefileData(file=os.path.join(retrieved_temporary_folder, model_filename))}
+
+        self.logger.info("Parsing 'metrics.json'")
+        with self.retrieved.open("metrics.json", "r") as handle:
+            output_parameters = json.load(handle)
+        if ensemble_seeds:
+            members = output_parameters.pop("members")
+            for index, member in enumerate(members):
+                member["model"] = f"member_{index}"
+            self.out("ensemble", Dict({"members": members}))
+
+        filename = TrainNetworkCalculation._EPOCH_METRICS_FILE
+        if filename in files_retrieved:
+            self.logger.info(f"Parsing '{filename}'")
+            with self.retrieved.open(filename, "r") as handle:
+                epochs = [json.loads(line) for line in handle if line.strip()]
+            if epochs:
+                self.out("training_metrics", get_training_metrics(epochs, bool(ensemble_seeds)))
+                output_parameters.update(get_epoch_summary(epochs))
+
+        self.out("output_parameters", Dict(output_parameters))
+
+        # record the models in the registry, with the parameters and the snapshots of the training
+        parameters = self.node.inputs.parameters.get_dict()
+        snapshots = (self.node.inputs.tr_snapshots.get_list(), self.node.inputs.va_snapshots.get_list())
+        if ensemble_seeds:
+            for index, member in enumerate(members):
+                metrics = {"final_validation_loss": member["final_validation_loss"]}
+                record = get_model_record(parameters, *snapshots, metrics, seed=member["seed"])
+                record_model(models[f"ensemble_models.member_{index}"], record)
+        else:
+            fine_tuned = {"base_model": self.node.inputs.model.uuid} if "model" in self.node.inputs else {}
+            for model in models.values():
+                record_model(model, get_model_record(parameters, *snapshots, output_parameters, **fine_tuned))
+        for label, model in models.items():
+            self.out(label, model)
 
         return ExitCode(0)
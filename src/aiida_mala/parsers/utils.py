@@ -0,0 +1,59 @@
+"""
+Utilities shared by the parsers of aiida_mala.
+"""
+
+import json
+import os
+
+import numpy as np
+from aiida.orm import Dict, SinglefileData
+from aiida_mala.calculations.base import PROFILERS
+
+
+def attach_npy_file(array_data, name, node, path):
+    """Attach a ``.npy`` file in the repository of a node to an ``ArrayData`` node without loading it into memory.
+
+    The file is memory-mapped and stored with ``ArrayData.set_array``, which writes it in chunks.
+
+    :param array_data: the ``ArrayData`` node to attach the array to.
+    :param name: the name of the array.
+    :param node: the node whose repository contains the ``.npy`` file.
+    :param path: the path of the ``.npy`` file in the repository of ``node``.
+    """
+    with node.base.repository.as_path(path) as filepath:
+        array_data.set_array(name, np.load(filepath, mmap_mode="r"))
+
+
+def get_timings(retrieved, filename):
+    """Return the timings of the phases of a script, written by its ``phase`` context manager.
+
+    :param retrieved: the ``retrieved`` folder of the calculation.
+    :param filename: the path of the timings file in the ``retrieved`` folder.
+    :returns: a ``Dict`` with the wall time, number of calls and peak resident set size of every phase, or ``None`` if
+        the file was not retrieved.
+    """
+    try:
+        with retrieved.open(filename, "r") as handle:
+            return Dict(json.load(handle))
+    except FileNotFoundError:
+        return None
+
+
+def get_profiles(node, retrieved_temporary_folder):
+    """Return the profiles written by the profilers enabled for a calculation.
+
+    The profiles are streamed from the temporary folder into the repository of their nodes.
+
+    :param node: the node of the calculation.
+    :param retrieved_temporary_folder: path of the folder with the files of the ``retrieve_temporary_list``.
+    :returns: dictionary of the ``SinglefileData`` of the retrieved profiles, keyed by their output label.
+    """
+    profiles = {}
+    if retrieved_temporary_folder is None:
+        return profiles
+    for profiler in node.get_option("profilers") or []:
+        label, filename = PROFILERS[profiler]
+        filepath = os.path.join(retrieved_temporary_folder, filename)
+        if os.path.isfile(filepath):
+            profiles[label] = SinglefileData(file=filepath)
+    return profiles
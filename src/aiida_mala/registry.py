@@ -0,0 +1,323 @@
+"""
+Registry of the models trained with aiida_mala.
+
+The parsers record every trained model in the ``mala_model`` extra of its node, with the parameters of the training,
+which include the hyperparameters and the settings of the descriptors and targets, its snapshots and its metrics. The
+extras are stored as JSON in the database, so that the models can be filtered and ranked by any of their fields with a
+single query, without loading their nodes.
+
+The parsers of the testings record the errors of every tested snapshot and their means in the ``mala_test`` extra of
+the tested model, so that the models can be filtered and ranked by their errors in the same query. The testings of a
+model that are parsed at the same time, e.g. the shards of a sharded testing, may overwrite each other's errors, which
+``index_models`` recomputes from the ``observables`` outputs of all testings.
+
+The fields of a model are addressed by their dotted path in its record, e.g. ``descriptors.bispectrum_twojmax`` or
+``metrics.final_validation_loss``, and the mean errors of the testings by ``errors.{observable}``.
+
+The outputs of the tasks of a ``PackedCalculation`` are all linked to the inputs of every task. The registry only
+records the inputs of the task of a model, which are found by the link labels ``tasks__{name}__{label}``.
+"""
+
+import math
+import re
+
+from aiida import orm
+from aiida.plugins.entry_point import format_entry_point_string
+
+MODEL_EXTRA = "mala_model"
+TEST_EXTRA = "mala_test"
+# Prefix of the fields of the errors of the testings, which are recorded in the ``TEST_EXTRA``
+ERRORS_PREFIX = "errors."
+# Operators of the filters on the fields of the models and those of the ``QueryBuilder``
+FILTER_OPERATORS = {"<=": "<=", ">=": ">=", "!=": "!==", "=": "==", "<": "<", ">": ">"}
+FILTER_PATTERN = re.compile(r"^\s*([\w.]+)\s*(<=|>=|!=|=|<|>)\s*(.*?)\s*$")
+
+
+def get_model_record(parameters, tr_snapshots, va_snapshots, metrics, **kwargs):
+    """Return the record of a trained model.
+
+    :param parameters: dictionary of the ``TrainNetworkParameters`` of the training.
+    :param tr_snapshots: names of the training snapshots.
+    :param va_snapshots: names of the validation snapshots.
+    :param metrics: dictionary of the final losses of the training and the summary of its epochs, of which the finite
+        numbers are recorded.
+    :param kwargs: further fields of the record, e.g. the ``seed`` of a member of an ensemble.
+    :returns: dictionary with the groups of the ``parameters``, the snapshots and the ``metrics``.
+    """
+    return {
+        **parameters,
+        "tr_snapshots": list(tr_snapshots),
+        "va_snapshots": list(va_snapshots),
+        "metrics": {
+            key: value
+            for key, value in metrics.items()
+            if isinstance(value, (int, float)) and (not isinstance(value, float) or math.isfinite(value))
+        },
+        **kwargs,
+    }
+
+
+def get_snapshot_errors(results):
+    """Return the errors of the observables of a tested snapshot.
+
+    :param results: dictionary of the scalar observables of the snapshot, an observable is either an error or a pair of
+        an actual and a predicted value.
+    :returns: dictionary with the absolute error of every numerical observable.
+    """
+    errors = {}
+    for observable, value in results.items():
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            errors[observable] = abs(value)
+        elif isinstance(value, list) and len(value) == 2 and all(isinstance(item, (int, float)) for item in value):
+            errors[observable] = abs(value[1] - value[0])
+    return {observable: error for observable, error in errors.items() if math.isfinite(error)}
+
+
+def record_model(model, record):
+    """Record a trained model in the registry.
+
+    :param model: the unstored node of the model, whose extras are stored with the node.
+    :param record: the record of the model, see ``get_model_record``.
+    """
+    model.base.extras.set(MODEL_EXTRA, record)
+
+
+def get_test_record(snapshots):
+    """Return the record of the testings of a model.
+
+    :param snapshots: dictionary of the errors of every tested snapshot, see ``get_snapshot_errors``.
+    :returns: dictionary with the ``snapshots`` and the ``errors``, the mean errors over all snapshots tested with the
+        observable.
+    """
+    errors = {}
+    for snapshot_errors in snapshots.values():
+        for observable, error in snapshot_errors.items():
+            errors.setdefault(observable, []).append(error)
+    return {
+        "snapshots": snapshots,
+        "errors": {observable: sum(error) / len(error) for observable, error in errors.items()},
+    }
+
+
+def record_test_errors(model, observables):
+    """Add the errors of a testing to the record of the testings of a model.
+
+    The errors of every snapshot are kept, so that the testings of different snapshots add up, and a snapshot that is
+    tested again gets the errors of the latest testing.
+
+    :param model: the node of the tested model.
+    :param observables: dictionary of the scalar observables of every tested snapshot.
+    """
+    snapshots = model.base.extras.get(TEST_EXTRA, {}).get("snapshots", {})
+    for snapshot, results in observables.items():
+        snapshots[snapshot] = {**snapshots.get(snapshot, {}), **get_snapshot_errors(results)}
+    model.base.extras.set(TEST_EXTRA, get_test_record(snapshots))
+
+
+def get_field_key(field):
+    """Return the key of a field of the models in the ``QueryBuilder``.
+
+    :param field: dotted path of the field in the record of a model, or ``errors.{observable}``.
+    """
+    if field.startswith(ERRORS_PREFIX):
+        return f"extras.{TEST_EXTRA}.{field}"
+    return f"extras.{MODEL_EXTRA}.{field}"
+
+
+def parse_filter(expression):
+    """Parse a filter on a field of the models.
+
+    :param expression: the filter as ``{field}{operator}{value}``, e.g. ``descriptors.bispectrum_twojmax=10``. The value
+        is compared as a number or a boolean if it can be read as one, otherwise as a string.
+    :returns: tuple of the field, the operator of the ``QueryBuilder`` and the value.
+    :raises ValueError: if the expression does not contain an operator of ``FILTER_OPERATORS``.
+    """
+    match = FILTER_PATTERN.match(expression)
+    if match is None:
+        raise ValueError(f"the filter `{expression}` has to be of the form `field{{operator}}value`")
+    field, operator, value = match.groups()
+
+    for convert in (int, float):
+        try:
+            value = convert(value)
+            break
+        except ValueError:
+            pass
+    else:
+        value = {"true": True, "false": False}.get(value.lower(), value)
+
+    return field, FILTER_OPERATORS[operator], value
+
+
+def query_models(filters=(), order_by=None, descending=False, limit=None, project=()):
+    """Return the registered models, filtered, ranked and projected on their fields.
+
+    The models are filtered, ranked, limited and projected on the fields of their records and on the errors of their
+    testings in a single query, without loading their nodes. Ranking by a field only returns the models that have it,
+    e.g. that were tested with the observable.
+
+    :param filters: filters on the fields of the models, see ``parse_filter``.
+    :param order_by: optional numerical field by which the models are ranked, in ascending order unless
+        ``descending``.
+    :param descending: rank the models in descending order.
+    :param limit: optional maximum number of models.
+    :param project: fields of the models that are projected after their ``id`` and ``uuid``.
+    :returns: list of the rows of the models, with the ``id``, the ``uuid`` and the projected fields of a model.
+    """
+    model_filters = {"extras": {"has_key": MODEL_EXTRA}}
+    for field, operator_, value in (parse_filter(expression) for expression in filters):
+        model_filters.setdefault("and", []).append({get_field_key(field): {operator_: value}})
+    if order_by is not None:
+        parent, _, name = get_field_key(order_by).rpartition(".")
+        model_filters.setdefault("and", []).append({parent: {"has_key": name}})
+
+    builder = orm.QueryBuilder()
+    builder.append(
+        orm.Data,
+        tag="model",
+        filters=model_filters,
+        project=["id", "uuid"] + [get_field_key(field) for field in project],
+    )
+    if order_by is not None:
+        order = {"order": "desc" if descending else "asc", "cast": "f"}
+        builder.order_by({"model": [{get_field_key(order_by): order}]})
+    else:
+        builder.order_by({"model": [{"id": "asc"}]})
+    if limit is not None:
+        builder.limit(limit)
+
+    return builder.all()
+
+
+def get_test_errors(models=None):
+    """Return the records of the testings of the models, computed from the ``observables`` outputs of the testings.
+
+    The testings are applied in the order in which they were created, as by ``record_test_errors``. The model of a task
+    of a packed calculation is only paired with the observables of its own task.
+
+    :param models: optional ids of the models, defaults to all tested models.
+    :returns: dictionary with the records of the testings of every tested model, see ``get_test_record``, keyed by its
+        id.
+    """
+    builder = orm.QueryBuilder()
+    builder.append(orm.Data, tag="model", filters={"id": {"in": list(models)}} if models is not None else {})
+    builder.append(
+        orm.CalcJobNode,
+        tag="calculation",
+        with_incoming="model",
+        filters={"process_type": {"in": _get_process_types("mala.test_network", "mala.packed")}},
+        edge_filters={"label": {"or": [{"==": "model"}, {"like": "tasks__%__model"}]}},
+        edge_tag="model_link",
+        edge_project=["label"],
+    )
+    builder.append(
+        orm.Dict,
+        tag="observables",
+        with_incoming="calculation",
+        edge_filters={"label": {"or": [{"==": "observables"}, {"like": "tasks__%__observables"}]}},
+        edge_tag="observables_link",
+        edge_project=["label"],
+        project=["attributes"],
+    )
+    builder.add_projection("model", "id")
+    builder.order_by({"calculation": [{"id": "asc"}]})
+
+    snapshots = {}
+    for row in builder.dict():
+        if get_task_name(row["model_link"]["label"]) != get_task_name(row["observables_link"]["label"]):
+            continue
+        model_snapshots = snapshots.setdefault(row["model"]["id"], {})
+        for snapshot, results in row["observables"]["attributes"].items():
+            model_snapshots[snapshot] = {**model_snapshots.get(snapshot, {}), **get_snapshot_errors(results)}
+
+    return {pk: get_test_record(model_snapshots) for pk, model_snapshots in snapshots.items()}
+
+
+def get_task_name(link_label):
+    """Return the name of the task of a packed calculation from the label of a link, or ``None`` for other links.
+
+    :param link_label: label of an input or output link, ``tasks__{name}__{label}`` for those of a task.
+    """
+    if link_label.startswith("tasks__"):
+        return link_label.split("__")[1]
+    return None
+
+
+def _get_training_record(calculation, link_label):
+    """Return the record of a model output by a finished training, or ``None`` if its metrics are missing.
+
+    The record of a model output by a task of a packed calculation only covers the inputs of its own task.
+    """
+    name = get_task_name(link_label)
+    if name is not None:
+        task = calculation.inputs.tasks[name]
+        outputs = calculation.outputs.tasks.get(name, {})
+        if "output_parameters" not in outputs:
+            return None
+        snapshots = (task["tr_snapshots"].get_list(), task["va_snapshots"].get_list())
+        return get_model_record(task["parameters"].get_dict(), *snapshots, outputs["output_parameters"].get_dict())
+
+    parameters = calculation.inputs.parameters.get_dict()
+    snapshots = (calculation.inputs.tr_snapshots.get_list(), calculation.inputs.va_snapshots.get_list())
+    if link_label.startswith("ensemble_models__"):
+        if "ensemble" not in calculation.outputs:
+            return None
+        member = calculation.outputs.ensemble["members"][int(link_label.rsplit("_", 1)[1])]
+        metrics = {"final_validation_loss": member["final_validation_loss"]}
+        return get_model_record(parameters, *snapshots, metrics, seed=member["seed"])
+
+    if "output_parameters" not in calculation.outputs:
+        return None
+    fine_tuned = {"base_model": calculation.inputs.model.uuid} if "model" in calculation.inputs else {}
+    return get_model_record(parameters, *snapshots, calculation.outputs.output_parameters.get_dict(), **fine_tuned)
+
+
+def _get_process_types(*entry_point_names):
+    """Return the process types of the calculations with the given entry point names."""
+    return [format_entry_point_string("aiida.calculations", name) for name in entry_point_names]
+
+
+def index_models():
+    """Record the models of the finished trainings that are not in the registry yet and the errors of all testings.
+
+    The models of the trainings that were parsed before the registry existed are added, so that the registry covers the
+    whole database. Models that are already recorded are skipped, so that the indexing can be repeated. The records of
+    the testings of all tested models are recomputed from the outputs of their testings.
+
+    :returns: tuple of the number of recorded models and the number of tested models.
+    """
+    builder = orm.QueryBuilder()
+    builder.append(
+        orm.CalcJobNode,
+        tag="calculation",
+        filters={"process_type": {"in": _get_process_types("mala.train_network", "mala.packed")}},
+        project=["*"],
+    )
+    builder.append(
+        orm.Data,
+        with_incoming="calculation",
+        filters={"extras": {"!has_key": MODEL_EXTRA}},
+        edge_filters={
+            "label": {
+                "or": [
+                    {"in": ["model", "remote_model"]},
+                    {"like": "ensemble_models__member_%"},
+                    {"like": "tasks__%__model"},
+                ]
+            }
+        },
+        edge_project=["label"],
+        project=["*"],
+    )
+    trained = 0
+    for calculation, model, link_label in builder.all():
+        record = _get_training_record(calculation, link_label)
+        if record is not None:
+            record_model(model, record)
+            trained += 1
+
+    test_errors = get_test_errors()
+    for pk, test in test_errors.items():
+        orm.load_node(pk).base.extras.set(TEST_EXTRA, test)
+
+    return trained, len(test_errors)
@@ -0,0 +1,224 @@
+"""
+Warm worker that runs the scripts of the calculations in an interpreter with MALA already imported.
+
+Starting a fresh interpreter that imports ``mala`` and ``torch`` takes seconds, which dominates the runtime of short
+jobs. The worker imports them once and forks a process for every script, which inherits the imported modules but none
+of the state of earlier scripts. The script runs in the working directory and with the environment of the job, writes
+to its standard streams and its exit status is returned to the job, so that the results are retrieved and parsed as
+usual. If the job is killed, e.g. by the scheduler, the script and the processes it started are killed as well.
+
+The module only depends on the standard library, so that the calculations can copy it into the working directory to
+connect to the worker. Start the worker on the compute host with::
+
+    python -m aiida_mala.worker serve --socket /tmp/mala-worker.sock
+"""
+
+import argparse
+import importlib
+import json
+import os
+import runpy
+import select
+import signal
+import socket
+import struct
+import sys
+import traceback
+
+DEFAULT_PRELOAD = ("mala",)
+# Interval in seconds at which the handler of a connection checks whether the script finished
+POLL_INTERVAL = 0.1
+
+
+def _receive_exactly(connection, size):
+    """Receive exactly ``size`` bytes from a connection."""
+    data = b""
+    while len(data) < size:
+        chunk = connection.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("the connection was closed before the message was complete")
+        data += chunk
+    return data
+
+
+def send_message(connection, message):
+    """Send a JSON message prefixed with its length."""
+    data = json.dumps(message).encode()
+    connection.sendall(struct.pack("!I", len(data)) + data)
+
+
+def receive_message(connection):
+    """Receive a JSON message prefixed with its length."""
+    (size,) = struct.unpack("!I", _receive_exactly(connection, 4))
+    return json.loads(_receive_exactly(connection, size))
+
+
+def run_script(script, arguments=()):
+    """Run a script as ``__main__`` in the current interpreter and return its exit status."""
+    sys.argv = [script, *arguments]
+    try:
+        runpy.run_path(script, run_name="__main__")
+    except SystemExit as exception:
+        if exception.code is None:
+            return 0
+        if isinstance(exception.code, int):
+            return exception.code
+        print(exception.code, file=sys.stderr)
+        return 1
+    except BaseException:  # pylint: disable=broad-exception-caught
+        traceback.print_exc()
+        return 1
+    return 0
+
+
+def _run_request(request, fds):
+    """Run the script of a request in the forked process and exit with its status."""
+    status = 1
+    try:
+        os.setpgid(0, 0)
+        for fd, stream in zip(fds, (0, 1, 2)):
+            os.dup2(fd, stream)
+            os.close(fd)
+        os.chdir(request["cwd"])
+        os.environ.clear()
+        os.environ.update(request["environment"])
+        status = run_script(request["script"], request["arguments"])
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(status)  # pylint: disable=protected-access
+
+
+def _handle_connection(connection):
+    """Run the script requested over a connection in a forked process and send back its exit status.
+
+    If the connection is closed before the script finished, i.e. the client was killed, the process group of the script
+    is killed.
+    """
+    _, fds, _, _ = socket.recv_fds(connection, 1, 3)
+    request = receive_message(connection)
+
+    pid = os.fork()
+    if pid == 0:
+        connection.close()
+        _run_request(request, fds)
+
+    for fd in fds:
+        os.close(fd)
+    # The script runs in its own process group, so that it can be killed together with the processes it started
+    try:
+        os.setpgid(pid, pid)
+    except OSError:
+        pass
+
+    # The client sends nothing while the script runs, so that the connection only becomes readable once it is closed
+    poller = select.poll()
+    poller.register(connection, select.POLLIN | select.POLLHUP)
+    while True:
+        finished, wait_status = os.waitpid(pid, os.WNOHANG)
+        if finished:
+            break
+        if poller.poll(POLL_INTERVAL * 1000):
+            os.killpg(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+            return
+
+    status = os.waitstatus_to_exitcode(wait_status)
+    # Follow the convention of the shell for scripts that were killed by a signal
+    send_message(connection, {"exit_status": 128 - status if status < 0 else status})
+
+
+def serve(socket_path, preload=DEFAULT_PRELOAD):
+    """Import the modules to preload and run the requested scripts until the worker is stopped.
+
+    Every connection is handled in a forked process, so that several scripts can run at the same time.
+
+    :param socket_path: path of the Unix socket the worker listens on.
+    :param preload: names of the modules that are imported once before any script is run.
+    """
+    for module in preload:
+        importlib.import_module(module)
+
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+
+    # The handlers are reaped automatically
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as server:
+        server.bind(socket_path)
+        server.listen()
+        print(f"worker listening on {socket_path}", flush=True)
+        while True:
+            connection, _ = server.accept()
+            sys.stdout.flush()
+            sys.stderr.flush()
+            if os.fork() == 0:
+                server.close()
+                signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+                try:
+                    with connection:
+                        _handle_connection(connection)
+                finally:
+                    os._exit(0)  # pylint: disable=protected-access
+            connection.close()
+
+
+def run(socket_path, script, arguments=()):
+    """Run a script in the worker and return its exit status.
+
+    The standard streams of the current process are passed to the worker, so that the output of the script ends up
+    where it would if the script were run directly. If no worker is listening, the script is run in this interpreter.
+
+    :param socket_path: path of the Unix socket the worker listens on.
+    :param script: path of the script to run.
+    :param arguments: command line arguments of the script.
+    """
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        connection.connect(socket_path)
+    except OSError as exception:
+        connection.close()
+        print(f"no worker at `{socket_path}` ({exception}), running `{script}` directly", file=sys.stderr)
+        return run_script(script, arguments)
+
+    with connection:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        socket.send_fds(connection, [b"\0"], [0, 1, 2])
+        send_message(
+            connection,
+            {
+                "script": os.path.abspath(script),
+                "arguments": list(arguments),
+                "cwd": os.getcwd(),
+                "environment": dict(os.environ),
+            },
+        )
+        return receive_message(connection)["exit_status"]
+
+
+def main(argv=None):
+    """Command line interface of the worker."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    serve_parser = subparsers.add_parser("serve", help="Start a worker.")
+    serve_parser.add_argument("--socket", required=True, help="Path of the Unix socket the worker listens on.")
+    serve_parser.add_argument(
+        "--preload", nargs="*", default=list(DEFAULT_PRELOAD), help="Modules that are imported once by the worker."
+    )
+
+    run_parser = subparsers.add_parser("run", help="Run a script in the worker.")
+    run_parser.add_argument("--socket", required=True, help="Path of the Unix socket the worker listens on.")
+    run_parser.add_argument("script", help="Path of the script to run.")
+    run_parser.add_argument("arguments", nargs=argparse.REMAINDER, help="Command line arguments of the script.")
+
+    args = parser.parse_args(argv)
+    if args.command == "serve":
+        serve(args.socket, args.preload)
+        return 0
+    return run(args.socket, args.script, args.arguments)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,353 @@
+"""
+Workflows provided by aiida_mala.
+
+Register workflows via the "aiida.workflows" entry point in setup.json.
+"""
+
+import copy
+import math
+import random
+
+from aiida import orm
+from aiida.common import AttributeDict
+from aiida.engine import ToContext, WorkChain, calcfunction, while_
+from aiida.plugins import CalculationFactory, DataFactory
+from voluptuous import All, Any, Invalid, Length, Optional, Required, Schema
+
+TrainNetworkCalculation = CalculationFactory("mala.train_network")
+TrainNetworkParameters = DataFactory("mala.train_network")
+
+SEARCHABLE_GROUPS = ("data", "network", "running")
+
+range_schema = Schema(
+    {
+        Required("low"): Any(int, float),
+        Required("high"): Any(int, float),
+        Optional("log", default=False): bool,
+        Optional("type", default="float"): Any("float", "int"),
+    }
+)
+search_space_schema = Schema(
+    {Optional(group): {str: Any(All(list, Length(min=1)), range_schema)} for group in SEARCHABLE_GROUPS}
+)
+
+
+def validate_search_space(value, _):
+    """Validate the ``search_space`` input."""
+    if value is None:
+        return None
+
+    try:
+        search_space = search_space_schema(value.get_dict())
+    except Invalid as exception:
+        return f"Invalid search space: {exception}"
+
+    for group, dimensions in search_space.items():
+        for key, dimension in dimensions.items():
+            if isinstance(dimension, dict) and dimension["low"] > dimension["high"]:
+                return f"The lower bound of `{group}.{key}` is larger than its upper bound."
+            if isinstance(dimension, dict) and dimension["log"] and dimension["low"] <= 0:
+                return f"The bounds of `{group}.{key}` have to be positive for a logarithmic range."
+
+    if not any(search_space.values()):
+        return "The search space has to contain at least one dimension."
+
+    return None
+
+
+def validate_positive(value, _):
+    """Validate that an ``Int`` input is at least one."""
+    if value is not None and value.value < 1:
+        return "The value has to be at least one."
+    return None
+
+
+def validate_reduction_factor(value, _):
+    """Validate the ``reduction_factor`` input."""
+    if value is not None and value.value < 2:
+        return "The reduction factor has to be at least two."
+    return None
+
+
+def sample_trials(search_space, num_trials, seed):
+    """Draw the hyperparameters of the trials from the search space.
+
+    A list in the search space is a set of choices, a dictionary with ``low`` and ``high`` a (logarithmic) range.
+
+    :param search_space: dictionary of the searched dimensions per parameter group.
+    :param num_trials: number of trials to sample.
+    :param seed: seed of the random number generator.
+    :returns: list with one dictionary ``{group: {key: value}}`` per trial.
+    """
+    search_space = search_space_schema(search_space)
+    rng = random.Random(seed)
+
+    trials = []
+    for _ in range(num_trials):
+        trial = {}
+        for group, dimensions in sorted(search_space.items()):
+            for key, dimension in sorted(dimensions.items()):
+                if isinstance(dimension, list):
+                    value = rng.choice(dimension)
+                elif dimension["log"]:
+                    value = math.exp(rng.uniform(math.log(dimension["low"]), math.log(dimension["high"])))
+                else:
+                    value = rng.uniform(dimension["low"], dimension["high"])
+
+                if isinstance(dimension, dict) and dimension["type"] == "int":
+                    value = round(value)
+                trial.setdefault(group, {})[key] = value
+        trials.append(trial)
+
+    return trials
+
+
+def get_rung_epochs(max_number_epochs, reduction_factor, num_rungs):
+    """Return the number of epochs each rung of the successive halving trains for.
+
+    The last rung trains for ``max_number_epochs``, every earlier rung for ``reduction_factor`` times fewer epochs.
+    """
+    return [max(1, max_number_epochs // reduction_factor ** (num_rungs - 1 - rung)) for rung in range(num_rungs)]
+
+
+@calcfunction
+def collect_trials(search_space, **kwargs):
+    """Collect the sampled hyperparameters and final losses of all trials into a table.
+
+    The keyword arguments are ``parameters_{trial}_{rung}`` for every launched training and
+    ``output_parameters_{trial}_{rung}`` for every training that finished successfully.
+    """
+    rows = []
+    for key, node in kwargs.items():
+        if not key.startswith("parameters_"):
+            continue
+        trial, rung = key.split("_")[1:]
+        parameters = node.get_dict()
+        output_parameters = kwargs.get(f"output_{key}", None)
+        rows.append(
+            {
+                "trial": int(trial),
+                "rung": int(rung),
+                "max_number_epochs": parameters["running"]["max_number_epochs"],
+                "hyperparameters": {
+                    group: {name: parameters[group][name] for name in dimensions}
+                    for group, dimensions in search_space.get_dict().items()
+                },
+                "final_validation_loss": (
+                    output_parameters["final_validation_loss"] if output_parameters is not None else None
+                ),
+            }
+        )
+
+    return orm.Dict({"trials": sorted(rows, key=lambda row: (row["rung"], row["trial"]))})
+
+
+class HyperparameterOptimizationWorkChain(WorkChain):
+    """
+    Workchain that optimizes the hyperparameters of a training by running concurrent trials.
+
+    The trials are sampled from a search space over the ``data``, ``network`` and ``running`` parameters. With more
+    than one rung, successive halving prunes the trials: all trials first train for a reduced number of epochs and only
+    the best ``1 / reduction_factor`` of them are promoted to the next rung, which trains for ``reduction_factor`` times
+    more epochs. A promoted trial resumes from the last checkpoint of its previous rung, so that it only trains the
+    additional epochs. The trials are ranked by their final validation loss.
+
+    At most ``max_concurrent`` trials train at the same time. The workchain waits for the oldest running trial, and
+    once it finished, launches the next trials of the rung for it and for every other trial that finished in the
+    meantime, so that a window of trials keeps running instead of waiting for a whole batch.
+    """
+
+    @classmethod
+    def define(cls, spec):
+        """Define inputs, outputs and outline of the workchain."""
+        super().define(spec)
+
+        spec.expose_inputs(TrainNetworkCalculation, namespace="train")
+        spec.input(
+            "search_space",
+            valid_type=orm.Dict,
+            validator=validate_search_space,
+            help="Searched hyperparameters per parameter group, e.g. `{'running': {'learning_rate': "
+            "{'low': 1e-5, 'high': 1e-2, 'log': True}, 'optimizer': ['Adam', 'SGD']}}`.",
+        )
+        spec.input(
+            "num_trials",
+            valid_type=orm.Int,
+            default=lambda: orm.Int(8),
+            validator=validate_positive,
+            help="Number of trials sampled from the search space.",
+        )
+        spec.input(
+            "max_concurrent",
+            valid_type=orm.Int,
+            required=False,
+            validator=validate_positive,
+            help="Maximum number of trials that train at the same time. By default all trials of a rung run at once.",
+        )
+        spec.input(
+            "num_rungs",
+            valid_type=orm.Int,
+            default=lambda: orm.Int(1),
+            validator=validate_positive,
+            help="Number of rungs of the successive halving. With a single rung no trial is pruned.",
+        )
+        spec.input(
+            "reduction_factor",
+            valid_type=orm.Int,
+            default=lambda: orm.Int(3),
+            validator=validate_reduction_factor,
+            help="Factor by which the number of trials is reduced and the number of epochs increased between rungs.",
+        )
+        spec.input(
+            "seed",
+            valid_type=orm.Int,
+            default=lambda: orm.Int(0),
+            help="Seed of the random sampling of the trials.",
+        )
+
+        spec.outline(
+            cls.setup,
+            while_(cls.should_run_trials)(cls.run_trials),
+            cls.results,
+        )
+
+        spec.output(
+            "best_model",
+            valid_type=(orm.SinglefileData, orm.RemoteData),
+            help="The model of the best trial, which is left on the remote computer with `keep_model_remote`.",
+        )
+        spec.output(
+            "best_parameters", valid_type=TrainNetworkParameters, help="The training parameters of the best trial."
+        )
+        spec.output("trials", valid_type=orm.Dict, help="Table with the hyperparameters and losses of all trials.")
+
+        spec.exit_code(
+            401,
+            "ERROR_INVALID_TRIAL_PARAMETERS",
+            message="The parameters of a sampled trial are invalid: {exception}",
+        )
+        spec.exit_code(
+            402,
+            "ERROR_ALL_TRIALS_FAILED",
+            message="None of the trials finished successfully.",
+        )
+
+    def setup(self):
+        """Sample the trials and prepare the first rung."""
+        base_parameters = self.inputs.train.parameters.get_dict()
+        max_number_epochs = base_parameters["running"]["max_number_epochs"]
+        self.ctx.rung_epochs = get_rung_epochs(
+            max_number_epochs, self.inputs.reduction_factor.value, self.inputs.num_rungs.value
+        )
+
+        self.ctx.trials = []
+        for hyperparameters in sample_trials(
+            self.inputs.search_space.get_dict(), self.inputs.num_trials.value, self.inputs.seed.value
+        ):
+            parameters = copy.deepcopy(base_parameters)
+            for group, values in hyperparameters.items():
+                parameters[group].update(values)
+            try:
+                TrainNetworkParameters.schema(parameters)
+            except Invalid as exception:
+                return self.exit_codes.ERROR_INVALID_TRIAL_PARAMETERS.format(exception=exception)
+            self.ctx.trials.append(parameters)
+
+        self.ctx.rung = 0
+        self.ctx.pending = list(range(len(self.ctx.trials)))
+        self.ctx.running = []
+        self.ctx.launched = []
+        self.ctx.losses = {}
+
+    def should_run_trials(self):
+        """Return whether there are trials left to train in the current rung or still running."""
+        return bool(self.ctx.pending or self.ctx.running)
+
+    def run_trials(self):
+        """Record the losses of the trials that finished and launch the next trials of the current rung.
+
+        At most ``max_concurrent`` trials are running, the step runs again once the oldest of them finished. Once all
+        trials of the rung finished, the best ones are promoted to the next rung.
+        """
+        for trial in list(self.ctx.running):
+            node = self.ctx[f"trial_{trial}_rung_{self.ctx.rung}"]
+            if not node.is_terminated:
+                continue
+            self.ctx.running.remove(trial)
+            if node.is_finished_ok:
+                self.ctx.losses[trial] = node.outputs.output_parameters["final_validation_loss"]
+            else:
+                self.report(f"trial {trial} {node.process_label}<{node.pk}> failed with exit status {node.exit_status}")
+                self.ctx.losses[trial] = None
+
+        if not self.ctx.pending and not self.ctx.running:
+            result = self.promote_trials()
+            if result is not None:
+                return result
+
+        max_concurrent = self.inputs.max_concurrent.value if "max_concurrent" in self.inputs else len(self.ctx.trials)
+        while self.ctx.pending and len(self.ctx.running) < max_concurrent:
+            trial = self.ctx.pending.pop(0)
+            parameters = copy.deepcopy(self.ctx.trials[trial])
+            parameters["running"]["max_number_epochs"] = self.ctx.rung_epochs[self.ctx.rung]
+            # Unless set otherwise, a trial writes a checkpoint at the end of the rung to resume from if promoted
+            previous_epochs = self.ctx.rung_epochs[self.ctx.rung - 1] if self.ctx.rung > 0 else 0
+            parameters["running"].setdefault(
+                "checkpoints_each_epoch", max(1, self.ctx.rung_epochs[self.ctx.rung] - previous_epochs)
+            )
+
+            inputs = AttributeDict(self.exposed_inputs(TrainNetworkCalculation, namespace="train"))
+            inputs.parameters = TrainNetworkParameters(parameters)
+            inputs.metadata.call_link_label = f"trial_{trial}_rung_{self.ctx.rung}"
+            if self.ctx.rung > 0:
+                # The promoted trial resumes from the checkpoint of the previous rung instead of retraining its epochs
+                inputs.parent_folder = self.ctx[f"trial_{trial}_rung_{self.ctx.rung - 1}"].outputs.remote_folder
+
+            node = self.submit(TrainNetworkCalculation, **inputs)
+            self.report(f"launched {node.process_label}<{node.pk}> for trial {trial} in rung {self.ctx.rung}")
+            self.ctx[f"trial_{trial}_rung_{self.ctx.rung}"] = node
+            self.ctx.running.append(trial)
+            self.ctx.launched.append((trial, self.ctx.rung))
+
+        if not self.ctx.running:
+            return None
+
+        # Only the oldest trial is awaited, the others stay in the window and are recorded at the next step
+        oldest = f"trial_{self.ctx.running[0]}_rung_{self.ctx.rung}"
+        return ToContext(**{oldest: self.ctx[oldest]})
+
+    def promote_trials(self):
+        """Rank the trials of the finished rung and promote the best trials to the next rung."""
+        finished = sorted(
+            (loss, trial) for trial, loss in self.ctx.losses.items() if loss is not None and math.isfinite(loss)
+        )
+        if not finished:
+            return self.exit_codes.ERROR_ALL_TRIALS_FAILED
+
+        self.ctx.ranking = [trial for _, trial in finished]
+
+        if self.ctx.rung < len(self.ctx.rung_epochs) - 1:
+            num_promoted = max(1, math.ceil(len(self.ctx.losses) / self.inputs.reduction_factor.value))
+            self.ctx.pending = sorted(self.ctx.ranking[:num_promoted])
+            self.ctx.rung += 1
+            self.ctx.losses = {}
+            self.report(f"promoted trials {self.ctx.pending} to rung {self.ctx.rung}")
+
+        return None
+
+    def results(self):
+        """Attach the best model and the table of all trials."""
+        best_trial = self.ctx.ranking[0]
+        best = self.ctx[f"trial_{best_trial}_rung_{self.ctx.rung}"]
+        self.report(f"best trial is {best_trial} with a final validation loss of {self.ctx.losses[best_trial]}")
+
+        kwargs = {}
+        for trial, rung in self.ctx.launched:
+            node = self.ctx[f"trial_{trial}_rung_{rung}"]
+            kwargs[f"parameters_{trial}_{rung}"] = node.inputs.parameters
+            if node.is_finished_ok:
+                kwargs[f"output_parameters_{trial}_{rung}"] = node.outputs.output_parameters
+
+        self.out("best_model", best.outputs.model if "model" in best.outputs else best.outputs.remote_model)
+        self.out("best_parameters", best.inputs.parameters)
+        self.out("trials", collect_trials(search_space=self.inputs.search_space, **kwargs))
@@ -0,0 +1,91 @@
+"""
+Workflows provided by aiida_mala.
+
+Register workflows via the "aiida.workflows" entry point in setup.json.
+"""
+
+from aiida import orm
+from aiida.engine import ToContext, WorkChain, workfunction
+from aiida.plugins import CalculationFactory
+
+PackedCalculation = CalculationFactory("mala.packed")
+
+
+@workfunction
+def get_task_outputs(**kwargs):
+    """Return the outputs of a task of a packed calculation, so that they are linked to the inputs of the task only.
+
+    The keyword arguments are the namespaces ``task``, with the inputs of the task, and ``outputs``, with the outputs
+    of the packed calculation in the namespace of the task. The outputs are returned as they are, without copying them.
+    """
+    return dict(kwargs["outputs"])
+
+
+class PackedWorkChain(WorkChain):
+    """
+    Workchain that runs many small trainings and testings in a single job of a ``PackedCalculation``.
+
+    The packed calculation creates the outputs of all its tasks, which are thus linked to the inputs of every task.
+    The outputs of every task are returned through a ``get_task_outputs`` workfunction called ``task_{name}``, which
+    only takes the inputs and the outputs of that task, so that the provenance of a task is that of a single training
+    or testing.
+    """
+
+    @classmethod
+    def define(cls, spec):
+        """Define inputs, outputs and outline of the workchain."""
+        super().define(spec)
+
+        spec.expose_inputs(PackedCalculation, namespace="packed")
+
+        spec.outline(
+            cls.run_packed,
+            cls.results,
+        )
+
+        spec.output_namespace(
+            "tasks",
+            valid_type=orm.Data,
+            dynamic=True,
+            help="The outputs of every task, with the labels of the outputs of the training or the testing.",
+        )
+        spec.output(
+            "task_summary",
+            valid_type=orm.Dict,
+            required=False,
+            help="The kind, exit status and wall time of every task.",
+        )
+
+        spec.exit_code(
+            401,
+            "ERROR_PACKED_CALCULATION_FAILED",
+            message="The packed calculation failed with exit status {exit_status}, the outputs of the tasks that "
+            "finished were returned.",
+        )
+
+    def run_packed(self):
+        """Run the packed calculation."""
+        inputs = self.exposed_inputs(PackedCalculation, namespace="packed")
+        node = self.submit(PackedCalculation, **inputs)
+        self.report(f"launched {node.process_label}<{node.pk}> with the tasks {list(inputs['tasks'])}")
+        return ToContext(packed=node)
+
+    def results(self):
+        """Return the outputs of every task through its own workfunction."""
+        node = self.ctx.packed
+        outputs = node.outputs.tasks if "tasks" in node.outputs else {}
+        for name, task in node.inputs.tasks.items():
+            if name not in outputs:
+                continue
+            returned = get_task_outputs(
+                task=dict(task), outputs=dict(outputs[name]), metadata={"call_link_label": f"task_{name}"}
+            )
+            for label, output in returned.items():
+                self.out(f"tasks.{name}.{label}", output)
+
+        if "task_summary" in node.outputs:
+            self.out("task_summary", node.outputs.task_summary)
+
+        if not node.is_finished_ok:
+            self.report(f"{node.process_label}<{node.pk}> failed with exit status {node.exit_status}")
+            return self.exit_codes.ERROR_PACKED_CALCULATION_FAILED.format(exit_status=node.exit_status)
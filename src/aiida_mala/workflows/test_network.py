@@ -0,0 +1,222 @@
+"""
+Workflows provided by aiida_mala.
+
+Register workflows via the "aiida.workflows" entry point in setup.json.
+"""
+
+from aiida import orm
+from aiida.common import AttributeDict
+from aiida.engine import ToContext, WorkChain, calcfunction, while_
+from aiida.plugins import CalculationFactory
+from aiida_mala.parsers.utils import attach_npy_file
+
+TestNetworkCalculation = CalculationFactory("mala.test_network")
+
+
+def validate_te_snapshots(value, _):
+    """Validate the ``te_snapshots`` input."""
+    if value is not None and not value.get_list():
+        return "At least one testing snapshot has to be specified."
+    return None
+
+
+def validate_num_shards(value, _):
+    """Validate the ``num_shards`` input."""
+    if value is not None and value.value < 1:
+        return "The number of shards has to be at least one."
+    return None
+
+
+def validate_max_concurrent(value, _):
+    """Validate the ``max_concurrent`` input."""
+    if value is not None and value.value < 1:
+        return "The maximum number of concurrent shards has to be at least one."
+    return None
+
+
+def validate_max_resubmissions(value, _):
+    """Validate the ``max_resubmissions`` input."""
+    if value is not None and value.value < 0:
+        return "The maximum number of resubmissions cannot be negative."
+    return None
+
+
+def split_into_shards(snapshots, num_shards):
+    """Split a list of snapshots into at most ``num_shards`` contiguous shards of nearly equal size."""
+    num_shards = min(num_shards, len(snapshots))
+    size, remainder = divmod(len(snapshots), num_shards)
+    shards = []
+    start = 0
+    for index in range(num_shards):
+        stop = start + size + (1 if index < remainder else 0)
+        shards.append(snapshots[start:stop])
+        start = stop
+    return shards
+
+
+@calcfunction
+def merge_observables(**kwargs):
+    """Merge the observables of the shards into a single dictionary keyed by snapshot.
+
+    The keyword arguments are ``observables_{index}`` and optionally ``observable_arrays_{index}``, holding the outputs
+    of a shard. The arrays are copied one by one, without loading them into memory.
+    """
+    observables = {}
+    observable_arrays = orm.ArrayData()
+    for key, node in sorted(kwargs.items()):
+        if key.startswith("observables_"):
+            observables.update(node.get_dict())
+        elif key.startswith("observable_arrays_"):
+            for name in node.get_arraynames():
+                attach_npy_file(observable_arrays, name, node, f"{name}.npy")
+
+    results = {"observables": orm.Dict(observables)}
+    if observable_arrays.get_arraynames():
+        results["observable_arrays"] = observable_arrays
+    return results
+
+
+class TestNetworkShardedWorkChain(WorkChain):
+    """
+    Workchain that tests a trained model by splitting the snapshots into shards, which are tested in parallel.
+
+    At most ``max_concurrent`` shards run at the same time. The workchain waits for the oldest running shard, and once
+    it finished, launches a new shard for it and for every other shard that finished in the meantime, so that a window
+    of shards keeps running instead of waiting for a whole batch. If the testing of a shard fails, only its snapshots
+    that did not finish are resubmitted as a new shard, at most ``max_resubmissions`` times.
+    """
+
+    @classmethod
+    def define(cls, spec):
+        """Define inputs, outputs and outline of the workchain."""
+        super().define(spec)
+
+        spec.expose_inputs(TestNetworkCalculation, namespace="test", exclude=("te_snapshots",))
+        spec.input(
+            "te_snapshots", valid_type=orm.List, validator=validate_te_snapshots, help="List of testing snapshots."
+        )
+        spec.input(
+            "num_shards",
+            valid_type=orm.Int,
+            default=lambda: orm.Int(1),
+            validator=validate_num_shards,
+            help="Number of shards the testing snapshots are split into.",
+        )
+        spec.input(
+            "max_concurrent",
+            valid_type=orm.Int,
+            required=False,
+            validator=validate_max_concurrent,
+            help="Maximum number of shards that are tested at the same time. By default all shards run at once.",
+        )
+        spec.input(
+            "max_resubmissions",
+            valid_type=orm.Int,
+            default=lambda: orm.Int(1),
+            validator=validate_max_resubmissions,
+            help="Maximum number of times the unfinished snapshots of a failed shard are resubmitted.",
+        )
+
+        spec.outline(
+            cls.setup,
+            while_(cls.should_run_shards)(cls.run_shards),
+            cls.results,
+        )
+
+        spec.output("observables", valid_type=orm.Dict, help="Dictionary of the observables of each snapshot.")
+        spec.output(
+            "observable_arrays",
+            valid_type=orm.ArrayData,
+            required=False,
+            help="Arrays of the grid-sized observables, named `{snapshot}__{observable}`.",
+        )
+
+        spec.exit_code(
+            401,
+            "ERROR_INCOMPLETE_SNAPSHOTS",
+            message="The snapshots {snapshots} could not be tested, the observables of the others were merged.",
+        )
+
+    def setup(self):
+        """Split the testing snapshots into shards."""
+        self.ctx.shards = split_into_shards(self.inputs.te_snapshots.get_list(), self.inputs.num_shards.value)
+        self.ctx.resubmissions = [0] * len(self.ctx.shards)
+        self.ctx.next_shard = 0
+        self.ctx.running = []
+        self.ctx.calculations = []
+        self.ctx.missing = []
+
+    def should_run_shards(self):
+        """Return whether there are shards left to test or still running."""
+        return self.ctx.next_shard < len(self.ctx.shards) or bool(self.ctx.running)
+
+    def run_shards(self):
+        """Inspect the shards that finished and launch the next shards, keeping at most ``max_concurrent`` running.
+
+        The step runs again once the oldest running shard finished.
+        """
+        for index in list(self.ctx.running):
+            node = self.ctx[f"shard_{index}"]
+            if node.is_terminated:
+                self.ctx.running.remove(index)
+                self.inspect_shard(index, node)
+
+        max_concurrent = self.inputs.max_concurrent.value if "max_concurrent" in self.inputs else None
+        while self.ctx.next_shard < len(self.ctx.shards) and (
+            max_concurrent is None or len(self.ctx.running) < max_concurrent
+        ):
+            index = self.ctx.next_shard
+            inputs = AttributeDict(self.exposed_inputs(TestNetworkCalculation, namespace="test"))
+            inputs.te_snapshots = orm.List(self.ctx.shards[index])
+            inputs.metadata.call_link_label = f"shard_{index}"
+
+            node = self.submit(TestNetworkCalculation, **inputs)
+            self.report(f"launched {node.process_label}<{node.pk}> for shard {index}")
+            self.ctx[f"shard_{index}"] = node
+            self.ctx.running.append(index)
+            self.ctx.next_shard += 1
+
+        if not self.ctx.running:
+            return None
+
+        # Only the oldest shard is awaited, the others stay in the window and are inspected at the next step
+        oldest = f"shard_{self.ctx.running[0]}"
+        return ToContext(**{oldest: self.ctx[oldest]})
+
+    def inspect_shard(self, index, node):
+        """Inspect a finished shard and resubmit the snapshots of a failed shard that did not finish."""
+        self.ctx.calculations.append(node)
+        if node.is_finished_ok:
+            return
+
+        finished = node.outputs.observables.get_dict() if "observables" in node.outputs else {}
+        missing = [snapshot for snapshot in self.ctx.shards[index] if snapshot not in finished]
+        self.report(
+            f"shard {index} {node.process_label}<{node.pk}> failed with exit status {node.exit_status}, "
+            f"the snapshots {missing} did not finish"
+        )
+        if not missing:
+            return
+
+        if self.ctx.resubmissions[index] < self.inputs.max_resubmissions.value:
+            self.ctx.shards.append(missing)
+            self.ctx.resubmissions.append(self.ctx.resubmissions[index] + 1)
+            self.report(f"resubmitting the snapshots {missing} as shard {len(self.ctx.shards) - 1}")
+        else:
+            self.ctx.missing.extend(missing)
+
+    def results(self):
+        """Merge the observables of all shards."""
+        kwargs = {}
+        for index, node in enumerate(self.ctx.calculations):
+            for key in ("observables", "observable_arrays"):
+                if key in node.outputs:
+                    kwargs[f"{key}_{index}"] = node.outputs[key]
+
+        merged = merge_observables(**kwargs)
+        self.out("observables", merged["observables"])
+        if "observable_arrays" in merged:
+            self.out("observable_arrays", merged["observable_arrays"])
+
+        if self.ctx.missing:
+            return self.exit_codes.ERROR_INCOMPLETE_SNAPSHOTS.format(snapshots=self.ctx.missing)
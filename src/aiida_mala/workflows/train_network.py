@@ -0,0 +1,57 @@
+"""
+Workflows provided by aiida_mala.
+
+Register workflows via the "aiida.workflows" entry point in setup.json.
+"""
+
+from aiida.common import AttributeDict
+from aiida.engine import BaseRestartWorkChain, ProcessHandlerReport, process_handler, while_
+from aiida.plugins import CalculationFactory
+
+TrainNetworkCalculation = CalculationFactory("mala.train_network")
+
+
+class TrainNetworkBaseWorkChain(BaseRestartWorkChain):
+    """
+    Workchain that runs a training and resumes it from the last checkpoint when the job is killed by the scheduler.
+
+    This allows to chain a long training across several jobs that each fit into a short queue slot. The members of an
+    ensemble are resumed from their own checkpoints.
+    """
+
+    _process_class = TrainNetworkCalculation
+
+    @classmethod
+    def define(cls, spec):
+        """Define inputs, outputs and outline of the workchain."""
+        super().define(spec)
+
+        spec.expose_inputs(TrainNetworkCalculation, namespace="train")
+        spec.expose_outputs(TrainNetworkCalculation)
+
+        spec.outline(
+            cls.setup,
+            while_(cls.should_run_process)(
+                cls.run_process,
+                cls.inspect_process,
+            ),
+            cls.results,
+        )
+
+    def setup(self):
+        """Set up the inputs of the first training."""
+        super().setup()
+        self.ctx.inputs = AttributeDict(self.exposed_inputs(TrainNetworkCalculation, namespace="train"))
+
+    @process_handler(
+        priority=500,
+        exit_codes=[
+            TrainNetworkCalculation.exit_codes.ERROR_SCHEDULER_OUT_OF_WALLTIME,  # type: ignore
+            TrainNetworkCalculation.exit_codes.ERROR_SCHEDULER_OUT_OF_MEMORY,  # type: ignore
+        ],
+    )
+    def handle_restart_from_checkpoint(self, node):
+        """Resume the training from the last checkpoint written in the working directory of the killed job."""
+        self.ctx.inputs.parent_folder = node.outputs.remote_folder
+        self.report(f"{node.process_label}<{node.pk}> was killed by the scheduler: resuming from the last checkpoint")
+        return ProcessHandlerReport(do_break=True)
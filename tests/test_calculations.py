@@ -1,10 +1,22 @@
 """Tests for calculations."""
 
+import copy
+import io
+import json
+import math
 import os
+import pstats
+import shutil
+import subprocess
+import sys
 
+import pytest
 from aiida.engine import run
-from aiida.orm import SinglefileData
+from aiida.orm import Dict, FolderData, List, RemoteData, SinglefileData, Str, StructureData, TrajectoryData
 from aiida.plugins import CalculationFactory, DataFactory
+from aiida_mala.calculations.preprocess import snapshots_schema
+from aiida_mala.calculations.resources import estimate_testing, estimate_training
+from voluptuous import Invalid
 
 from . import TEST_DIR
 
@@ -36,3 +48,1194 @@ def test_process(mala_code):
 
     assert "content1" in computed_diff
     assert "content2" in computed_diff
+
+
+def test_train_network_local_data(
+    fixture_sandbox, generate_calc_job, train_network_code, train_network_parameters, snapshot_folder
+):
+    """Test that the snapshots of ``input_data`` and ``output_data`` are uploaded from the repository."""
+    folder_data = FolderData(tree=snapshot_folder)
+    inputs = {
+        "code": train_network_code,
+        "parameters": train_network_parameters,
+        "input_data": folder_data,
+        "output_data": folder_data,
+        "tr_snapshots": List(["Be_snapshot0"]),
+        "va_snapshots": List(["Be_snapshot1"]),
+    }
+    calc_info = generate_calc_job(fixture_sandbox, "mala.train_network", inputs)
+
+    assert sorted(calc_info.local_copy_list) == sorted(
+        (folder_data.uuid, f"Be_snapshot{index}.{suffix}", f"Be_snapshot{index}.{suffix}")
+        for index in range(2)
+        for suffix in ("in.npy", "out.npy")
+    )
+    assert calc_info.remote_copy_list == []
+    assert calc_info.remote_symlink_list == []
+    assert "aiida.in" in fixture_sandbox.get_content_list()
+
+
+@pytest.mark.parametrize("symlink", (True, False))
+def test_train_network_remote_data(
+    fixture_sandbox, generate_calc_job, train_network_code, train_network_parameters, symlink
+):
+    """Test that the snapshots of ``remote_data`` are symlinked or copied on the remote."""
+    remote_data = RemoteData(remote_path="/data/snapshots", computer=train_network_code.computer)
+    inputs = {
+        "code": train_network_code,
+        "parameters": train_network_parameters,
+        "remote_data": remote_data,
+        "tr_snapshots": List(["Be_snapshot0"]),
+        "va_snapshots": List(["Be_snapshot1"]),
+        "metadata": {"options": {"symlink_remote_data": symlink}},
+    }
+    calc_info = generate_calc_job(fixture_sandbox, "mala.train_network", inputs)
+
+    expected = [
+        (remote_data.computer.uuid, f"/data/snapshots/Be_snapshot{index}.{suffix}", f"Be_snapshot{index}.{suffix}")
+        for index in range(2)
+        for suffix in ("in.npy", "out.npy")
+    ]
+    assert calc_info.local_copy_list == []
+    assert calc_info.remote_symlink_list == (expected if symlink else [])
+    assert calc_info.remote_copy_list == ([] if symlink else expected)
+
+
+def test_test_network_remote_data(fixture_sandbox, generate_calc_job, test_network_code, tmp_path):
+    """Test that only the model is uploaded when the snapshots are taken from ``remote_data``."""
+    (tmp_path / "model.zip").write_bytes(b"model")
+    model = SinglefileData(tmp_path / "model.zip")
+    inputs = {
+        "code": test_network_code,
+        "model": model,
+        "remote_data": RemoteData(remote_path="/data/snapshots", computer=test_network_code.computer),
+        "te_snapshots": List(["Be_snapshot2"]),
+        "observables": List(["band_energy"]),
+    }
+    calc_info = generate_calc_job(fixture_sandbox, "mala.test_network", inputs)
+
+    assert calc_info.local_copy_list == [(model.uuid, "model.zip", "model.zip")]
+    assert sorted(entry[2] for entry in calc_info.remote_symlink_list) == [
+        "Be_snapshot2.in.npy",
+        "Be_snapshot2.info.json",
+        "Be_snapshot2.out.npy",
+    ]
+
+
+def test_snapshot_source_validation(train_network_code, train_network_parameters, snapshot_folder):
+    """Test that exactly one source of snapshots has to be specified."""
+    folder_data = FolderData(tree=snapshot_folder)
+    builder = CalculationFactory("mala.train_network").get_builder()
+    builder.code = train_network_code
+    builder.parameters = train_network_parameters
+    builder.tr_snapshots = List(["Be_snapshot0"])
+    builder.va_snapshots = List(["Be_snapshot1"])
+    builder.input_data = folder_data
+
+    with pytest.raises(ValueError, match="Specify both `input_data` and `output_data`"):
+        run(builder)
+
+    builder.output_data = folder_data
+    builder.remote_data = RemoteData(remote_path="/data/snapshots", computer=train_network_code.computer)
+
+    with pytest.raises(ValueError, match="Specify exactly one of"):
+        run(builder)
+
+
+def test_missing_snapshot_files(train_network_code, train_network_parameters, snapshot_folder):
+    """Test that snapshots with missing files are rejected before the upload."""
+    (snapshot_folder / "Be_snapshot1.out.npy").unlink()
+    folder_data = FolderData(tree=snapshot_folder)
+    builder = CalculationFactory("mala.train_network").get_builder()
+    builder.code = train_network_code
+    builder.parameters = train_network_parameters
+    builder.tr_snapshots = List(["Be_snapshot0", "Be_snapshot7"])
+    builder.va_snapshots = List(["Be_snapshot1"])
+    builder.input_data = folder_data
+    builder.output_data = folder_data
+
+    with pytest.raises(ValueError, match=r"The files \['Be_snapshot7.in.npy'\] are missing from the `input_data`"):
+        run(builder)
+
+    builder.tr_snapshots = List(["Be_snapshot0"])
+    with pytest.raises(ValueError, match=r"The files \['Be_snapshot1.out.npy'\] are missing from the `output_data`"):
+        run(builder)
+
+
+def test_estimate_resources(train_network_code, test_network_code, train_network_parameters, snapshot_folder):
+    """Test that the resources are estimated from the shapes of the snapshots and set as the default options."""
+    from aiida.engine.utils import instantiate_process
+    from aiida.manage.manager import get_manager
+
+    train_network = CalculationFactory("mala.train_network")
+    folder_data = FolderData(tree=snapshot_folder)
+    builder = train_network.get_builder()
+    builder.code = train_network_code
+    builder.parameters = train_network_parameters
+    builder.tr_snapshots = List(["Be_snapshot0", "Be_snapshot1"])
+    builder.va_snapshots = List(["Be_snapshot2"])
+    builder.input_data = folder_data
+    builder.output_data = folder_data
+
+    estimate = train_network.estimate_resources(builder)
+    assert estimate["snapshots"]["Be_snapshot0"] == {
+        "grid_points": 8,
+        "descriptor_features": 5,
+        "target_features": 3,
+        "nbytes": 8 * (5 + 3) * 8,
+    }
+    assert estimate["grid_points"] == 24
+    assert estimate["nbytes"] == 3 * 8 * (5 + 3) * 8
+
+    snapshot_set = DataFactory("mala.snapshot_set")(folder=snapshot_folder)
+    builder_set = train_network.get_builder()
+    builder_set.parameters = train_network_parameters
+    builder_set.tr_snapshots = builder.tr_snapshots
+    builder_set.va_snapshots = builder.va_snapshots
+    builder_set.snapshot_set = snapshot_set
+    assert train_network.estimate_resources(builder_set) == estimate
+
+    parameters = copy.deepcopy(train_network_parameters.get_dict())
+    parameters["running"]["max_number_epochs"] *= 10
+    builder_set.parameters = DataFactory("mala.train_network")(parameters)
+    assert train_network.estimate_resources(builder_set)["max_wallclock_seconds"] > estimate["max_wallclock_seconds"]
+
+    builder.metadata.options.estimate_resources = True
+    builder.metadata.options.max_wallclock_seconds = 600
+    process = instantiate_process(get_manager().get_runner(), train_network, **builder)
+    assert process.node.base.attributes.get("resource_estimate") == estimate
+    assert process.node.get_option("max_memory_kb") == estimate["max_memory_kb"]
+    assert process.node.get_option("max_wallclock_seconds") == 600
+
+    builder = CalculationFactory("mala.test_network").get_builder()
+    builder.te_snapshots = List(["Be_snapshot0", "Be_snapshot1"])
+    builder.snapshot_set = snapshot_set
+    lazy = CalculationFactory("mala.test_network").estimate_resources(builder)
+    builder.metadata.options.use_lazy_loading = False
+    assert CalculationFactory("mala.test_network").estimate_resources(builder)["max_memory_kb"] > lazy["max_memory_kb"]
+
+    builder.remote_data = RemoteData(remote_path="/data/snapshots", computer=test_network_code.computer)
+    del builder.snapshot_set
+    assert CalculationFactory("mala.test_network").estimate_resources(builder) is None
+
+
+def test_estimate_resources_empty(train_network_parameters, snapshot_folder):
+    """Test that the resources of a training or a testing without snapshots are those of the setup."""
+    parameters = train_network_parameters.get_dict()
+    sizes = {"Be_snapshot0": {"grid_points": 8, "descriptor_features": 5, "target_features": 3, "nbytes": 512}}
+
+    assert estimate_training({}, [], [], parameters) == estimate_testing({}, [])
+    assert estimate_testing({}, [])["grid_points"] == 0
+    assert estimate_testing({}, [], use_lazy_loading=False) == estimate_testing({}, [])
+    assert estimate_training(sizes, ["Be_snapshot0"], [], parameters)["snapshots"] == sizes
+
+    builder = CalculationFactory("mala.test_network").get_builder()
+    builder.te_snapshots = List([])
+    builder.snapshot_set = DataFactory("mala.snapshot_set")(folder=snapshot_folder)
+    assert CalculationFactory("mala.test_network").estimate_resources(builder) == estimate_testing({}, [])
+
+
+def test_train_network_snapshot_set(
+    fixture_sandbox, generate_calc_job, train_network_code, train_network_parameters, snapshot_folder
+):
+    """Test that the selected snapshots of a ``snapshot_set`` are uploaded."""
+    snapshot_set = DataFactory("mala.snapshot_set")(folder=snapshot_folder)
+    inputs = {
+        "code": train_network_code,
+        "parameters": train_network_parameters,
+        "snapshot_set": snapshot_set,
+        "tr_snapshots": List(["Be_snapshot0"]),
+        "va_snapshots": List(["Be_snapshot1"]),
+    }
+    calc_info = generate_calc_job(fixture_sandbox, "mala.train_network", inputs)
+
+    assert sorted(calc_info.local_copy_list) == sorted(
+        (snapshot_set.uuid, f"Be_snapshot{index}.{suffix}", f"Be_snapshot{index}.{suffix}")
+        for index in range(2)
+        for suffix in ("in.npy", "out.npy")
+    )
+
+    inputs["va_snapshots"] = List(["Be_snapshot9"])
+    with pytest.raises(ValueError, match=r"The snapshots \['Be_snapshot9'\] of `va_snapshots`"):
+        generate_calc_job(fixture_sandbox, "mala.train_network", inputs)
+
+
+def test_train_network_hash(train_network_code, train_network_parameters, snapshot_folder, tmp_path):
+    """Test that the hash of a training only covers the snapshots it stages."""
+    import numpy as np
+    from aiida.engine.utils import instantiate_process
+    from aiida.manage.manager import get_manager
+
+    def get_hash(folder, tr_snapshots=("Be_snapshot0",)):
+        folder_data = FolderData(tree=folder)
+        inputs = {
+            "code": train_network_code,
+            "parameters": train_network_parameters,
+            "input_data": folder_data,
+            "output_data": folder_data,
+            "tr_snapshots": List(list(tr_snapshots)),
+            "va_snapshots": List(["Be_snapshot1"]),
+        }
+        process = instantiate_process(get_manager().get_runner(), CalculationFactory("mala.train_network"), **inputs)
+        return process.node.base.caching.get_hash()
+
+    reference = get_hash(snapshot_folder)
+
+    shutil.copytree(snapshot_folder, tmp_path / "other")
+    (tmp_path / "other" / "Be_snapshot3.out.npy").unlink()
+    (tmp_path / "other" / "unrelated.txt").write_text("unrelated")
+    assert get_hash(tmp_path / "other") == reference
+    assert get_hash(snapshot_folder, ["Be_snapshot2"]) != reference
+
+    np.save(tmp_path / "other" / "Be_snapshot1.out.npy", np.ones((2, 2, 2, 3)))
+    assert get_hash(tmp_path / "other") != reference
+
+
+def test_train_network_hash_reload(train_network_code, train_network_parameters, snapshot_folder):
+    """Test that a stored training is loaded with the hashing of the staged snapshots, so that its hash is unchanged."""
+    from aiida.engine.utils import instantiate_process
+    from aiida.manage.manager import get_manager
+    from aiida.orm import CalcJobNode, QueryBuilder, load_node
+    from aiida_mala.calculations.base import SnapshotCalcJobNode
+
+    folder_data = FolderData(tree=snapshot_folder)
+    inputs = {
+        "code": train_network_code,
+        "parameters": train_network_parameters,
+        "input_data": folder_data,
+        "output_data": folder_data,
+        "tr_snapshots": List(["Be_snapshot0"]),
+        "va_snapshots": List(["Be_snapshot1"]),
+    }
+    process = instantiate_process(get_manager().get_runner(), CalculationFactory("mala.train_network"), **inputs)
+    reference = process.node.base.caching.get_hash()
+
+    node = load_node(process.node.pk)
+    assert isinstance(node, SnapshotCalcJobNode)
+    assert node.base.caching.compute_hash() == reference
+    node.base.caching.rehash()
+    assert node.base.caching.get_hash() == reference
+    assert QueryBuilder().append(CalcJobNode, filters={"id": node.pk}).count() == 1
+
+
+def test_train_network_checkpoint(
+    fixture_sandbox, generate_calc_job, train_network_code, train_network_parameters, snapshot_folder
+):
+    """Test that the training writes checkpoints and resumes from the checkpoint of the ``parent_folder``."""
+    folder_data = FolderData(tree=snapshot_folder)
+    parent_folder = RemoteData(remote_path="/scratch/parent", computer=train_network_code.computer)
+    inputs = {
+        "code": train_network_code,
+        "parameters": train_network_parameters,
+        "input_data": folder_data,
+        "output_data": folder_data,
+        "tr_snapshots": List(["Be_snapshot0"]),
+        "va_snapshots": List(["Be_snapshot1"]),
+        "parent_folder": parent_folder,
+    }
+    calc_info = generate_calc_job(fixture_sandbox, "mala.train_network", inputs)
+
+    assert calc_info.remote_copy_list == [(parent_folder.computer.uuid, "/scratch/parent/checkpoint*", ".")]
+    assert "checkpoint*" not in calc_info.retrieve_list
+
+    with fixture_sandbox.open("aiida.in") as handle:
+        input_file = handle.read()
+    assert "parameters.running.checkpoints_each_epoch = 10\n" in input_file
+    assert (
+        "    parameters.network.layer_sizes = [data_handler.input_dimension, 100, data_handler.output_dimension]\n"
+        in input_file
+    )
+    assert "if mala.Trainer.run_exists('checkpoint'):\n" in input_file
+    assert "        parameters.running.max_number_epochs = 100\n" in input_file
+    compile(input_file, "aiida.in", "exec")
+
+
+def test_train_network_data_loading(
+    fixture_sandbox, generate_calc_job, train_network_code, train_network_parameters, snapshot_folder
+):
+    """Test that the data loading options are set in the training script."""
+    parameters = train_network_parameters.get_dict()
+    parameters["data"].update({"use_lazy_loading": True, "use_lazy_loading_prefetch": True})
+    parameters["running"]["num_workers"] = 4
+    folder_data = FolderData(tree=snapshot_folder)
+    inputs = {
+        "code": train_network_code,
+        "parameters": DataFactory("mala.train_network")(parameters),
+        "input_data": folder_data,
+        "output_data": folder_data,
+        "tr_snapshots": List(["Be_snapshot0"]),
+        "va_snapshots": List(["Be_snapshot1"]),
+    }
+    generate_calc_job(fixture_sandbox, "mala.train_network", inputs)
+
+    with fixture_sandbox.open("aiida.in") as handle:
+        input_file = handle.read()
+    assert "    parameters.data.use_lazy_loading = True\n" in input_file
+    assert "    parameters.data.use_lazy_loading_prefetch = True\n" in input_file
+    assert "    parameters.running.num_workers = 4\n" in input_file
+
+
+def test_train_network_architecture(
+    fixture_sandbox, generate_calc_job, train_network_code, train_network_parameters, snapshot_folder
+):
+    """Test that the hidden layers and the network type are set in the training script."""
+    parameters = train_network_parameters.get_dict()
+    parameters["network"] = {"layer_activations": ["ReLU"], "hidden_layer_sizes": [200, 50], "nn_type": "feed-forward"}
+    folder_data = FolderData(tree=snapshot_folder)
+    inputs = {
+        "code": train_network_code,
+        "parameters": DataFactory("mala.train_network")(parameters),
+        "input_data": folder_data,
+        "output_data": folder_data,
+        "tr_snapshots": List(["Be_snapshot0"]),
+        "va_snapshots": List(["Be_snapshot1"]),
+    }
+    generate_calc_job(fixture_sandbox, "mala.train_network", inputs)
+
+    with fixture_sandbox.open("aiida.in") as handle:
+        input_file = handle.read()
+    assert (
+        "    parameters.network.layer_sizes = [data_handler.input_dimension, 200, 50, data_handler.output_dimension]\n"
+        in input_file
+    )
+    assert '    parameters.network.nn_type = "feed-forward"\n' in input_file
+    assert "hidden_layer_sizes" not in input_file
+
+
+def test_train_network_worker(
+    fixture_sandbox, generate_calc_job, train_network_code, train_network_parameters, snapshot_folder
+):
+    """Test that the script is run through the client of the warm worker if a ``worker_socket`` is given."""
+    folder_data = FolderData(tree=snapshot_folder)
+    inputs = {
+        "code": train_network_code,
+        "parameters": train_network_parameters,
+        "input_data": folder_data,
+        "output_data": folder_data,
+        "tr_snapshots": List(["Be_snapshot0"]),
+        "va_snapshots": List(["Be_snapshot1"]),
+        "metadata": {"options": {"worker_socket": "/tmp/mala-worker.sock"}},
+    }
+    calc_info = generate_calc_job(fixture_sandbox, "mala.train_network", inputs)
+
+    assert calc_info.codes_info[0].cmdline_params == [
+        "mala_worker.py",
+        "run",
+        "--socket",
+        "/tmp/mala-worker.sock",
+        "aiida.in",
+    ]
+    assert "mala_worker.py" in fixture_sandbox.get_content_list()
+
+    inputs["metadata"]["options"]["use_ddp"] = True
+    with pytest.raises(ValueError, match="A distributed training cannot be run by the `worker_socket`"):
+        generate_calc_job(fixture_sandbox, "mala.train_network", inputs)
+
+
+def test_train_network_ddp(
+    fixture_sandbox, generate_calc_job, train_network_code, train_network_parameters, snapshot_folder
+):
+    """Test that a distributed training is launched with one rank per MPI process."""
+    folder_data = FolderData(tree=snapshot_folder)
+    inputs = {
+        "code": train_network_code,
+        "parameters": train_network_parameters,
+        "input_data": folder_data,
+        "output_data": folder_data,
+        "tr_snapshots": List(["Be_snapshot0"]),
+        "va_snapshots": List(["Be_snapshot1"]),
+        "metadata": {"options": {"use_ddp": True, "resources": {"num_machines": 1, "num_mpiprocs_per_machine": 2}}},
+    }
+    calc_info = generate_calc_job(fixture_sandbox, "mala.train_network", inputs)
+
+    assert calc_info.codes_info[0].withmpi
+    assert "export MASTER_ADDR=${MASTER_ADDR:-$(hostname)}" in calc_info.prepend_text
+
+    with fixture_sandbox.open("aiida.in") as handle:
+        input_file = handle.read()
+    assert "with ddp_setup():\n" in input_file
+    assert "      parameters.use_ddp = True\n" in input_file
+    assert "unittest.mock" not in input_file
+    compile(input_file, "aiida.in", "exec")
+
+
+def test_train_network_keep_model_remote(
+    fixture_sandbox, generate_calc_job, train_network_code, train_network_parameters, snapshot_folder
+):
+    """Test that only the manifest of the model is retrieved if the model is kept on the remote computer."""
+    folder_data = FolderData(tree=snapshot_folder)
+    inputs = {
+        "code": train_network_code,
+        "parameters": train_network_parameters,
+        "input_data": folder_data,
+        "output_data": folder_data,
+        "tr_snapshots": List(["Be_snapshot0"]),
+        "va_snapshots": List(["Be_snapshot1"]),
+        "metadata": {"options": {"model_name": "Be_model"}},
+    }
+    calc_info = generate_calc_job(fixture_sandbox, "mala.train_network", inputs)
+
+    assert calc_info.retrieve_list == ["metrics.json", "epochs.jsonl", "timings.json"]
+    assert calc_info.retrieve_temporary_list == ["Be_model.zip"]
+
+    inputs["metadata"]["options"]["keep_model_remote"] = True
+    calc_info = generate_calc_job(fixture_sandbox, "mala.train_network", inputs)
+
+    assert calc_info.retrieve_list == ["metrics.json", "epochs.jsonl", "timings.json", "model_manifest.json"]
+    assert not calc_info.retrieve_temporary_list
+    with fixture_sandbox.open("aiida.in") as handle:
+        input_file = handle.read()
+    assert "test_trainer.save_run('Be_model')\n" in input_file
+    assert "  with open('model_manifest.json', 'w') as file:\n" in input_file
+    compile(input_file, "aiida.in", "exec")
+
+
+def test_train_network_epoch_logger(tmp_path, monkeypatch):
+    """Test that the metrics of the epochs printed by MALA are written to a JSON lines file."""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(sys, "stdout", io.StringIO())
+    namespace = {"test_trainer": None}
+    script = "import json\nimport os\nimport re\nimport sys\nimport time\n"
+    exec(script + CalculationFactory("mala.train_network")._generate_epoch_logger(), namespace)  # pylint: disable=exec-used
+
+    print("Epoch 0: validation data loss: 1.500e-01, training data loss: 2.000e-01")
+    print("Epoch 1: validation data loss: 1.000e-01")
+    print("Some other output")
+
+    epochs = [json.loads(line) for line in (tmp_path / "epochs.jsonl").read_text().splitlines()]
+    assert [epoch["epoch"] for epoch in epochs] == [0, 1]
+    assert [epoch["validation_loss"] for epoch in epochs] == [0.15, 0.1]
+    assert epochs[0]["training_loss"] == 0.2
+    assert math.isnan(epochs[1]["training_loss"])
+    assert "Some other output" in sys.stdout.stream.getvalue()
+
+
+def test_phase_timer(tmp_path, monkeypatch):
+    """Test that the wall time, calls and peak memory of the phases of a script are written to ``timings.json``."""
+    monkeypatch.chdir(tmp_path)
+    namespace = {}
+    script = "import json\nimport os\nimport time\n"
+    exec(script + CalculationFactory("mala.train_network")._generate_phase_timer(), namespace)  # pylint: disable=exec-used
+
+    with namespace["phase"]("prepare_data"):
+        pass
+    for _ in range(2):
+        with namespace["phase"]("testing"):
+            pass
+    with pytest.raises(RuntimeError), namespace["phase"]("training"):
+        raise RuntimeError
+
+    timings = json.loads((tmp_path / "timings.json").read_text())
+    assert sorted(timings) == ["prepare_data", "testing", "training"]
+    assert timings["testing"]["calls"] == 2
+    assert timings["training"]["wall_time"] >= 0
+    assert timings["prepare_data"]["peak_rss"] > 0
+
+
+def test_train_network_profilers(
+    fixture_sandbox, generate_calc_job, train_network_code, train_network_parameters, snapshot_folder
+):
+    """Test that the profiles of the enabled profilers are retrieved and that unknown profilers are rejected."""
+    folder_data = FolderData(tree=snapshot_folder)
+    inputs = {
+        "code": train_network_code,
+        "parameters": train_network_parameters,
+        "input_data": folder_data,
+        "output_data": folder_data,
+        "tr_snapshots": List(["Be_snapshot0"]),
+        "va_snapshots": List(["Be_snapshot1"]),
+        "metadata": {"options": {"profilers": ["cprofile", "torch"]}},
+    }
+    calc_info = generate_calc_job(fixture_sandbox, "mala.train_network", inputs)
+
+    assert calc_info.retrieve_temporary_list == ["model.zip", "profile.pstats", "profile_trace.json"]
+    with fixture_sandbox.open("aiida.in") as handle:
+        input_file = handle.read()
+    assert "  test_trainer.train_network()\n" in input_file
+    assert "    torch_profiler.export_chrome_trace('profile_trace.json')\n" in input_file
+    compile(input_file, "aiida.in", "exec")
+
+    inputs["metadata"]["options"]["profilers"] = ["perf"]
+    with pytest.raises(ValueError, match="Unknown profilers"):
+        generate_calc_job(fixture_sandbox, "mala.train_network", inputs)
+
+
+def test_profiled_script(tmp_path):
+    """Test that the profile of ``cProfile`` is written even if the script fails."""
+    script = tmp_path / "script.py"
+    script.write_text(
+        CalculationFactory("mala.train_network")._generate_profiled_script(
+            "def work():\n  return sum(range(1000))\nwork()\nraise RuntimeError('failed')\n", ["cprofile"]
+        )
+    )
+    process = subprocess.run([sys.executable, str(script)], cwd=tmp_path, capture_output=True, check=False)
+
+    assert process.returncode == 1
+    assert b"RuntimeError: failed" in process.stderr
+    assert "work" in {function for _, _, function in pstats.Stats(str(tmp_path / "profile.pstats")).stats}
+
+
+def test_test_network_remote_model(fixture_sandbox, generate_calc_job, test_network_code, snapshot_folder):
+    """Test that a ``remote_model`` is copied on the remote computer instead of being uploaded."""
+    model = RemoteData(remote_path="/scratch/train/model.zip", computer=test_network_code.computer)
+    inputs = {
+        "code": test_network_code,
+        "model": model,
+        "snapshot_set": DataFactory("mala.snapshot_set")(folder=snapshot_folder),
+        "te_snapshots": List(["Be_snapshot2"]),
+        "observables": List(["band_energy"]),
+    }
+    calc_info = generate_calc_job(fixture_sandbox, "mala.test_network", inputs)
+
+    assert calc_info.remote_copy_list == [(model.computer.uuid, "/scratch/train/model.zip", "model.zip")]
+    assert all(entry[1] != "model.zip" for entry in calc_info.local_copy_list)
+
+
+def test_train_network_fine_tuning(
+    fixture_sandbox, generate_calc_job, train_network_code, train_network_parameters, snapshot_folder
+):
+    """Test that a ``model`` is staged and fine-tuned with its scalers instead of training a new network."""
+    model = SinglefileData(io.BytesIO(b"model"), filename="previous.zip")
+    inputs = {
+        "code": train_network_code,
+        "parameters": train_network_parameters,
+        "model": model,
+        "snapshot_set": DataFactory("mala.snapshot_set")(folder=snapshot_folder),
+        "tr_snapshots": List(["Be_snapshot0"]),
+        "va_snapshots": List(["Be_snapshot1"]),
+        "metadata": {"options": {"frozen_layers": 2}},
+    }
+    calc_info = generate_calc_job(fixture_sandbox, "mala.train_network", inputs)
+
+    assert (model.uuid, "previous.zip", "previous.zip") in calc_info.local_copy_list
+    with fixture_sandbox.open("aiida.in") as handle:
+        input_file = handle.read()
+    assert (
+        "mala.Trainer.load_run(run_name='previous', path='./', load_runner=False, prepare_data=False)\n" in input_file
+    )
+    assert "data_handler.prepare_data(reparametrize_scaler=False)\n" in input_file
+    assert "  for layer in layers[:2]:\n" in input_file
+    assert "parameters.running.max_number_epochs = 100\n" in input_file
+    assert "parameters.descriptors" not in input_file
+    assert "mala.Network(parameters)" not in input_file
+    assert "mala.DataHandler(parameters)" not in input_file
+    compile(input_file, "aiida.in", "exec")
+
+    inputs["model"] = RemoteData(remote_path="/scratch/train/model.zip", computer=train_network_code.computer)
+    calc_info = generate_calc_job(fixture_sandbox, "mala.train_network", inputs)
+    assert (train_network_code.computer.uuid, "/scratch/train/model.zip", "model.zip") in calc_info.remote_copy_list
+
+    inputs["metadata"]["options"]["frozen_layers"] = -1
+    with pytest.raises(ValueError, match="The `frozen_layers` option cannot be negative"):
+        generate_calc_job(fixture_sandbox, "mala.train_network", inputs)
+
+    inputs["metadata"]["options"]["frozen_layers"] = 2
+    inputs.pop("model")
+    with pytest.raises(ValueError, match="The `frozen_layers` option requires a `model`"):
+        generate_calc_job(fixture_sandbox, "mala.train_network", inputs)
+
+
+@pytest.mark.parametrize("resumed", (False, True))
+def test_fine_tuning_training(tmp_path, train_network_parameters, resumed):
+    """Test that the frozen layers of a fine-tuned model stay frozen when the training is resumed from a checkpoint."""
+    (tmp_path / "torch").mkdir()
+    (tmp_path / "torch" / "__init__.py").write_text("from torch import nn\n")
+    (tmp_path / "torch" / "nn.py").write_text(
+        "class Weight:\n  requires_grad = True\n"
+        "class Linear:\n"
+        "  def __init__(self):\n    self.weight = Weight()\n"
+        "  def parameters(self):\n    return [self.weight]\n"
+    )
+    (tmp_path / "mala.py").write_text(
+        "import json, os, torch\n"
+        "class Group:\n  pass\n"
+        "class Parameters:\n"
+        "  def __init__(self):\n"
+        "    for group in ('data', 'network', 'running', 'descriptors', 'targets'):\n"
+        "      setattr(self, group, Group())\n"
+        "class DataHandler:\n"
+        "  def add_snapshot(self, *args, **kwargs):\n    pass\n"
+        "  def prepare_data(self, reparametrize_scaler=True):\n    pass\n"
+        "class Network:\n"
+        "  def __init__(self):\n    self.layers = [torch.nn.Linear() for _ in range(3)]\n"
+        "  def modules(self):\n    return [self, *self.layers]\n"
+        "class Trainer:\n"
+        "  def __init__(self, parameters, network, data_handler):\n"
+        "    self.parameters, self.network = parameters, network\n"
+        "  @staticmethod\n"
+        "  def run_exists(name):\n"
+        "    return os.path.exists(name + '.zip')\n"
+        "  @staticmethod\n"
+        "  def load_run(run_name, path='./', load_runner=True, prepare_data=True):\n"
+        "    parameters, network = Parameters(), Network()\n"
+        "    if load_runner:\n"
+        "      return parameters, network, DataHandler(), Trainer(parameters, network, None)\n"
+        "    assert not prepare_data\n"
+        "    return parameters, network, DataHandler()\n"
+        "  def train_network(self):\n"
+        "    self.final_validation_loss = 0.1\n"
+        "    with open('frozen.json', 'w') as file:\n"
+        "      json.dump([not layer.weight.requires_grad for layer in self.network.layers], file)\n"
+        "  def save_run(self, name):\n"
+        "    pass\n"
+    )
+    if resumed:
+        (tmp_path / "checkpoint.zip").write_text("checkpoint")
+    script = CalculationFactory("mala.train_network")._generate_input_file(
+        train_network_parameters,
+        List(["Be_snapshot0"]),
+        List(["Be_snapshot1"]),
+        model="previous.zip",
+        frozen_layers=2,
+    )
+    (tmp_path / "aiida.in").write_text(script)
+    subprocess.run(
+        [sys.executable, "aiida.in"], cwd=tmp_path, env={**os.environ, "PYTHONPATH": str(tmp_path)}, check=True
+    )
+
+    assert json.loads((tmp_path / "frozen.json").read_text()) == [True, True, False]
+
+
+def test_train_network_ensemble(
+    fixture_sandbox, generate_calc_job, train_network_code, train_network_parameters, snapshot_folder
+):
+    """Test that the members of an ensemble are trained in one job and their models are retrieved."""
+    inputs = {
+        "code": train_network_code,
+        "parameters": train_network_parameters,
+        "snapshot_set": DataFactory("mala.snapshot_set")(folder=snapshot_folder),
+        "tr_snapshots": List(["Be_snapshot0"]),
+        "va_snapshots": List(["Be_snapshot1"]),
+        "ensemble_seeds": List([7, 11, 13]),
+    }
+    calc_info = generate_calc_job(fixture_sandbox, "mala.train_network", inputs)
+
+    assert calc_info.retrieve_temporary_list == ["model_0.zip", "model_1.zip", "model_2.zip"]
+    with fixture_sandbox.open("aiida.in") as handle:
+        input_file = handle.read()
+    assert input_file.count("data_handler.prepare_data()\n") == 1
+    assert "seeds = [7, 11, 13]\n" in input_file
+    assert "mala.Trainer.run_exists('checkpoint')" not in input_file
+    compile(input_file, "aiida.in", "exec")
+
+    parent_folder = RemoteData(remote_path="/scratch/parent", computer=train_network_code.computer)
+    calc_info = generate_calc_job(fixture_sandbox, "mala.train_network", {**inputs, "parent_folder": parent_folder})
+    assert (parent_folder.computer.uuid, "/scratch/parent/checkpoint*", ".") in calc_info.remote_copy_list
+
+    inputs["ensemble_seeds"] = List([7, 7])
+    with pytest.raises(ValueError, match="at least two distinct integers"):
+        generate_calc_job(fixture_sandbox, "mala.train_network", inputs)
+
+    inputs["ensemble_seeds"] = List([7, 11])
+    inputs["metadata"] = {"options": {"use_ddp": True}}
+    with pytest.raises(ValueError, match=r"An ensemble cannot be trained with \['use_ddp'\]"):
+        generate_calc_job(fixture_sandbox, "mala.train_network", inputs)
+
+
+@pytest.mark.parametrize("resumed", ((), (1,), (0, 1)))
+def test_ensemble_training(tmp_path, train_network_parameters, resumed):
+    """Test that the members of an ensemble are trained in forked processes on the data prepared once.
+
+    The members with a checkpoint are resumed from it instead. The data is prepared on a single thread, so that no
+    pool of threads is forked.
+    """
+    (tmp_path / "torch.py").write_text(
+        "threads = None\n"
+        "def set_num_threads(number):\n  global threads\n  threads = number\n"
+        "def manual_seed(seed):\n  pass\n"
+    )
+    (tmp_path / "mala.py").write_text(
+        "import os, torch\n"
+        "class Group:\n  pass\n"
+        "class Parameters:\n"
+        "  def __init__(self):\n"
+        "    for group in ('data', 'network', 'running', 'descriptors', 'targets'):\n"
+        "      setattr(self, group, Group())\n"
+        "class DataHandler:\n"
+        "  input_dimension, output_dimension, prepared = 5, 3, 0\n"
+        "  def __init__(self, parameters):\n    pass\n"
+        "  def add_snapshot(self, *args, **kwargs):\n    pass\n"
+        "  def prepare_data(self):\n"
+        "    assert torch.threads == 1, torch.threads\n"
+        "    DataHandler.prepared += 1\n"
+        "class Network:\n"
+        "  def __init__(self, parameters):\n    self.parameters = parameters\n"
+        "class Trainer:\n"
+        "  def __init__(self, parameters, network, data_handler):\n"
+        "    self.parameters = parameters\n"
+        "  @staticmethod\n"
+        "  def run_exists(name):\n"
+        "    return os.path.exists(name + '.zip')\n"
+        "  @staticmethod\n"
+        "  def load_run(name):\n"
+        "    parameters = Parameters()\n"
+        "    parameters.running.checkpoint_name = 'resumed_' + name\n"
+        "    return parameters, None, None, Trainer(parameters, None, None)\n"
+        "  def train_network(self):\n"
+        "    self.final_validation_loss = 0.1 * DataHandler.prepared\n"
+        "    print(f'Epoch 0: validation data loss: {self.final_validation_loss}')\n"
+        "  def save_run(self, name):\n"
+        "    with open(name + '.zip', 'w') as file:\n"
+        "      file.write(self.parameters.running.checkpoint_name + ' ' + str(os.getpid()))\n"
+    )
+    for index in resumed:
+        (tmp_path / f"checkpoint_{index}.zip").write_text("checkpoint")
+    script = CalculationFactory("mala.train_network")._generate_input_file(
+        train_network_parameters,
+        List(["Be_snapshot0"]),
+        List(["Be_snapshot1"]),
+        ensemble_seeds=[7, 11],
+    )
+    (tmp_path / "aiida.in").write_text(script)
+    subprocess.run(
+        [sys.executable, "aiida.in"], cwd=tmp_path, env={**os.environ, "PYTHONPATH": str(tmp_path)}, check=True
+    )
+
+    contents = [(tmp_path / f"model_{index}.zip").read_text().split() for index in range(2)]
+    assert [content[0] for content in contents] == [
+        f"resumed_checkpoint_{index}" if index in resumed else f"checkpoint_{index}" for index in range(2)
+    ]
+    assert all(int(content[1]) != os.getpid() for content in contents)
+    # The data is prepared once, unless all members are resumed
+    loss = 0.0 if len(resumed) == 2 else 0.1
+    metrics = json.loads((tmp_path / "metrics.json").read_text())
+    assert [member["final_validation_loss"] for member in metrics["members"]] == [loss, loss]
+    epochs = [json.loads(line) for line in (tmp_path / "epochs.jsonl").read_text().splitlines()]
+    assert sorted(epoch["member"] for epoch in epochs) == [0, 1]
+
+
+def test_packed(fixture_sandbox, generate_calc_job, packed_code, train_network_parameters, snapshot_folder):
+    """Test that the trainings and testings of a packed calculation share the staged snapshots."""
+    snapshot_set = DataFactory("mala.snapshot_set")(folder=snapshot_folder)
+    model = SinglefileData(io.BytesIO(b"model"), filename="be_model.zip")
+    inputs = {
+        "code": packed_code,
+        "snapshot_set": snapshot_set,
+        "tasks": {
+            "small": {
+                "parameters": train_network_parameters,
+                "tr_snapshots": List(["Be_snapshot0"]),
+                "va_snapshots": List(["Be_snapshot1"]),
+            },
+            "check": {"model": model, "te_snapshots": List(["Be_snapshot1", "Be_snapshot2"]), "observables": List([])},
+        },
+        "metadata": {"options": {"max_concurrent_tasks": 2}},
+    }
+    calc_info = generate_calc_job(fixture_sandbox, "mala.packed", inputs)
+
+    # Every snapshot is staged once, the information files only for the tested snapshots
+    staged = sorted(entry[2] for entry in calc_info.local_copy_list if entry[0] == snapshot_set.uuid)
+    assert staged == sorted(
+        [f"Be_snapshot0.{suffix}" for suffix in ("in.npy", "out.npy")]
+        + [f"Be_snapshot{index}.{suffix}" for index in (1, 2) for suffix in ("in.npy", "out.npy", "info.json")]
+    )
+    assert (model.uuid, "be_model.zip", "tasks/check/be_model.zip") in calc_info.local_copy_list
+    assert ("tasks/small/metrics.json", ".", 3) in calc_info.retrieve_list
+    assert ("tasks/check/results", ".", 3) in calc_info.retrieve_list
+    assert calc_info.retrieve_temporary_list == [("tasks/small/model.zip", ".", 3)]
+
+    with fixture_sandbox.open("aiida.in") as handle:
+        driver = handle.read()
+    assert "workers = min(len(tasks), 2)\n" in driver
+    compile(driver, "aiida.in", "exec")
+    with fixture_sandbox.get_subfolder("tasks/check").open("aiida.in") as handle:
+        assert "mala.Tester.load_run(run_name='be_model', path='./')" in handle.read()
+    with fixture_sandbox.get_subfolder("tasks/small").open("aiida.in") as handle:
+        assert "test_trainer.save_run('model')" in handle.read()
+
+    packed = CalculationFactory("mala.packed")
+    estimate = packed.estimate_resources(inputs)
+    memory = [estimate["tasks"][name]["max_memory_kb"] for name in ("small", "check")]
+    wall_time = [estimate["tasks"][name]["max_wallclock_seconds"] for name in ("small", "check")]
+    assert estimate["max_memory_kb"] == sum(memory)
+    inputs["metadata"]["options"]["max_concurrent_tasks"] = 1
+    assert packed.estimate_resources(inputs)["max_memory_kb"] == max(memory)
+    assert packed.estimate_resources(inputs)["max_wallclock_seconds"] == sum(wall_time)
+
+    inputs["tasks"]["check"]["te_snapshots"] = List(["Be_snapshot9"])
+    with pytest.raises(ValueError, match=r"The snapshots \['Be_snapshot9'\] of `tasks.check.te_snapshots`"):
+        generate_calc_job(fixture_sandbox, "mala.packed", inputs)
+
+    inputs["tasks"]["check"] = {"model": model, "te_snapshots": List(["Be_snapshot2"])}
+    with pytest.raises(ValueError, match="The task `check` has to be a training"):
+        generate_calc_job(fixture_sandbox, "mala.packed", inputs)
+
+
+def test_packed_driver(tmp_path):
+    """Test that the driver runs the tasks in their directories and records their exit status."""
+    for name, exit_status in (("first", 0), ("second", 3)):
+        (tmp_path / "tasks" / name).mkdir(parents=True)
+        (tmp_path / "tasks" / name / "aiida.in").write_text(
+            "import os, sys\n"
+            "print(open('Be_snapshot0.in.npy').read(), os.environ['OMP_NUM_THREADS'])\n"
+            f"sys.exit({exit_status})\n"
+        )
+    (tmp_path / "Be_snapshot0.in.npy").write_text("descriptors")
+    script = CalculationFactory("mala.packed")._generate_input_file(
+        {"first": ["Be_snapshot0.in.npy"], "second": ["Be_snapshot0.in.npy"]}, max_concurrent_tasks=1
+    )
+    (tmp_path / "aiida.in").write_text(script)
+    subprocess.run([sys.executable, "aiida.in"], cwd=tmp_path, check=True)
+
+    results = json.loads((tmp_path / "tasks.json").read_text())
+    assert {name: result["exit_status"] for name, result in results.items()} == {"first": 0, "second": 3}
+    assert (tmp_path / "tasks" / "first" / "Be_snapshot0.in.npy").is_symlink()
+    assert (tmp_path / "tasks" / "first" / "aiida.out").read_text().split()[0] == "descriptors"
+
+
+@pytest.mark.skipif(shutil.which("mpirun") is None, reason="requires an MPI launcher")
+def test_train_network_ddp_environment(tmp_path):
+    """Test that every MPI process gets its own ``torch.distributed`` rank on a single machine."""
+    script = tmp_path / "ddp_environment.py"
+    script.write_text(
+        "import os\n"
+        + CalculationFactory("mala.train_network")._generate_ddp_environment()
+        + "with open(f\"rank_{os.environ['RANK']}.txt\", 'w') as handle:\n"
+        + "  handle.write(f\"{os.environ['WORLD_SIZE']} {os.environ['LOCAL_RANK']} {os.environ['MASTER_ADDR']}\")\n"
+    )
+    environment = {key: value for key, value in os.environ.items() if key not in ("RANK", "WORLD_SIZE", "LOCAL_RANK")}
+    subprocess.run(
+        ["mpirun", "--allow-run-as-root", "--oversubscribe", "-np", "2", sys.executable, str(script)],
+        check=True,
+        cwd=tmp_path,
+        env=environment,
+    )
+
+    assert (tmp_path / "rank_0.txt").read_text() == "2 0 localhost"
+    assert (tmp_path / "rank_1.txt").read_text() == "2 1 localhost"
+
+
+def test_ddp_setup(tmp_path):
+    """Test that the GPU-only functions of ``torch`` are replaced by no-ops only while MALA sets up the training."""
+    (tmp_path / "torch").mkdir()
+    (tmp_path / "torch" / "__init__.py").write_text("from torch import cuda, distributed\n")
+    (tmp_path / "torch" / "cuda.py").write_text(
+        "def is_available():\n  return False\n"
+        "def Stream(*args, **kwargs):\n  raise RuntimeError('no GPU')\n"
+        "stream = current_stream = Stream\n"
+    )
+    (tmp_path / "torch" / "distributed.py").write_text(
+        "backends = []\n"
+        "def is_initialized():\n  return bool(backends)\n"
+        "def init_process_group(backend, **kwargs):\n  backends.append(backend)\n"
+    )
+    script = tmp_path / "ddp_setup.py"
+    script.write_text(
+        CalculationFactory("mala.train_network")._generate_ddp_backend()
+        + "original = torch.cuda.Stream\n"
+        + "with ddp_setup():\n"
+        + "  torch.distributed.init_process_group('nccl')\n"
+        + "  stream = torch.cuda.Stream()\n"
+        + "  with torch.cuda.stream(stream):\n"
+        + "    pass\n"
+        + "  torch.cuda.current_stream().wait_stream(stream)\n"
+        + "assert torch.distributed.backends == ['gloo'], torch.distributed.backends\n"
+        + "assert torch.cuda.Stream is original\n"
+        + "try:\n"
+        + "  torch.cuda.current_stream()\n"
+        + "except RuntimeError:\n"
+        + "  pass\n"
+        + "else:\n"
+        + "  raise AssertionError('the CUDA streams were not restored')\n"
+    )
+    subprocess.run([sys.executable, str(script)], check=True, env={**os.environ, "PYTHONPATH": str(tmp_path)})
+
+
+@pytest.mark.skipif(shutil.which("mpirun") is None, reason="requires an MPI launcher")
+def test_train_network_ddp_cpu(
+    fixture_sandbox, generate_calc_job, train_network_code, train_network_parameters, tmp_path
+):
+    """Test that a distributed training runs on two CPU processes and that only the first rank writes the outputs."""
+    pytest.importorskip("mala")
+    import numpy as np
+
+    rng = np.random.default_rng(0)
+    for index in range(2):
+        np.save(tmp_path / f"Be_snapshot{index}.in.npy", rng.random((4, 4, 4, 8)))
+        np.save(tmp_path / f"Be_snapshot{index}.out.npy", rng.random((4, 4, 4, 3)))
+    parameters = train_network_parameters.get_dict()
+    parameters["running"].update({"max_number_epochs": 2, "mini_batch_size": 8, "checkpoints_each_epoch": 1})
+    folder_data = FolderData(tree=tmp_path)
+    inputs = {
+        "code": train_network_code,
+        "parameters": DataFactory("mala.train_network")(parameters),
+        "input_data": folder_data,
+        "output_data": folder_data,
+        "tr_snapshots": List(["Be_snapshot0"]),
+        "va_snapshots": List(["Be_snapshot1"]),
+        "metadata": {"options": {"use_ddp": True, "resources": {"num_machines": 1, "num_mpiprocs_per_machine": 2}}},
+    }
+    generate_calc_job(fixture_sandbox, "mala.train_network", inputs)
+
+    shutil.copy(fixture_sandbox.get_abs_path("aiida.in"), tmp_path / "aiida.in")
+    environment = {key: value for key, value in os.environ.items() if key not in ("RANK", "WORLD_SIZE", "LOCAL_RANK")}
+    environment.update({"CUDA_VISIBLE_DEVICES": "", "MASTER_PORT": "29517"})
+    subprocess.run(
+        ["mpirun", "--allow-run-as-root", "--oversubscribe", "-np", "2", sys.executable, "aiida.in"],
+        check=True,
+        cwd=tmp_path,
+        env=environment,
+        timeout=600,
+    )
+
+    metrics = json.loads((tmp_path / "metrics.json").read_text())
+    assert math.isfinite(metrics["final_validation_loss"])
+    assert (tmp_path / "model.zip").is_file()
+    assert (tmp_path / "checkpoint.zip").is_file()
+    epochs = [json.loads(line) for line in (tmp_path / "epochs.jsonl").read_text().splitlines()]
+    assert [epoch["epoch"] for epoch in epochs] == [0, 1]
+
+
+def test_test_network_observable_arrays(
+    fixture_sandbox, generate_calc_job, test_network_code, snapshot_folder, tmp_path
+):
+    """Test that the testing script writes the results of each snapshot as it finishes, which are retrieved."""
+    (tmp_path / "model.zip").write_bytes(b"model")
+    snapshot_set = DataFactory("mala.snapshot_set")(folder=snapshot_folder)
+    inputs = {
+        "code": test_network_code,
+        "model": SinglefileData(tmp_path / "model.zip"),
+        "snapshot_set": snapshot_set,
+        "te_snapshots": List(["Be_snapshot2", "Be_snapshot3"]),
+        "observables": List(["band_energy", "density"]),
+    }
+    calc_info = generate_calc_job(fixture_sandbox, "mala.test_network", inputs)
+
+    assert calc_info.retrieve_list == ["results", "timings.json"]
+    with fixture_sandbox.open("aiida.in") as handle:
+        input_file = handle.read()
+    assert "for index, snapshot in enumerate(['Be_snapshot2', 'Be_snapshot3']):\n" in input_file
+    assert "    with phase('testing'):\n" in input_file
+    assert "        np.save(os.path.join('results', snapshot + '__' + observable + '.npy'), array)\n" in input_file
+    assert "    os.replace(filename + '.tmp', filename)\n" in input_file
+    assert "calculation_output_file=os.path.join('.', 'Be_snapshot2.info.json')" in input_file
+    compile(input_file, "aiida.in", "exec")
+
+    # A snapshot without an information file is tested without one
+    (tmp_path / "snapshots").mkdir()
+    for filename in ("Be_snapshot2.in.npy", "Be_snapshot2.out.npy", "Be_snapshot3.in.npy", "Be_snapshot3.out.npy"):
+        shutil.copy(snapshot_folder / filename, tmp_path / "snapshots" / filename)
+    shutil.copy(snapshot_folder / "Be_snapshot3.info.json", tmp_path / "snapshots" / "Be_snapshot3.info.json")
+    inputs["snapshot_set"] = DataFactory("mala.snapshot_set")(folder=tmp_path / "snapshots")
+    generate_calc_job(fixture_sandbox, "mala.test_network", inputs)
+    with fixture_sandbox.open("aiida.in") as handle:
+        input_file = handle.read()
+    assert "data_handler.add_snapshot('Be_snapshot2.in.npy', '.', 'Be_snapshot2.out.npy', '.', 'te',)\n" in input_file
+    assert "calculation_output_file=os.path.join('.', 'Be_snapshot3.info.json')" in input_file
+    assert "Be_snapshot2.info.json" not in input_file
+    compile(input_file, "aiida.in", "exec")
+
+
+def test_predict(fixture_sandbox, generate_calc_job, predict_code, tmp_path):
+    """Test that the structures and the steps of the trajectory are predicted in a single session."""
+    (tmp_path / "model.zip").write_bytes(b"model")
+    structure = StructureData(cell=[[3.0, 0.0, 0.0], [0.0, 3.0, 0.0], [0.0, 0.0, 3.0]])
+    structure.append_atom(position=(0.0, 0.0, 0.0), symbols="Be")
+    structure.append_atom(position=(1.5, 1.5, 1.5), symbols="Be")
+    trajectory = TrajectoryData([structure, structure])
+    inputs = {
+        "code": predict_code,
+        "model": SinglefileData(tmp_path / "model.zip"),
+        "structures": {"bcc": structure},
+        "trajectory": trajectory,
+    }
+    calc_info = generate_calc_job(fixture_sandbox, "mala.predict", inputs)
+
+    assert calc_info.retrieve_list == ["predictions"]
+    with fixture_sandbox.open("structures.json") as handle:
+        frames = json.load(handle)
+    assert [frame["label"] for frame in frames] == ["bcc", "step_0", "step_1"]
+    assert frames[0]["symbols"] == ["Be", "Be"]
+    assert frames[0]["positions"] == [[0.0, 0.0, 0.0], [1.5, 1.5, 1.5]]
+
+    with fixture_sandbox.open("aiida.in") as handle:
+        input_file = handle.read()
+    assert input_file.count("mala.Predictor.load_run(run_name='model', path='./')") == 1
+    # Every observable of the default ones is computed on its own, so that a failing observable does not lose the others
+    assert input_file.count("  try:\n") == 3
+    assert (
+        "  try:\n    scalars['band_energy'] = float(ldos_calculator.band_energy)\n  except Exception:\n" in input_file
+    )
+    assert "total_energy" not in input_file
+    compile(input_file, "aiida.in", "exec")
+
+    inputs["observables"] = List(["density_of_states"])
+    with pytest.raises(ValueError, match=r"The observables \['density_of_states'\] cannot be predicted"):
+        generate_calc_job(fixture_sandbox, "mala.predict", inputs)
+
+
+def test_preprocess(fixture_sandbox, generate_calc_job, preprocess_code, tmp_path):
+    """Test that the raw data is staged and every snapshot is converted and retrieved."""
+    (tmp_path / "Be.pw.scf.out").write_text("output")
+    (tmp_path / "Be_ldos.cube").write_text("cube")
+    raw_data = FolderData(tree=tmp_path)
+    parameters = {
+        "descriptors": {"descriptor_type": "Bispectrum", "bispectrum_twojmax": 10, "bispectrum_cutoff": 4.67637},
+        "targets": {"target_type": "LDOS", "ldos_gridsize": 11, "ldos_gridspacing_ev": 2.5, "ldos_gridoffset_ev": -5},
+    }
+    inputs = {
+        "code": preprocess_code,
+        "parameters": DataFactory("mala.preprocess")(parameters),
+        "raw_data": raw_data,
+        "snapshots": Dict(
+            {"Be_snapshot0": {"descriptor_input_path": "Be.pw.scf.out", "target_input_path": "Be_ldos.cube"}}
+        ),
+        "metadata": {"options": {"resources": {"num_machines": 1, "num_mpiprocs_per_machine": 4}}},
+    }
+    calc_info = generate_calc_job(fixture_sandbox, "mala.preprocess", inputs)
+
+    assert sorted(calc_info.local_copy_list) == [
+        (raw_data.uuid, "Be.pw.scf.out", "raw/Be.pw.scf.out"),
+        (raw_data.uuid, "Be_ldos.cube", "raw/Be_ldos.cube"),
+    ]
+    assert calc_info.retrieve_temporary_list == [
+        "Be_snapshot0.in.npy",
+        "Be_snapshot0.out.npy",
+        "Be_snapshot0.info.json",
+    ]
+
+    with fixture_sandbox.open("aiida.in") as handle:
+        input_file = handle.read()
+    assert "parameters.descriptors.bispectrum_twojmax = 10\n" in input_file
+    assert "parameters.use_mpi = True\n" in input_file
+    assert "  additional_info_input_path=os.path.join('raw', 'Be.pw.scf.out'),\n" in input_file
+    assert "naming_scheme='Be_snapshot0.npy'" in input_file
+    compile(input_file, "aiida.in", "exec")
+
+    inputs["snapshots"] = Dict({"Be_snapshot0": {"descriptor_input_path": "Be.pw.scf.out"}})
+    with pytest.raises(ValueError, match="Invalid snapshots: required key not provided"):
+        generate_calc_job(fixture_sandbox, "mala.preprocess", inputs)
+
+
+def test_preprocess_snapshot_names():
+    """Test that the snapshot names cannot contain dots, which would make their filenames ambiguous."""
+    paths = {"descriptor_input_path": "Al.pw.scf.out", "target_input_path": "Al_ldos.cube"}
+    assert list(snapshots_schema({"Al_300K-0": paths})) == ["Al_300K-0"]
+    with pytest.raises(Invalid, match="does not match regular expression"):
+        snapshots_schema({"Al.300K": paths})
+
+
+def test_convert_snapshots(fixture_sandbox, generate_calc_job, convert_snapshots_code, snapshot_folder):
+    """Test that the ``.npy`` snapshots are staged and converted into openPMD files."""
+    snapshot_set = DataFactory("mala.snapshot_set")(folder=snapshot_folder)
+    parameters = {"descriptors": {"descriptor_type": "Bispectrum"}, "targets": {"target_type": "LDOS"}}
+    inputs = {
+        "code": convert_snapshots_code,
+        "parameters": DataFactory("mala.preprocess")(parameters),
+        "snapshot_set": snapshot_set,
+        "snapshots": List(["Be_snapshot0"]),
+        "dtype": Str("float32"),
+    }
+    calc_info = generate_calc_job(fixture_sandbox, "mala.convert_snapshots", inputs)
+
+    assert sorted(calc_info.local_copy_list) == sorted(
+        (snapshot_set.uuid, f"Be_snapshot0.{suffix}", f"Be_snapshot0.{suffix}")
+        for suffix in ("in.npy", "out.npy", "info.json")
+    )
+    assert calc_info.retrieve_temporary_list == [
+        "Be_snapshot0.in.h5",
+        "Be_snapshot0.out.h5",
+        "Be_snapshot0.info.json",
+        "snapshots.json",
+    ]
+
+    with fixture_sandbox.open("aiida.in") as handle:
+        input_file = handle.read()
+    assert "parameters.openpmd_configuration = {'hdf5': {'dataset': {'chunks': 'auto'" in input_file
+    assert "      array = array.astype(np.float32, copy=False)\n" in input_file
+    assert "calculator.write_to_openpmd_file(snapshot + openpmd_suffix, array)" in input_file
+    compile(input_file, "aiida.in", "exec")
+
+    inputs["dtype"] = Str("float16")
+    with pytest.raises(ValueError, match="Unknown dtype `float16`"):
+        generate_calc_job(fixture_sandbox, "mala.convert_snapshots", inputs)
+
+    inputs.pop("dtype")
+    inputs.pop("snapshot_set")
+    inputs["input_data"] = inputs["output_data"] = FolderData(tree=snapshot_folder)
+    inputs["metadata"] = {"options": {"snapshot_format": "openpmd"}}
+    with pytest.raises(ValueError, match="Only `numpy` snapshots can be converted"):
+        generate_calc_job(fixture_sandbox, "mala.convert_snapshots", inputs)
+
+
+def test_convert_snapshots_without_info(
+    fixture_sandbox, generate_calc_job, convert_snapshots_code, snapshot_folder, tmp_path
+):
+    """Test that the information files are only staged for the snapshots that have one."""
+    shutil.copytree(snapshot_folder, tmp_path / "snapshots")
+    (tmp_path / "snapshots" / "Be_snapshot1.info.json").unlink()
+    snapshot_set = DataFactory("mala.snapshot_set")(folder=tmp_path / "snapshots")
+    parameters = {"descriptors": {"descriptor_type": "Bispectrum"}, "targets": {"target_type": "LDOS"}}
+    inputs = {
+        "code": convert_snapshots_code,
+        "parameters": DataFactory("mala.preprocess")(parameters),
+        "snapshot_set": snapshot_set,
+        "snapshots": List(["Be_snapshot0", "Be_snapshot1"]),
+    }
+    calc_info = generate_calc_job(fixture_sandbox, "mala.convert_snapshots", inputs)
+
+    filenames = sorted(filename for _, filename, _ in calc_info.local_copy_list)
+    assert filenames == [
+        "Be_snapshot0.in.npy",
+        "Be_snapshot0.info.json",
+        "Be_snapshot0.out.npy",
+        "Be_snapshot1.in.npy",
+        "Be_snapshot1.out.npy",
+    ]
+
+    inputs.pop("snapshot_set")
+    inputs["input_data"] = inputs["output_data"] = FolderData(tree=tmp_path / "snapshots")
+    calc_info = generate_calc_job(fixture_sandbox, "mala.convert_snapshots", inputs)
+
+    assert sorted(filename for _, filename, _ in calc_info.local_copy_list) == filenames
+
+
+def test_openpmd_snapshots(
+    fixture_sandbox, generate_calc_job, train_network_code, test_network_code, train_network_parameters, tmp_path
+):
+    """Test that the training and the testing stage and read snapshots in the ``openpmd`` format."""
+    for index in range(2):
+        (tmp_path / f"Be_snapshot{index}.in.h5").write_bytes(b"descriptors")
+        (tmp_path / f"Be_snapshot{index}.out.h5").write_bytes(b"targets")
+        (tmp_path / f"Be_snapshot{index}.info.json").write_text("{}")
+    snapshot_set = DataFactory("mala.snapshot_set")(folder=tmp_path, snapshot_format="openpmd")
+    inputs = {
+        "code": train_network_code,
+        "parameters": train_network_parameters,
+        "snapshot_set": snapshot_set,
+        "tr_snapshots": List(["Be_snapshot0"]),
+        "va_snapshots": List(["Be_snapshot1"]),
+    }
+    calc_info = generate_calc_job(fixture_sandbox, "mala.train_network", inputs)
+
+    assert sorted(calc_info.local_copy_list) == sorted(
+        (snapshot_set.uuid, f"Be_snapshot{index}.{suffix}", f"Be_snapshot{index}.{suffix}")
+        for index in range(2)
+        for suffix in ("in.h5", "out.h5")
+    )
+    with fixture_sandbox.open("aiida.in") as handle:
+        input_file = handle.read()
+    assert "'Be_snapshot0.out.h5', '.', 'tr', snapshot_type='openpmd')\n" in input_file
+
+    inputs["metadata"] = {"options": {"snapshot_format": "numpy"}}
+    with pytest.raises(ValueError, match="does not match the format `openpmd` of the `snapshot_set`"):
+        generate_calc_job(fixture_sandbox, "mala.train_network", inputs)
+
+    folder_data = FolderData(tree=tmp_path)
+    inputs = {
+        "code": test_network_code,
+        "input_data": folder_data,
+        "output_data": folder_data,
+        "model": SinglefileData(io.BytesIO(b"model"), filename="model.zip"),
+        "te_snapshots": List(["Be_snapshot1"]),
+        "observables": List(["rmse"]),
+        "metadata": {"options": {"snapshot_format": "openpmd"}},
+    }
+    calc_info = generate_calc_job(fixture_sandbox, "mala.test_network", inputs)
+
+    assert (folder_data.uuid, "Be_snapshot1.info.json", "Be_snapshot1.info.json") in calc_info.local_copy_list
+    with fixture_sandbox.open("aiida.in") as handle:
+        input_file = handle.read()
+    assert "'Be_snapshot1.out.h5', '.', 'te'," in input_file
+    assert "os.path.join('.', 'Be_snapshot1.info.json'), snapshot_type='openpmd',)\n" in input_file
+    compile(input_file, "aiida.in", "exec")
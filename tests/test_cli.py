@@ -0,0 +1,210 @@
+"""Tests for the registry of the models and its command line interface."""
+
+import io
+import json
+
+import pytest
+from aiida.common import LinkType
+from aiida.orm import Dict, List, SinglefileData
+from aiida_mala.cli import data_cli
+from aiida_mala.registry import (
+    get_model_record,
+    get_test_errors,
+    index_models,
+    parse_filter,
+    query_models,
+    record_model,
+    record_test_errors,
+)
+from click.testing import CliRunner
+
+
+def add_testing(generate_calc_job_node, model, observables, folder):
+    """Add a finished testing of a model with the given ``observables`` output, without recording its errors."""
+    node = generate_calc_job_node(
+        "mala.test_network", folder, {"model": model, "te_snapshots": List(list(observables))}
+    )
+    output = Dict(observables)
+    output.base.links.add_incoming(node, link_type=LinkType.CREATE, link_label="observables")
+    output.store()
+
+
+@pytest.fixture
+def registered_models(generate_calc_job_node, train_network_parameters, tmp_path):
+    """Return three registered models, of which two are tested, with their training parameters and band energies.
+
+    The first model is tested in two shards, whose errors add up.
+    """
+    models = []
+    testings = (
+        (("Be_snapshot2", [1.0, 1.2]), ("Be_snapshot3", [1.0, 1.4])),
+        (("Be_snapshot2", [1.0, 1.1]),),
+        (),
+    )
+    for twojmax, loss, shards in zip((10, 10, 6), (0.3, 0.2, 0.1), testings):
+        parameters = train_network_parameters.get_dict()
+        parameters["descriptors"]["bispectrum_twojmax"] = twojmax
+        model = SinglefileData(io.BytesIO(b"model"), filename="model.zip")
+        record_model(model, get_model_record(parameters, ["Be_snapshot0"], ["Be_snapshot1"], {"loss": loss}))
+        model.store()
+        for snapshot, band_energy in shards:
+            observables = {snapshot: {"band_energy": band_energy, "ldos": "skipped"}}
+            add_testing(generate_calc_job_node, model, observables, tmp_path)
+            record_test_errors(model, observables)
+        models.append(model)
+    # A model that is not registered
+    SinglefileData(io.BytesIO(b"model"), filename="model.zip").store()
+    return models
+
+
+def test_parse_filter():
+    """Test that the filters are parsed into the operators and values of the ``QueryBuilder``."""
+    assert parse_filter("descriptors.bispectrum_twojmax=10") == ("descriptors.bispectrum_twojmax", "==", 10)
+    assert parse_filter("errors.band_energy <= 1e-2") == ("errors.band_energy", "<=", 0.01)
+    assert parse_filter("descriptors.descriptor_type!=SOAP") == ("descriptors.descriptor_type", "!==", "SOAP")
+    assert parse_filter("data.use_lazy_loading=true") == ("data.use_lazy_loading", "==", True)
+    with pytest.raises(ValueError, match="has to be of the form"):
+        parse_filter("descriptors.bispectrum_twojmax")
+
+
+def test_query_models(registered_models):
+    """Test that the models are filtered and ranked on their records and on the errors of their testings."""
+    first, second, third = (model.pk for model in registered_models)
+
+    rows = query_models(["descriptors.bispectrum_twojmax=10"], order_by="errors.band_energy")
+    assert [row[0] for row in rows] == [second, first]
+    assert rows[0][2:] == []
+
+    rows = query_models(order_by="metrics.loss", descending=True, limit=2, project=["metrics.loss"])
+    assert rows == [
+        [first, registered_models[0].uuid, 0.3],
+        [second, registered_models[1].uuid, 0.2],
+    ]
+
+    rows = query_models(["metrics.loss<0.25"], project=["descriptors.bispectrum_twojmax"])
+    assert [row[2] for row in rows] == [10, 6]
+
+    rows = query_models(["errors.band_energy<0.2"], project=["errors.band_energy", "metrics.loss"])
+    assert rows == [[second, registered_models[1].uuid, pytest.approx(0.1), 0.2]]
+
+    rows = query_models(project=["errors.band_energy"], limit=3)
+    assert [row[0] for row in rows] == [first, second, third]
+    assert [row[2] for row in rows] == [pytest.approx(0.3), pytest.approx(0.1), None]
+
+
+def test_list(registered_models):
+    """Test that the command lists the models ranked by the given field."""
+    runner = CliRunner()
+    result = runner.invoke(
+        data_cli, ["list", "-f", "descriptors.bispectrum_twojmax=10", "-o", "errors.band_energy", "-l", "1"]
+    )
+
+    assert result.exit_code == 0, result.output
+    lines = result.output.splitlines()
+    assert lines[0].split() == [
+        "PK",
+        "descriptors.descriptor_type",
+        "metrics.final_validation_loss",
+        "errors.band_energy",
+    ]
+    assert lines[2].split()[:2] == [str(registered_models[1].pk), "Bispectrum"]
+    assert len(lines) == 3
+
+    result = runner.invoke(data_cli, ["list", "-f", "errors.band_energy"])
+    assert result.exit_code != 0
+    assert "has to be of the form" in result.output
+
+
+def test_show(registered_models):
+    """Test that the command shows the record and the testing errors of a model."""
+    result = CliRunner().invoke(data_cli, ["show", str(registered_models[0].pk)])
+
+    assert result.exit_code == 0, result.output
+    record = json.loads(result.output)
+    assert record["descriptors"]["bispectrum_twojmax"] == 10
+    assert record["errors"] == {"band_energy": pytest.approx(0.3)}
+    assert record["te_snapshots"] == ["Be_snapshot2", "Be_snapshot3"]
+    assert sorted(registered_models[0].base.extras.keys()) == ["_aiida_hash", "mala_model", "mala_test"]
+
+
+def test_index(generate_calc_job_node, train_network_parameters, tmp_path):
+    """Test that the models of trainings parsed before the registry existed are registered once."""
+    inputs = {
+        "parameters": train_network_parameters,
+        "tr_snapshots": List(["Be_snapshot0"]),
+        "va_snapshots": List(["Be_snapshot1"]),
+    }
+    node = generate_calc_job_node("mala.train_network", tmp_path, inputs)
+    model = SinglefileData(io.BytesIO(b"model"), filename="model.zip")
+    for link_label, output in (("model", model), ("output_parameters", Dict({"final_validation_loss": 0.5}))):
+        output.base.links.add_incoming(node, link_type=LinkType.CREATE, link_label=link_label)
+        output.store()
+
+    assert index_models() == (1, 0)
+    record = model.base.extras.get("mala_model")
+    assert record["metrics"] == {"final_validation_loss": 0.5}
+    assert record["tr_snapshots"] == ["Be_snapshot0"]
+
+    result = CliRunner().invoke(data_cli, ["index"])
+    assert result.exit_code == 0, result.output
+    assert "Registered 0 trained models and the testing errors of 0 models" in result.output
+
+
+def test_index_packed(generate_calc_job_node, train_network_parameters, tmp_path):
+    """Test that the models of the tasks of a packed calculation are only paired with their own inputs and outputs."""
+    inputs = {}
+    for name, twojmax in (("coarse", 6), ("fine", 10)):
+        parameters = train_network_parameters.clone()
+        parameters["descriptors"] = {**parameters["descriptors"], "bispectrum_twojmax": twojmax}
+        inputs[f"tasks__{name}__parameters"] = parameters
+        inputs[f"tasks__{name}__tr_snapshots"] = List([f"{name}_snapshot0"])
+        inputs[f"tasks__{name}__va_snapshots"] = List([f"{name}_snapshot1"])
+    tested = {name: SinglefileData(io.BytesIO(b"model"), filename="model.zip") for name in ("check", "other")}
+    for name, model in tested.items():
+        inputs[f"tasks__{name}__model"] = model
+        inputs[f"tasks__{name}__te_snapshots"] = List([f"{name}_snapshot2"])
+        inputs[f"tasks__{name}__observables"] = List(["band_energy"])
+    node = generate_calc_job_node("mala.packed", tmp_path, inputs)
+
+    models = {name: SinglefileData(io.BytesIO(b"model"), filename="model.zip") for name in ("coarse", "fine")}
+    outputs = {
+        "tasks__coarse__model": models["coarse"],
+        "tasks__coarse__output_parameters": Dict({"final_validation_loss": 0.5}),
+        "tasks__fine__model": models["fine"],
+        "tasks__fine__output_parameters": Dict({"final_validation_loss": 0.2}),
+        "tasks__check__observables": Dict({"check_snapshot2": {"band_energy": [1.0, 1.1]}}),
+    }
+    for link_label, output in outputs.items():
+        output.base.links.add_incoming(node, link_type=LinkType.CREATE, link_label=link_label)
+        output.store()
+
+    assert index_models() == (2, 1)
+    for name, twojmax, loss in (("coarse", 6, 0.5), ("fine", 10, 0.2)):
+        record = models[name].base.extras.get("mala_model")
+        assert record["descriptors"]["bispectrum_twojmax"] == twojmax
+        assert record["tr_snapshots"] == [f"{name}_snapshot0"]
+        assert record["metrics"] == {"final_validation_loss": loss}
+    test_errors = get_test_errors([model.pk for model in tested.values()])
+    assert list(test_errors) == [tested["check"].pk]
+    assert test_errors[tested["check"].pk]["errors"] == {"band_energy": pytest.approx(0.1)}
+    assert tested["check"].base.extras.get("mala_test")["errors"] == {"band_energy": pytest.approx(0.1)}
+    assert "mala_test" not in tested["other"].base.extras
+
+
+def test_index_testings(registered_models, generate_calc_job_node, tmp_path):
+    """Test that the errors of the testings are recomputed from their outputs, in the order of the testings."""
+    first = registered_models[0]
+    # A testing whose errors were not recorded, e.g. overwritten by a testing of the same model parsed at once
+    add_testing(generate_calc_job_node, first, {"Be_snapshot3": {"band_energy": [1.0, 1.6]}}, tmp_path)
+    assert first.base.extras.get("mala_test")["errors"] == {"band_energy": pytest.approx(0.3)}
+    assert [row[0] for row in query_models(["errors.band_energy<0.35"])] == [first.pk, registered_models[1].pk]
+
+    assert index_models() == (0, 2)
+    assert first.base.extras.get("mala_test") == {
+        "snapshots": {
+            "Be_snapshot2": {"band_energy": pytest.approx(0.2)},
+            "Be_snapshot3": {"band_energy": pytest.approx(0.6)},
+        },
+        "errors": {"band_energy": pytest.approx(0.4)},
+    }
+    assert [row[0] for row in query_models(["errors.band_energy<0.35"])] == [registered_models[1].pk]
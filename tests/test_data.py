@@ -0,0 +1,123 @@
+"""Tests for data types."""
+
+import hashlib
+
+import numpy as np
+import pytest
+from aiida.plugins import DataFactory
+from voluptuous import Invalid
+
+SnapshotSet = DataFactory("mala.snapshot_set")
+
+
+def test_snapshot_set_index(snapshot_folder):
+    """Test that the index of a snapshot set is read from the ``.npy`` headers."""
+    snapshot_set = SnapshotSet(folder=snapshot_folder, snapshots=["Be_snapshot0", "Be_snapshot1"])
+    snapshot_set.store()
+
+    assert snapshot_set.snapshot_names == ["Be_snapshot0", "Be_snapshot1"]
+    assert sorted(snapshot_set.base.repository.list_object_names()) == sorted(
+        f"Be_snapshot{index}.{suffix}" for index in range(2) for suffix in ("in.npy", "out.npy", "info.json")
+    )
+
+    index = snapshot_set.get_index("Be_snapshot0")
+    assert index["descriptors"]["shape"] == [2, 2, 2, 5]
+    assert index["targets"]["shape"] == [2, 2, 2, 3]
+    assert index["targets"]["dtype"] == np.dtype(np.float64).str
+    assert index["targets"]["nbytes"] == (snapshot_folder / "Be_snapshot0.out.npy").stat().st_size
+    content = (snapshot_folder / "Be_snapshot0.in.npy").read_bytes()
+    assert index["descriptors"]["sha256"] == hashlib.sha256(content).hexdigest()
+    assert snapshot_set.base.repository.get_object_content("Be_snapshot0.in.npy", mode="rb") == content
+    assert "shape" not in index["info"]
+    assert snapshot_set.nbytes == sum(
+        (snapshot_folder / entry["filename"]).stat().st_size
+        for files in snapshot_set.get_index().values()
+        for entry in files.values()
+    )
+    assert snapshot_set.get_missing_snapshots(["Be_snapshot1", "Be_snapshot2"]) == ["Be_snapshot2"]
+
+
+def test_snapshot_set_discovery(snapshot_folder):
+    """Test that all snapshots of a folder are added by default and that incomplete snapshots are rejected."""
+    assert SnapshotSet(folder=snapshot_folder).snapshot_names == [f"Be_snapshot{index}" for index in range(4)]
+
+    (snapshot_folder / "Be_snapshot3.out.npy").unlink()
+    with pytest.raises(FileNotFoundError, match="snapshot `Be_snapshot3` has no targets file"):
+        SnapshotSet(folder=snapshot_folder)
+
+
+def test_snapshot_set_openpmd(tmp_path):
+    """Test that the index of openPMD snapshots takes the shape and dtype from the given headers."""
+    (tmp_path / "Be_snapshot0.in.h5").write_bytes(b"descriptors")
+    (tmp_path / "Be_snapshot0.out.h5").write_bytes(b"targets")
+    headers = {"Be_snapshot0": {"targets": {"shape": [2, 2, 2, 3], "dtype": "<f4"}}}
+    snapshot_set = SnapshotSet(folder=tmp_path, snapshot_format="openpmd", headers=headers)
+
+    assert snapshot_set.snapshot_format == "openpmd"
+    assert snapshot_set.snapshot_names == ["Be_snapshot0"]
+    index = snapshot_set.get_index("Be_snapshot0")
+    assert index["targets"] == {
+        "filename": "Be_snapshot0.out.h5",
+        "nbytes": 7,
+        "sha256": index["targets"]["sha256"],
+        "shape": [2, 2, 2, 3],
+        "dtype": "<f4",
+    }
+    assert "shape" not in index["descriptors"]
+
+    with pytest.raises(ValueError, match="unknown snapshot format `zarr`"):
+        SnapshotSet(folder=tmp_path, snapshot_format="zarr")
+
+
+def test_snapshot_set_hash(snapshot_folder):
+    """Test that the hash of a snapshot set follows the checksums of its index."""
+    reference = SnapshotSet(folder=snapshot_folder).store().base.caching.get_hash()
+    assert SnapshotSet(folder=snapshot_folder).store().base.caching.get_hash() == reference
+
+    np.save(snapshot_folder / "Be_snapshot0.in.npy", np.ones((2, 2, 2, 5)))
+    assert SnapshotSet(folder=snapshot_folder).store().base.caching.get_hash() != reference
+
+
+@pytest.mark.parametrize(
+    ("data", "message"),
+    (
+        ({"use_lazy_loading": True, "use_lazy_loading_prefetch": True}, None),
+        ({"use_fast_tensor_data_set": True}, None),
+        ({"use_lazy_loading_prefetch": True}, "requires `use_lazy_loading`"),
+        ({"use_lazy_loading": True, "use_fast_tensor_data_set": True}, "cannot be combined with `use_lazy_loading`"),
+    ),
+)
+def test_train_network_parameters_data_loading(train_network_parameters, data, message):
+    """Test that the data loading options are validated against each other."""
+    parameters = train_network_parameters.get_dict()
+    parameters["data"].update(data)
+    parameters["running"]["num_workers"] = 4
+
+    if message is None:
+        assert DataFactory("mala.train_network")(parameters)["data"] == parameters["data"]
+    else:
+        with pytest.raises(Invalid, match=message):
+            DataFactory("mala.train_network")(parameters)
+
+
+@pytest.mark.parametrize(
+    ("network", "message"),
+    (
+        ({"layer_activations": ["ReLU"], "hidden_layer_sizes": [200, 100]}, None),
+        ({"layer_activations": ["ReLU", "ReLU", "Linear"], "hidden_layer_sizes": [200, 100]}, None),
+        ({"layer_activations": ["ReLU", "Linear"]}, None),
+        ({"layer_activations": ["ReLU", "Linear"], "hidden_layer_sizes": [200, 100]}, "one per layer \\(3\\), got 2"),
+        ({"layer_activations": ["ReLU"], "hidden_layer_sizes": []}, "length of value must be at least 1"),
+        ({"layer_activations": ["ReLU"], "hidden_layer_sizes": [0]}, "at least 1"),
+    ),
+)
+def test_train_network_parameters_network(train_network_parameters, network, message):
+    """Test that the activations have to match the hidden layers."""
+    parameters = train_network_parameters.get_dict()
+    parameters["network"] = network
+
+    if message is None:
+        assert DataFactory("mala.train_network")(parameters)["network"] == network
+    else:
+        with pytest.raises(Invalid, match=message):
+            DataFactory("mala.train_network")(parameters)
@@ -0,0 +1,365 @@
+"""Tests for parsers."""
+
+import io
+import json
+
+import numpy as np
+import pytest
+from aiida.orm import Dict, List, SinglefileData
+from aiida.plugins import DataFactory, ParserFactory
+
+
+def write_snapshot_results(folder, snapshot, scalars, arrays=None):
+    """Write the result files the testing script writes for a finished snapshot."""
+    folder.mkdir(exist_ok=True)
+    for observable, array in (arrays or {}).items():
+        np.save(folder / f"{snapshot}__{observable}.npy", array)
+    (folder / f"{snapshot}.json").write_text(json.dumps(scalars))
+
+
+def get_test_inputs(te_snapshots):
+    """Return the inputs of a testing of the given snapshots."""
+    return {
+        "te_snapshots": List(te_snapshots),
+        "model": SinglefileData(io.BytesIO(b"model"), filename="model.zip"),
+    }
+
+
+def get_train_inputs(parameters, **kwargs):
+    """Return the inputs of a training with the given parameters."""
+    return {
+        "parameters": parameters,
+        "tr_snapshots": List(["Be_snapshot0"]),
+        "va_snapshots": List(["Be_snapshot1"]),
+        **kwargs,
+    }
+
+
+def test_test_network_observable_arrays(generate_calc_job_node, tmp_path):
+    """Test that grid-sized observables are parsed into an ``ArrayData`` and scalar ones into a ``Dict``."""
+    density = np.arange(8, dtype=float).reshape(2, 2, 2)
+    write_snapshot_results(tmp_path / "results", "Be_snapshot2", {"band_energy": [1.0, 1.1]}, {"density": density})
+    write_snapshot_results(tmp_path / "results", "Be_snapshot3", {"band_energy": [2.0, 2.1]}, {"density": density})
+
+    inputs = get_test_inputs(["Be_snapshot2", "Be_snapshot3"])
+    node = generate_calc_job_node("mala.test_network", tmp_path, inputs)
+    results, calcfunction = ParserFactory("mala.test_network").parse_from_node(node, store_provenance=False)
+
+    assert calcfunction.is_finished_ok
+    assert results["observables"].get_dict() == {
+        "Be_snapshot2": {"band_energy": [1.0, 1.1]},
+        "Be_snapshot3": {"band_energy": [2.0, 2.1]},
+    }
+    assert sorted(results["observable_arrays"].get_arraynames()) == ["Be_snapshot2__density", "Be_snapshot3__density"]
+    assert results["observable_arrays"].get_shape("Be_snapshot2__density") == (2, 2, 2)
+    np.testing.assert_array_equal(results["observable_arrays"].get_array("Be_snapshot3__density"), density)
+
+    # The errors are recorded on the model, which is an input of the testing
+    assert node.inputs.model.base.extras.get("mala_test") == {
+        "snapshots": {
+            "Be_snapshot2": {"band_energy": pytest.approx(0.1)},
+            "Be_snapshot3": {"band_energy": pytest.approx(0.1)},
+        },
+        "errors": {"band_energy": pytest.approx(0.1)},
+    }
+
+
+def test_test_network_incomplete_snapshots(generate_calc_job_node, tmp_path):
+    """Test that the finished snapshots are parsed if the testing of the others did not finish."""
+    write_snapshot_results(tmp_path / "results", "Be_snapshot2", {"band_energy": [1.0, 1.1]})
+    # The arrays of a snapshot without its ``.json`` file are incomplete and ignored
+    np.save(tmp_path / "results" / "Be_snapshot3__density.npy", np.zeros((2, 2, 2)))
+
+    inputs = get_test_inputs(["Be_snapshot2", "Be_snapshot3"])
+    node = generate_calc_job_node("mala.test_network", tmp_path, inputs)
+    results, calcfunction = ParserFactory("mala.test_network").parse_from_node(node, store_provenance=False)
+
+    assert calcfunction.exit_status == 301
+    assert "Be_snapshot3" in calcfunction.exit_message
+    assert results["observables"].get_dict() == {"Be_snapshot2": {"band_energy": [1.0, 1.1]}}
+    assert "observable_arrays" not in results
+
+
+def test_test_network_no_snapshots(generate_calc_job_node, tmp_path):
+    """Test that the parser fails if no snapshot finished."""
+    inputs = get_test_inputs(["Be_snapshot2"])
+    node = generate_calc_job_node("mala.test_network", tmp_path, inputs)
+    results, calcfunction = ParserFactory("mala.test_network").parse_from_node(node, store_provenance=False)
+
+    assert calcfunction.exit_status == 300
+    assert not results
+
+
+def test_test_network_timings(generate_calc_job_node, tmp_path):
+    """Test that the timings of the phases are output even if no snapshot finished."""
+    timings = {"load_model": {"wall_time": 1.5, "calls": 1, "peak_rss": 2**20}}
+    (tmp_path / "timings.json").write_text(json.dumps(timings))
+
+    inputs = get_test_inputs(["Be_snapshot2"])
+    node = generate_calc_job_node("mala.test_network", tmp_path, inputs)
+    results, calcfunction = ParserFactory("mala.test_network").parse_from_node(node, store_provenance=False)
+
+    assert calcfunction.exit_status == 300
+    assert results["timings"].get_dict() == timings
+
+
+def test_train_network_model(generate_calc_job_node, tmp_path, train_network_parameters):
+    """Test that the model named by the ``model_name`` option and the metrics of the epochs are parsed."""
+    (tmp_path / "retrieved").mkdir()
+    (tmp_path / "retrieved" / "metrics.json").write_text(json.dumps({"final_validation_loss": 0.5}))
+    epochs = [
+        {"epoch": 0, "training_loss": 0.3, "validation_loss": 0.6, "epoch_time": 2.0, "learning_rate": 1e-3},
+        {"epoch": 1, "training_loss": 0.2, "validation_loss": 0.4, "epoch_time": 1.0, "learning_rate": 1e-3},
+        {"epoch": 2, "training_loss": 0.1, "validation_loss": 0.5, "epoch_time": 1.5, "learning_rate": 1e-4},
+    ]
+    (tmp_path / "retrieved" / "epochs.jsonl").write_text("".join(json.dumps(epoch) + "\n" for epoch in epochs))
+    timings = {"training": {"wall_time": 4.5, "calls": 1, "peak_rss": 2**30}}
+    (tmp_path / "retrieved" / "timings.json").write_text(json.dumps(timings))
+    (tmp_path / "temporary").mkdir()
+    (tmp_path / "temporary" / "Be_model.zip").write_bytes(b"model")
+
+    node = generate_calc_job_node(
+        "mala.train_network",
+        tmp_path / "retrieved",
+        inputs=get_train_inputs(train_network_parameters),
+        options={"model_name": "Be_model"},
+    )
+    results, calcfunction = ParserFactory("mala.train_network").parse_from_node(
+        node, store_provenance=False, retrieved_temporary_folder=str(tmp_path / "temporary")
+    )
+
+    assert calcfunction.is_finished_ok
+    assert results["model"].filename == "Be_model.zip"
+    assert results["model"].get_content("rb") == b"model"
+    assert results["output_parameters"].get_dict() == {
+        "final_validation_loss": 0.5,
+        "number_of_epochs": 3,
+        "mean_epoch_time": 1.5,
+        "best_epoch": 1,
+        "best_validation_loss": 0.4,
+    }
+    np.testing.assert_array_equal(results["training_metrics"].get_array("validation_loss"), [0.6, 0.4, 0.5])
+    np.testing.assert_array_equal(results["training_metrics"].get_array("learning_rate"), [1e-3, 1e-3, 1e-4])
+    assert results["timings"].get_dict() == timings
+
+    record = results["model"].base.extras.get("mala_model")
+    assert record["descriptors"] == train_network_parameters["descriptors"]
+    assert record["tr_snapshots"] == ["Be_snapshot0"]
+    assert record["metrics"]["best_validation_loss"] == 0.4
+
+
+def test_test_network_profiles(generate_calc_job_node, tmp_path):
+    """Test that the profiles of the enabled profilers are output from the temporary folder."""
+    (tmp_path / "retrieved").mkdir()
+    write_snapshot_results(tmp_path / "retrieved" / "results", "Be_snapshot2", {"band_energy": [1.0, 1.1]})
+    (tmp_path / "temporary").mkdir()
+    (tmp_path / "temporary" / "profile.pstats").write_bytes(b"stats")
+
+    inputs = get_test_inputs(["Be_snapshot2"])
+    node = generate_calc_job_node(
+        "mala.test_network", tmp_path / "retrieved", inputs, options={"profilers": ["cprofile", "torch"]}
+    )
+    results, calcfunction = ParserFactory("mala.test_network").parse_from_node(
+        node, store_provenance=False, retrieved_temporary_folder=str(tmp_path / "temporary")
+    )
+
+    assert calcfunction.is_finished_ok
+    assert results["profile_stats"].get_content("rb") == b"stats"
+    # The trace is missing, e.g. because the profiler of ``torch`` failed
+    assert "profile_trace" not in results
+
+
+def test_train_network_ensemble(generate_calc_job_node, tmp_path, train_network_parameters):
+    """Test that the models of the members of an ensemble and their final losses are parsed."""
+    (tmp_path / "retrieved").mkdir()
+    members = [{"seed": 7, "final_validation_loss": 0.4}, {"seed": 11, "final_validation_loss": 0.6}]
+    metrics = {"final_validation_loss": 0.5, "members": members}
+    (tmp_path / "retrieved" / "metrics.json").write_text(json.dumps(metrics))
+    epochs = [
+        {
+            "epoch": 0,
+            "training_loss": 0.3,
+            "validation_loss": 0.6,
+            "epoch_time": 2.0,
+            "learning_rate": 1e-3,
+            "member": 1,
+        },
+        {
+            "epoch": 0,
+            "training_loss": 0.2,
+            "validation_loss": 0.4,
+            "epoch_time": 1.0,
+            "learning_rate": 1e-3,
+            "member": 0,
+        },
+    ]
+    (tmp_path / "retrieved" / "epochs.jsonl").write_text("".join(json.dumps(epoch) + "\n" for epoch in epochs))
+    (tmp_path / "temporary").mkdir()
+    for index in range(2):
+        (tmp_path / "temporary" / f"model_{index}.zip").write_bytes(f"model {index}".encode())
+
+    node = generate_calc_job_node(
+        "mala.train_network",
+        tmp_path / "retrieved",
+        inputs=get_train_inputs(train_network_parameters, ensemble_seeds=List([7, 11])),
+        options={"model_name": "model"},
+    )
+    results, calcfunction = ParserFactory("mala.train_network").parse_from_node(
+        node, store_provenance=False, retrieved_temporary_folder=str(tmp_path / "temporary")
+    )
+
+    assert calcfunction.is_finished_ok
+    assert "model" not in results
+    assert results["ensemble_models"]["member_1"].get_content("rb") == b"model 1"
+    assert results["ensemble"].get_dict() == {
+        "members": [
+            {"seed": 7, "final_validation_loss": 0.4, "model": "member_0"},
+            {"seed": 11, "final_validation_loss": 0.6, "model": "member_1"},
+        ]
+    }
+    assert results["output_parameters"]["final_validation_loss"] == 0.5
+    np.testing.assert_array_equal(results["training_metrics"].get_array("member"), [1, 0])
+    assert results["ensemble_models"]["member_1"].base.extras.get("mala_model")["seed"] == 11
+    assert results["ensemble_models"]["member_1"].base.extras.get("mala_model")["metrics"] == {
+        "final_validation_loss": 0.6
+    }
+
+
+def test_train_network_remote_model(generate_calc_job_node, tmp_path, train_network_parameters):
+    """Test that only a manifest and a ``RemoteData`` of the model are output if the model is kept remote."""
+    manifest = {"filename": "model.zip", "nbytes": 5, "sha256": "0" * 64}
+    (tmp_path / "metrics.json").write_text(json.dumps({"final_validation_loss": 0.5}))
+    (tmp_path / "model_manifest.json").write_text(json.dumps(manifest))
+
+    node = generate_calc_job_node(
+        "mala.train_network",
+        tmp_path,
+        inputs=get_train_inputs(train_network_parameters),
+        options={"keep_model_remote": True},
+    )
+    node.set_remote_workdir("/scratch/train")
+    results, calcfunction = ParserFactory("mala.train_network").parse_from_node(node, store_provenance=False)
+
+    assert calcfunction.is_finished_ok
+    assert "model" not in results
+    assert results["model_manifest"].get_dict() == manifest
+    assert results["remote_model"].get_remote_path() == "/scratch/train/model.zip"
+
+
+def test_predict_incomplete_frames(generate_calc_job_node, tmp_path):
+    """Test that the predictions of the finished frames are parsed in the order of the frames.
+
+    An observable that could not be computed for a frame is NaN.
+    """
+    ldos = np.arange(8, dtype=float).reshape(2, 2, 2, 1)
+    write_snapshot_results(tmp_path / "predictions", "step_1", {"band_energy": 2.0}, {"ldos": ldos})
+    write_snapshot_results(tmp_path / "predictions", "bcc", {"band_energy": 1.0, "total_energy": 3.0}, {"ldos": ldos})
+    frames = [{"label": label} for label in ("bcc", "step_0", "step_1")]
+
+    node = generate_calc_job_node("mala.predict", tmp_path, input_files={"structures.json": json.dumps(frames)})
+    results, calcfunction = ParserFactory("mala.predict").parse_from_node(node, store_provenance=False)
+
+    assert calcfunction.exit_status == 301
+    assert "step_0" in calcfunction.exit_message
+    predictions = results["predictions"]
+    assert predictions.base.attributes.get("frames") == ["bcc", "step_1"]
+    np.testing.assert_array_equal(predictions.get_array("band_energy"), [1.0, 2.0])
+    np.testing.assert_array_equal(predictions.get_array("total_energy"), [3.0, np.nan])
+    np.testing.assert_array_equal(predictions.get_array("step_1__ldos"), ldos)
+
+
+def test_preprocess(generate_calc_job_node, snapshot_folder, tmp_path):
+    """Test that the converted snapshots are parsed into a ``SnapshotSet`` with the preprocessing parameters."""
+    parameters = {"descriptors": {"descriptor_type": "Bispectrum"}, "targets": {"target_type": "LDOS"}}
+    inputs = {
+        "parameters": DataFactory("mala.preprocess")(parameters),
+        "snapshots": Dict({"Be_snapshot0": {}, "Be_snapshot1": {}}),
+    }
+    (tmp_path / "retrieved").mkdir()
+    node = generate_calc_job_node("mala.preprocess", tmp_path / "retrieved", inputs)
+    results, calcfunction = ParserFactory("mala.preprocess").parse_from_node(
+        node, store_provenance=False, retrieved_temporary_folder=str(snapshot_folder)
+    )
+
+    assert calcfunction.is_finished_ok
+    snapshot_set = results["snapshot_set"]
+    assert snapshot_set.snapshot_names == ["Be_snapshot0", "Be_snapshot1"]
+    assert snapshot_set.base.attributes.get("parameters") == parameters
+
+
+def test_convert_snapshots(generate_calc_job_node, tmp_path):
+    """Test that the converted snapshots are parsed into an openPMD ``SnapshotSet`` with the shapes of the manifest."""
+    converted = tmp_path / "converted"
+    converted.mkdir()
+    headers = {}
+    for snapshot in ("Be_snapshot0", "Be_snapshot1"):
+        (converted / f"{snapshot}.in.h5").write_bytes(b"descriptors")
+        (converted / f"{snapshot}.out.h5").write_bytes(b"targets")
+        headers[snapshot] = {
+            "descriptors": {"shape": [2, 2, 2, 5], "dtype": "<f4"},
+            "targets": {"shape": [2, 2, 2, 3], "dtype": "<f4"},
+        }
+    (converted / "snapshots.json").write_text(json.dumps(headers))
+
+    parameters = {"descriptors": {"descriptor_type": "Bispectrum"}, "targets": {"target_type": "LDOS"}}
+    inputs = {
+        "parameters": DataFactory("mala.preprocess")(parameters),
+        "snapshots": List(["Be_snapshot0", "Be_snapshot1"]),
+    }
+    (tmp_path / "retrieved").mkdir()
+    node = generate_calc_job_node("mala.convert_snapshots", tmp_path / "retrieved", inputs)
+    results, calcfunction = ParserFactory("mala.convert_snapshots").parse_from_node(
+        node, store_provenance=False, retrieved_temporary_folder=str(converted)
+    )
+
+    assert calcfunction.is_finished_ok
+    snapshot_set = results["snapshot_set"]
+    assert snapshot_set.snapshot_format == "openpmd"
+    assert snapshot_set.snapshot_names == ["Be_snapshot0", "Be_snapshot1"]
+    assert snapshot_set.get_index("Be_snapshot1")["targets"]["shape"] == [2, 2, 2, 3]
+    assert snapshot_set.get_index("Be_snapshot1")["targets"]["dtype"] == "<f4"
+    assert snapshot_set.base.attributes.get("parameters") == parameters
+
+    (converted / "Be_snapshot1.out.h5").unlink()
+    _, calcfunction = ParserFactory("mala.convert_snapshots").parse_from_node(
+        node, store_provenance=False, retrieved_temporary_folder=str(converted)
+    )
+    assert calcfunction.exit_status == node.process_class.exit_codes.ERROR_MISSING_OUTPUT_FILES.status
+
+
+def test_packed(generate_calc_job_node, tmp_path, train_network_parameters):
+    """Test that the results of the tasks are split into their namespaces and failed tasks are reported."""
+    retrieved = tmp_path / "retrieved"
+    for name in ("small", "check"):
+        (retrieved / "tasks" / name).mkdir(parents=True)
+    (retrieved / "tasks" / "small" / "metrics.json").write_text(json.dumps({"final_validation_loss": 0.5}))
+    write_snapshot_results(retrieved / "tasks" / "check" / "results", "Be_snapshot2", {"band_energy": [1.0, 1.1]})
+    (retrieved / "tasks.json").write_text(
+        json.dumps({name: {"exit_status": 0, "wall_time": 1.0} for name in ("small", "check", "broken")})
+    )
+    (tmp_path / "temporary" / "tasks" / "small").mkdir(parents=True)
+    (tmp_path / "temporary" / "tasks" / "small" / "model.zip").write_bytes(b"model")
+
+    inputs = {
+        "tasks__small__parameters": train_network_parameters,
+        "tasks__small__tr_snapshots": List(["Be_snapshot0"]),
+        "tasks__small__va_snapshots": List(["Be_snapshot1"]),
+    }
+    for name, te_snapshots in (("check", ["Be_snapshot2"]), ("broken", ["Be_snapshot3"])):
+        inputs[f"tasks__{name}__model"] = SinglefileData(io.BytesIO(b"model"), filename="model.zip")
+        inputs[f"tasks__{name}__te_snapshots"] = List(te_snapshots)
+        inputs[f"tasks__{name}__observables"] = List(["band_energy"])
+    node = generate_calc_job_node("mala.packed", retrieved, inputs)
+    results, calcfunction = ParserFactory("mala.packed").parse_from_node(
+        node, store_provenance=False, retrieved_temporary_folder=str(tmp_path / "temporary")
+    )
+
+    assert calcfunction.exit_status == 302
+    assert "['broken']" in calcfunction.exit_message
+    assert results["tasks"]["small"]["model"].get_content("rb") == b"model"
+    assert results["tasks"]["small"]["output_parameters"]["final_validation_loss"] == 0.5
+    assert results["tasks"]["check"]["observables"].get_dict() == {"Be_snapshot2": {"band_energy": [1.0, 1.1]}}
+    assert "broken" not in results["tasks"]
+    assert node.inputs.tasks.check.model.base.extras.get("mala_test")["errors"] == {"band_energy": pytest.approx(0.1)}
+    assert "mala_test" not in node.inputs.tasks.broken.model.base.extras
+    assert results["task_summary"]["small"] == {"kind": "train", "exit_status": 0, "wall_time": 1.0}
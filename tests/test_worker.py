@@ -0,0 +1,131 @@
+"""Tests for the warm worker."""
+
+import subprocess
+import sys
+import time
+
+import pytest
+from aiida_mala import worker
+
+SCRIPT = """\
+import os
+import sys
+print('output of', os.environ['JOB_NAME'], sys.argv[1:])
+print('error of', os.environ['JOB_NAME'], file=sys.stderr)
+with open('result.txt', 'w') as file:
+    file.write(os.getcwd())
+sys.exit(int(os.environ['JOB_STATUS']))
+"""
+
+
+def run_client(socket_path, job, status):
+    """Run the script in the working directory ``job`` through the client of the worker."""
+    job.mkdir()
+    (job / "aiida.in").write_text(SCRIPT)
+    return subprocess.run(
+        [sys.executable, worker.__file__, "run", "--socket", str(socket_path), "aiida.in", "--flag"],
+        capture_output=True,
+        check=False,
+        cwd=job,
+        env={"JOB_NAME": job.name, "JOB_STATUS": str(status)},
+        text=True,
+    )
+
+
+def is_running(pid):
+    """Return whether a process is running, i.e. exists and is not a zombie."""
+    try:
+        with open(f"/proc/{pid}/stat", encoding="utf-8") as handle:
+            return handle.read().rsplit(")", 1)[1].split()[0] != "Z"
+    except FileNotFoundError:
+        return False
+
+
+@pytest.fixture
+def worker_socket(tmp_path):
+    """Start a worker and return the path of its socket."""
+    socket_path = tmp_path / "worker.sock"
+    process = subprocess.Popen(  # pylint: disable=consider-using-with
+        [sys.executable, worker.__file__, "serve", "--socket", str(socket_path), "--preload", "json"],
+        stdout=subprocess.PIPE,
+    )
+    assert process.stdout.readline().decode().startswith("worker listening")
+    yield socket_path
+    process.terminate()
+    process.wait()
+
+
+def test_worker(worker_socket, tmp_path):
+    """Test that the scripts run in the worker with the working directory, environment and streams of the job."""
+    first = run_client(worker_socket, tmp_path / "first", 0)
+    second = run_client(worker_socket, tmp_path / "second", 3)
+
+    assert first.returncode == 0
+    assert first.stdout == "output of first ['--flag']\n"
+    assert first.stderr == "error of first\n"
+    assert (tmp_path / "first" / "result.txt").read_text() == str(tmp_path / "first")
+    assert second.returncode == 3
+    assert second.stdout == "output of second ['--flag']\n"
+
+
+def test_worker_concurrent(tmp_path, worker_socket):
+    """Test that the worker runs several scripts at the same time."""
+    # Every script waits for all of them to start, which times out if they run one after the other
+    script = (
+        "import os, sys, time\n"
+        "open(sys.argv[1], 'w').close()\n"
+        "deadline = time.time() + 30\n"
+        "while not all(os.path.exists(f'started_{index}') for index in range(3)):\n"
+        "    if time.time() > deadline:\n"
+        "        sys.exit(1)\n"
+        "    time.sleep(0.01)\n"
+    )
+    (tmp_path / "wait.py").write_text(script)
+    processes = [
+        subprocess.Popen(  # pylint: disable=consider-using-with
+            [sys.executable, worker.__file__, "run", "--socket", str(worker_socket), "wait.py", f"started_{index}"],
+            cwd=tmp_path,
+        )
+        for index in range(3)
+    ]
+
+    assert [process.wait() for process in processes] == [0, 0, 0]
+
+
+def test_worker_killed_client(tmp_path, worker_socket):
+    """Test that the script and the processes it started are killed if the client is killed."""
+    script = (
+        "import os, subprocess, sys, time\n"
+        "child = subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(60)'])\n"
+        "with open('pids.tmp', 'w') as file:\n"
+        "    file.write(f'{os.getpid()} {child.pid}')\n"
+        "os.replace('pids.tmp', 'pids')\n"
+        "time.sleep(60)\n"
+    )
+    (tmp_path / "sleep.py").write_text(script)
+    client = subprocess.Popen(  # pylint: disable=consider-using-with
+        [sys.executable, worker.__file__, "run", "--socket", str(worker_socket), "sleep.py"], cwd=tmp_path
+    )
+    while not (tmp_path / "pids").exists():
+        assert client.poll() is None
+        time.sleep(0.01)
+    pids = [int(pid) for pid in (tmp_path / "pids").read_text().split()]
+
+    client.kill()
+    client.wait()
+
+    for pid in pids:
+        for _ in range(1000):
+            if not is_running(pid):
+                break
+            time.sleep(0.01)
+        assert not is_running(pid)
+
+
+def test_worker_fallback(tmp_path):
+    """Test that the script is run directly if no worker is listening."""
+    result = run_client(tmp_path / "missing.sock", tmp_path / "job", 2)
+
+    assert result.returncode == 2
+    assert result.stdout == "output of job ['--flag']\n"
+    assert "running `aiida.in` directly" in result.stderr
@@ -0,0 +1,349 @@
+"""Tests for workflows."""
+
+import io
+
+import numpy as np
+import pytest
+from aiida.common import LinkType
+from aiida.engine import run_get_node
+from aiida.orm import ArrayData, Dict, FolderData, Int, List, RemoteData, SinglefileData
+from aiida.plugins import CalculationFactory
+from aiida_mala.workflows.hyperparameter_optimization import (
+    HyperparameterOptimizationWorkChain,
+    collect_trials,
+    get_rung_epochs,
+    sample_trials,
+    validate_search_space,
+)
+from aiida_mala.workflows.packed import PackedWorkChain
+from aiida_mala.workflows.test_network import TestNetworkShardedWorkChain, merge_observables, split_into_shards
+from aiida_mala.workflows.train_network import TrainNetworkBaseWorkChain
+
+PackedCalculation = CalculationFactory("mala.packed")
+TestNetworkCalculation = CalculationFactory("mala.test_network")
+TrainNetworkCalculation = CalculationFactory("mala.train_network")
+
+
+def get_called(node, prefix):
+    """Return the calculations called by a workchain whose link label starts with ``prefix``, by their link label."""
+    links = node.base.links.get_outgoing(link_type=LinkType.CALL_CALC).all()
+    return {link.link_label: link.node for link in links if link.link_label.startswith(prefix)}
+
+
+def emit_job_outputs(process):
+    """Emit the ``remote_folder`` and ``retrieved`` outputs of a job that is replaced by a mock."""
+    remote_folder = RemoteData(computer=process.node.computer, remote_path=f"/scratch/{process.node.uuid}")
+    process.out("remote_folder", remote_folder)
+    process.out("retrieved", FolderData())
+
+
+@pytest.fixture
+def mock_test_network(monkeypatch):
+    """Replace the job of the testing by one that tests every snapshot, except ``flaky`` ones tested with others."""
+
+    def run(self):
+        snapshots = self.inputs.te_snapshots.get_list()
+        observables = {
+            snapshot: {"band_energy": [1.0, 1.1]}
+            for snapshot in snapshots
+            if len(snapshots) == 1 or not snapshot.startswith("flaky")
+        }
+        emit_job_outputs(self)
+        self.out("observables", Dict(observables))
+        missing = [snapshot for snapshot in snapshots if snapshot not in observables]
+        if missing:
+            return self.exit_codes.ERROR_INCOMPLETE_SNAPSHOTS.format(snapshots=missing)
+        return None
+
+    monkeypatch.setattr(TestNetworkCalculation, "run", run)
+
+
+@pytest.fixture
+def mock_train_network(monkeypatch):
+    """Replace the job of the training by one whose final validation loss is its learning rate."""
+
+    def run(self):
+        loss = self.inputs.parameters["running"]["learning_rate"]
+        emit_job_outputs(self)
+        self.out("model", SinglefileData(io.BytesIO(b"model"), filename="model.zip"))
+        self.out("output_parameters", Dict({"final_validation_loss": loss}))
+
+    monkeypatch.setattr(TrainNetworkCalculation, "run", run)
+
+
+@pytest.mark.usefixtures("mock_test_network")
+@pytest.mark.parametrize("max_resubmissions", (0, 1))
+def test_test_network_sharded(test_network_code, max_resubmissions):
+    """Test that the unfinished snapshots of a failed shard are resubmitted and the observables are merged."""
+    inputs = {
+        "test": {
+            "code": test_network_code,
+            "model": SinglefileData(io.BytesIO(b"model"), filename="model.zip"),
+            "remote_data": RemoteData(remote_path="/data/snapshots", computer=test_network_code.computer),
+            "observables": List(["band_energy"]),
+        },
+        "te_snapshots": List(["s0", "flaky", "s2", "s3", "s4"]),
+        "num_shards": Int(3),
+        "max_concurrent": Int(2),
+        "max_resubmissions": Int(max_resubmissions),
+    }
+    results, node = run_get_node(TestNetworkShardedWorkChain, **inputs)
+
+    called = get_called(node, "shard_")
+    assert {label: node.inputs.te_snapshots.get_list() for label, node in called.items()} == {
+        "shard_0": ["s0", "flaky"],
+        "shard_1": ["s2", "s3"],
+        "shard_2": ["s4"],
+        **({"shard_3": ["flaky"]} if max_resubmissions else {}),
+    }
+    assert [calculation.is_finished_ok for _, calculation in sorted(called.items())] == [False, True, True, True][
+        : len(called)
+    ]
+    if max_resubmissions:
+        assert node.is_finished_ok
+        assert sorted(results["observables"].get_dict()) == ["flaky", "s0", "s2", "s3", "s4"]
+    else:
+        assert node.exit_status == TestNetworkShardedWorkChain.exit_codes.ERROR_INCOMPLETE_SNAPSHOTS.status
+        assert sorted(results["observables"].get_dict()) == ["s0", "s2", "s3", "s4"]
+
+
+@pytest.mark.usefixtures("mock_train_network")
+def test_hyperparameter_optimization(train_network_code, train_network_parameters):
+    """Test that the best trials of a rung are promoted and resume from the checkpoint of their previous rung."""
+    inputs = {
+        "train": {
+            "code": train_network_code,
+            "parameters": train_network_parameters,
+            "remote_data": RemoteData(remote_path="/data/snapshots", computer=train_network_code.computer),
+            "tr_snapshots": List(["Be_snapshot0"]),
+            "va_snapshots": List(["Be_snapshot1"]),
+        },
+        "search_space": Dict({"running": {"learning_rate": {"low": 1e-4, "high": 1e-2}}}),
+        "num_trials": Int(4),
+        "num_rungs": Int(2),
+        "reduction_factor": Int(2),
+        "max_concurrent": Int(3),
+    }
+    results, node = run_get_node(HyperparameterOptimizationWorkChain, **inputs)
+
+    assert node.is_finished_ok
+    called = get_called(node, "trial_")
+    learning_rates = {
+        int(label.split("_")[1]): calculation.inputs.parameters["running"]["learning_rate"]
+        for label, calculation in called.items()
+    }
+    promoted = sorted(learning_rates, key=learning_rates.get)[:2]
+    assert sorted(label for label in called if label.endswith("rung_1")) == [
+        f"trial_{trial}_rung_1" for trial in sorted(promoted)
+    ]
+    for trial in promoted:
+        rung_0, rung_1 = called[f"trial_{trial}_rung_0"], called[f"trial_{trial}_rung_1"]
+        assert rung_0.inputs.parameters["running"]["max_number_epochs"] == 50
+        assert rung_1.inputs.parameters["running"]["max_number_epochs"] == 100
+        assert rung_1.inputs.parent_folder.uuid == rung_0.outputs.remote_folder.uuid
+        assert rung_0.inputs.parameters["running"]["checkpoints_each_epoch"] == 50
+        assert rung_1.inputs.parameters["running"]["checkpoints_each_epoch"] == 50
+
+    assert results["best_parameters"]["running"]["learning_rate"] == min(learning_rates.values())
+    assert len(results["trials"]["trials"]) == 6
+
+
+@pytest.mark.parametrize("failed", (False, True))
+def test_packed(monkeypatch, packed_code, train_network_parameters, failed):
+    """Test that the outputs of every task are returned through a workfunction of the inputs of that task only."""
+
+    def run(self):
+        emit_job_outputs(self)
+        self.out("tasks.small.model", SinglefileData(io.BytesIO(b"model"), filename="model.zip"))
+        self.out("tasks.small.output_parameters", Dict({"final_validation_loss": 0.1}))
+        if not failed:
+            self.out("tasks.check.observables", Dict({"Be_snapshot2": {"band_energy": [1.0, 1.1]}}))
+        self.out("task_summary", Dict({"small": {"exit_status": 0}, "check": {"exit_status": 1 if failed else 0}}))
+        if failed:
+            return self.exit_codes.ERROR_FAILED_TASKS.format(tasks=["check"])
+        return None
+
+    monkeypatch.setattr(PackedCalculation, "run", run)
+    tasks = {
+        "small": {
+            "parameters": train_network_parameters,
+            "tr_snapshots": List(["Be_snapshot0"]),
+            "va_snapshots": List(["Be_snapshot1"]),
+        },
+        "check": {
+            "model": SinglefileData(io.BytesIO(b"model"), filename="model.zip"),
+            "te_snapshots": List(["Be_snapshot2"]),
+            "observables": List(["band_energy"]),
+        },
+    }
+    inputs = {
+        "packed": {
+            "code": packed_code,
+            "remote_data": RemoteData(remote_path="/data/snapshots", computer=packed_code.computer),
+            "tasks": tasks,
+        }
+    }
+    results, node = run_get_node(PackedWorkChain, **inputs)
+
+    (packed,) = get_called(node, "CALL").values()
+    assert results["task_summary"].uuid == packed.outputs.task_summary.uuid
+    functions = {
+        link.link_label: link.node for link in node.base.links.get_outgoing(link_type=LinkType.CALL_WORK).all()
+    }
+    assert sorted(functions) == (["task_small"] if failed else ["task_check", "task_small"])
+    for label, function in functions.items():
+        name = label.removeprefix("task_")
+        outputs = packed.outputs.tasks[name]
+        # The outputs of the task are returned as they are, by a workfunction of the task
+        assert {key: output.uuid for key, output in results["tasks"][name].items()} == {
+            key: output.uuid for key, output in outputs.items()
+        }
+        returned = function.base.links.get_outgoing(link_type=LinkType.RETURN).all()
+        assert {link.node.uuid for link in returned} == {output.uuid for output in outputs.values()}
+        incoming = {link.node.uuid for link in function.base.links.get_incoming(link_type=LinkType.INPUT_WORK).all()}
+        assert incoming == {task.uuid for task in tasks[name].values()} | {output.uuid for output in outputs.values()}
+
+    if failed:
+        assert node.exit_status == PackedWorkChain.exit_codes.ERROR_PACKED_CALCULATION_FAILED.status
+    else:
+        assert node.is_finished_ok
+
+
+@pytest.mark.parametrize("ensemble", (False, True))
+@pytest.mark.parametrize("exit_code", ("ERROR_SCHEDULER_OUT_OF_WALLTIME", "ERROR_SCHEDULER_OUT_OF_MEMORY"))
+def test_train_network_restart(monkeypatch, train_network_code, train_network_parameters, exit_code, ensemble):
+    """Test that a training killed by the scheduler is resumed from the checkpoint in its working directory."""
+
+    def run(self):
+        emit_job_outputs(self)
+        if "parent_folder" not in self.inputs:
+            return getattr(self.exit_codes, exit_code)
+        self.out("model", SinglefileData(io.BytesIO(b"model"), filename="model.zip"))
+        self.out("output_parameters", Dict({"final_validation_loss": 0.1}))
+        return None
+
+    monkeypatch.setattr(TrainNetworkCalculation, "run", run)
+    inputs = {
+        "code": train_network_code,
+        "parameters": train_network_parameters,
+        "remote_data": RemoteData(remote_path="/data/snapshots", computer=train_network_code.computer),
+        "tr_snapshots": List(["Be_snapshot0"]),
+        "va_snapshots": List(["Be_snapshot1"]),
+    }
+    if ensemble:
+        inputs["ensemble_seeds"] = List([7, 11])
+    results, node = run_get_node(TrainNetworkBaseWorkChain, train=inputs)
+
+    assert node.is_finished_ok
+    killed, resumed = sorted(node.called, key=lambda calculation: calculation.ctime)
+    assert killed.exit_status == getattr(TrainNetworkCalculation.exit_codes, exit_code).status
+    assert "parent_folder" not in killed.inputs
+    assert resumed.inputs.parent_folder.uuid == killed.outputs.remote_folder.uuid
+    assert resumed.is_finished_ok
+    assert results["output_parameters"]["final_validation_loss"] == 0.1
+
+
+@pytest.mark.parametrize(
+    ("num_shards", "expected"),
+    (
+        (1, [["s0", "s1", "s2", "s3", "s4"]]),
+        (2, [["s0", "s1", "s2"], ["s3", "s4"]]),
+        (3, [["s0", "s1"], ["s2", "s3"], ["s4"]]),
+        (8, [["s0"], ["s1"], ["s2"], ["s3"], ["s4"]]),
+    ),
+)
+def test_split_into_shards(num_shards, expected):
+    """Test that the snapshots are split into contiguous shards of nearly equal size."""
+    assert split_into_shards([f"s{index}" for index in range(5)], num_shards) == expected
+
+
+def test_merge_observables():
+    """Test that the observables and arrays of the shards are merged."""
+    arrays = ArrayData()
+    arrays.set_array("Be_snapshot2__density", np.arange(8.0).reshape(2, 2, 2))
+
+    merged = merge_observables(
+        observables_0=Dict({"Be_snapshot2": {"band_energy": [1.0, 1.1]}, "Be_snapshot3": {"band_energy": [2.0, 2.1]}}),
+        observable_arrays_0=arrays,
+        observables_1=Dict({"Be_snapshot4": {"band_energy": [3.0, 3.1]}}),
+    )
+
+    assert merged["observables"].get_dict() == {
+        "Be_snapshot2": {"band_energy": [1.0, 1.1]},
+        "Be_snapshot3": {"band_energy": [2.0, 2.1]},
+        "Be_snapshot4": {"band_energy": [3.0, 3.1]},
+    }
+    assert merged["observable_arrays"].get_arraynames() == ["Be_snapshot2__density"]
+    np.testing.assert_array_equal(
+        merged["observable_arrays"].get_array("Be_snapshot2__density"), np.arange(8.0).reshape(2, 2, 2)
+    )
+
+
+def test_sample_trials():
+    """Test that the trials are sampled reproducibly from choices and ranges."""
+    search_space = {
+        "running": {
+            "learning_rate": {"low": 1e-5, "high": 1e-2, "log": True},
+            "mini_batch_size": {"low": 10, "high": 100, "type": "int"},
+            "optimizer": ["Adam", "SGD"],
+        },
+        "network": {"layer_activations": [["ReLU"], ["Sigmoid"]]},
+    }
+    trials = sample_trials(search_space, 20, seed=1)
+
+    assert trials == sample_trials(search_space, 20, seed=1)
+    assert len(trials) == 20
+    for trial in trials:
+        assert 1e-5 <= trial["running"]["learning_rate"] <= 1e-2
+        assert isinstance(trial["running"]["mini_batch_size"], int)
+        assert trial["running"]["optimizer"] in ("Adam", "SGD")
+        assert trial["network"]["layer_activations"] in (["ReLU"], ["Sigmoid"])
+
+
+@pytest.mark.parametrize(
+    ("search_space", "message"),
+    (
+        ({"targets": {"target_type": ["LDOS"]}}, "Invalid search space"),
+        ({"running": {"learning_rate": []}}, "Invalid search space"),
+        ({"running": {"learning_rate": {"low": 1.0, "high": 0.1}}}, "lower bound"),
+        ({"running": {"learning_rate": {"low": 0.0, "high": 0.1, "log": True}}}, "positive"),
+        ({"running": {}}, "at least one dimension"),
+    ),
+)
+def test_validate_search_space(search_space, message):
+    """Test the validation of the search space."""
+    assert message in validate_search_space(Dict(search_space), None)
+
+
+def test_get_rung_epochs():
+    """Test that every rung trains ``reduction_factor`` times longer than the previous one."""
+    assert get_rung_epochs(90, 3, 1) == [90]
+    assert get_rung_epochs(90, 3, 3) == [10, 30, 90]
+    assert get_rung_epochs(4, 3, 3) == [1, 1, 4]
+
+
+def test_collect_trials(train_network_parameters):
+    """Test that the trials are collected into a table ordered by rung and trial."""
+    trials = collect_trials(
+        search_space=Dict({"running": {"learning_rate": [1e-5, 1e-4]}}),
+        parameters_1_0=train_network_parameters,
+        parameters_0_0=train_network_parameters,
+        output_parameters_0_0=Dict({"final_validation_loss": 0.5}),
+    )
+
+    assert trials["trials"] == [
+        {
+            "trial": 0,
+            "rung": 0,
+            "max_number_epochs": 100,
+            "hyperparameters": {"running": {"learning_rate": 0.00001}},
+            "final_validation_loss": 0.5,
+        },
+        {
+            "trial": 1,
+            "rung": 0,
+            "max_number_epochs": 100,
+            "hyperparameters": {"running": {"learning_rate": 0.00001}},
+            "final_validation_loss": None,
+        },
+    ]